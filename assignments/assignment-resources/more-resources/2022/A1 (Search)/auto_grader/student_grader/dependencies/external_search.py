@@ -0,0 +1,322 @@
+'''External memory search routines.
+
+    A) Class ExternalBFS
+
+      Breadth-first search that keeps its layers on disk instead of in
+      memory, for exhaustive searches of state spaces that do not fit in
+      RAM (e.g. counting every reachable state, or proving that no goal
+      can be reached).
+
+      States are stored in files as the bytes returned by
+      StateSpace.pack_state(). Each layer is expanded by reading the
+      previous one from disk. Its successors are collected in memory up
+      to buffer_size at a time and written out as sorted runs. The runs
+      are then merged, and duplicates are removed in one pass against
+      the sorted file of all states seen so far (delayed duplicate
+      detection). Only the buffer and one record per open file are ever
+      held in memory.
+
+      The directory records which layers are complete, so a search that
+      was interrupted (or stopped by its timebound) resumes at the layer
+      it was working on. The file of states seen so far is written anew
+      for each layer (seen-<depth>.dat) and the record names the one
+      matching it, so a search interrupted at any point resumes with
+      the layers and the seen file agreeing. The record also names the
+      goal function (or notes that the state space is being enumerated),
+      so a search is only resumed by a search with the same goal.
+'''
+
+import heapq
+import json
+import os
+import struct
+
+from search import SearchStats
+from parallel_search import _replay_path
+
+# Each record in a file is its length followed by the packed state.
+_LENGTH = struct.Struct('<H')
+
+# Largest number of sorted runs merged at once. If a layer produces more,
+# they are merged in several passes.
+_MAX_MERGE_FANIN = 64
+
+_PROGRESS_FILE = 'progress.json'
+
+
+def _write_records(path, records):
+    '''Write records to path (through a temporary file, so an interrupted
+       write never leaves a partial file under path). Returns the number
+       of records written.'''
+    tmp_path = path + '.tmp'
+    count = 0
+    with open(tmp_path, 'wb') as f:
+        for record in records:
+            f.write(_LENGTH.pack(len(record)))
+            f.write(record)
+            count = count + 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def _read_records(path):
+    '''Yield the records of the file at path, in order'''
+    with open(path, 'rb', buffering=1 << 16) as f:
+        while True:
+            prefix = f.read(_LENGTH.size)
+            if not prefix:
+                return
+            yield f.read(_LENGTH.unpack(prefix)[0])
+
+
+def _unique(records):
+    '''Yield the records of a sorted stream without repeats'''
+    last = None
+    for record in records:
+        if record != last:
+            yield record
+            last = record
+
+
+def _subtract(records, seen):
+    '''Yield the records of the sorted stream records that are not in the
+       sorted stream seen'''
+    seen = iter(seen)
+    other = next(seen, None)
+    for record in records:
+        while other is not None and other < record:
+            other = next(seen, None)
+        if other != record:
+            yield record
+
+
+class ExternalBFS:
+    '''Breadth-first search with its layers in files under directory.
+       Assumes every action has the same cost, so that layer d holds the
+       states at distance d from the initial state.
+
+       Duplicates of a new layer are removed against every earlier layer.
+       For state spaces where every action can be undone (e.g. Rush Hour)
+       locality can be set to 2: then a new layer is only checked against
+       the previous two layers, which is enough and much cheaper.'''
+
+    def __init__(self, directory, buffer_size=1000000, locality=None):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.locality = locality
+        self.trace = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def trace_on(self, level=1):
+        '''For debugging, set tracking level 1 or 2'''
+        self.trace = level
+
+    def trace_off(self):
+        '''Turn off tracing'''
+        self.trace = 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _layer_path(self, depth):
+        return self._path('layer-{}.dat'.format(depth))
+
+    def _save_progress(self):
+        tmp_path = self._path(_PROGRESS_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.progress, f)
+        os.replace(tmp_path, self._path(_PROGRESS_FILE))
+
+    def _load_progress(self, root, goal_mode):
+        '''Load the progress of an earlier search from the same initial
+           state, or start a new one. Raises an Exception if the earlier
+           search had another goal mode (see _goal_mode).'''
+        path = self._path(_PROGRESS_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                progress = json.load(f)
+            if progress['root'] == root.hex():
+                if progress.get('goal_mode') != goal_mode:
+                    raise Exception("{} holds a search for goal {}, not {}; search with restart=True to discard it"
+                                    .format(self.directory, progress.get('goal_mode'), goal_mode))
+                # progress written before seen files were kept per layer
+                progress.setdefault('seen', 'seen.dat')
+                return progress
+        return {'root': root.hex(), 'goal_mode': goal_mode, 'layer_sizes': [], 'generated': 0, 'duplicates': 0,
+                'goal': None, 'complete': False, 'seen': None}
+
+    def _remove_stale_seen(self):
+        '''Remove seen files left behind by an interrupted search other
+           than the one the progress names'''
+        for name in os.listdir(self.directory):
+            if (name == 'seen.dat' or name.startswith('seen-')) and name != self.progress['seen']:
+                os.remove(self._path(name))
+
+    @staticmethod
+    def _goal_mode(goal_fn):
+        '''Name the goal of a search: 'enumerate' if goal_fn is None, else
+           the goal function's module and name'''
+        if goal_fn is None:
+            return 'enumerate'
+        return '{}.{}'.format(getattr(goal_fn, '__module__', None),
+                              getattr(goal_fn, '__qualname__', goal_fn.__class__.__name__))
+
+    def search(self, initState, goal_fn=None, timebound=None, restart=False):
+        """
+        Search from initState, continuing an earlier search of the same
+        initial state in this directory unless restart is true.
+
+        @param initState: the state of the puzzle to start the search from.
+        @param goal_fn: the goal function for the puzzle; if None the whole reachable state space is enumerated.
+        @param timebound: the maximum amount of time, in seconds, to spend on this call.
+        @param restart: if true, discard the progress of any earlier search. Without it, an earlier search
+            of the same initial state with another goal function (or enumerating the state space, when the
+            other has a goal function) raises an Exception rather than being resumed.
+
+        Returns a goal state with its path (False if none was found or the timebound ran out)
+        and a SearchStats object for the whole search so far. The number of states in each layer
+        is in self.layer_sizes.
+        """
+        self.search_start_time = os.times()[0]
+        self.search_stop_time = self.search_start_time + timebound if timebound else None
+        self.init_state = initState
+        root = initState.pack_state()
+        if restart and os.path.exists(self._path(_PROGRESS_FILE)):
+            os.remove(self._path(_PROGRESS_FILE))
+        self.progress = self._load_progress(root, self._goal_mode(goal_fn))
+        self.layer_sizes = self.progress['layer_sizes']
+        self._remove_stale_seen()
+
+        if not self.layer_sizes:
+            _write_records(self._layer_path(0), [root])
+            if self.locality is None:
+                _write_records(self._path('seen-0.dat'), [root])
+                self.progress['seen'] = 'seen-0.dat'
+            self.layer_sizes.append(1)
+            if goal_fn is not None and goal_fn(initState):
+                self.progress['goal'] = [0, root.hex()]
+            self._save_progress()
+
+        while self.progress['goal'] is None and not self.progress['complete']:
+            depth = len(self.layer_sizes)
+            # BEGIN TRACING
+            if self.trace:
+                print("   TRACE: Expanding layer {} ({} states)".format(depth - 1, self.layer_sizes[-1]))
+            # END TRACING
+            if not self._expand_layer(depth, goal_fn):
+                print("TRACE: Search has exceeeded the time bound provided.")
+                return False, self._search_stats()
+
+        goal = self.progress['goal']
+        if goal is None:
+            return False, self._search_stats()
+        return self._trace_back(goal[0], bytes.fromhex(goal[1])), self._search_stats()
+
+    def _search_stats(self):
+        total_search_time = os.times()[0] - self.search_start_time
+        expanded = sum(self.layer_sizes) if self.progress['complete'] else sum(self.layer_sizes[:-1])
+        return SearchStats(expanded, self.progress['generated'], self.progress['duplicates'], 0, total_search_time,
+                           max(self.layer_sizes))
+
+    def _expand_layer(self, depth, goal_fn):
+        '''Build layer depth from layer depth-1. Returns False if the
+           timebound ran out first.'''
+        template = self.init_state
+        runs = []
+        buffer = set()
+        generated = 0
+        for record in _read_records(self._layer_path(depth - 1)):
+            if self.search_stop_time and os.times()[0] > self.search_stop_time:
+                for run in runs:
+                    os.remove(run)
+                return False
+            state = template.unpack_state(record, 'START', depth - 1)
+            for succ in state.successors():
+                buffer.add(succ.pack_state())
+                generated = generated + 1
+            if len(buffer) >= self.buffer_size:
+                runs.append(self._write_run(depth, len(runs), buffer))
+                buffer = set()
+        if buffer or not runs:
+            runs.append(self._write_run(depth, len(runs), buffer))
+        runs = self._merge_runs(depth, runs)
+
+        # remove the states already seen, and check the new ones for goals
+        if self.locality is None:
+            seen = [self._path(self.progress['seen'])]
+        else:
+            seen = [self._layer_path(d) for d in range(max(0, depth - self.locality), depth)]
+        new_states = _subtract(_unique(heapq.merge(*[_read_records(run) for run in runs])),
+                               heapq.merge(*[_read_records(path) for path in seen]))
+        goal = []
+
+        def check_goals(records):
+            for record in records:
+                if not goal and goal_fn is not None and goal_fn(template.unpack_state(record, 'START', depth)):
+                    goal.append(record)
+                yield record
+
+        size = _write_records(self._layer_path(depth), check_goals(new_states))
+        for run in runs:
+            os.remove(run)
+        # the new seen file replaces the old one only once the progress
+        # naming it is saved, so the two always agree
+        old_seen = self.progress['seen']
+        if self.locality is None:
+            new_seen = 'seen-{}.dat'.format(depth)
+            _write_records(self._path(new_seen),
+                           heapq.merge(_read_records(self._path(old_seen)), _read_records(self._layer_path(depth))))
+            self.progress['seen'] = new_seen
+
+        self.layer_sizes.append(size)
+        self.progress['generated'] = self.progress['generated'] + generated
+        self.progress['duplicates'] = self.progress['duplicates'] + generated - size
+        if goal:
+            self.progress['goal'] = [depth, goal[0].hex()]
+        if size == 0:
+            self.layer_sizes.pop()
+            self.progress['complete'] = True
+        self._save_progress()
+        if old_seen is not None and old_seen != self.progress['seen']:
+            os.remove(self._path(old_seen))
+        return True
+
+    def _write_run(self, depth, index, buffer):
+        '''Write the records in buffer to a sorted run file and return its path'''
+        path = self._path('run-{}-{}.dat'.format(depth, index))
+        _write_records(path, sorted(buffer))
+        return path
+
+    def _merge_runs(self, depth, runs):
+        '''Merge runs until there are at most _MAX_MERGE_FANIN of them'''
+        merge_pass = 0
+        while len(runs) > _MAX_MERGE_FANIN:
+            merge_pass = merge_pass + 1
+            merged = []
+            for i in range(0, len(runs), _MAX_MERGE_FANIN):
+                group = runs[i:i + _MAX_MERGE_FANIN]
+                path = self._path('run-{}-p{}-{}.dat'.format(depth, merge_pass, len(merged)))
+                _write_records(path, _unique(heapq.merge(*[_read_records(run) for run in group])))
+                for run in group:
+                    os.remove(run)
+                merged.append(path)
+            runs = merged
+        return runs
+
+    def _trace_back(self, depth, record):
+        '''Rebuild the path to the state packed as record in layer depth,
+           by finding a parent for it in each earlier layer in turn'''
+        template = self.init_state
+        actions = []
+        for d in range(depth - 1, -1, -1):
+            for parent_record in _read_records(self._layer_path(d)):
+                parent = template.unpack_state(parent_record, 'START', d)
+                action = next((succ.action for succ in parent.successors() if succ.pack_state() == record), None)
+                if action is not None:
+                    actions.append(action)
+                    record = parent_record
+                    break
+            else:
+                raise Exception("Could not rebuild path: no parent in layer {}".format(d))
+        actions.reverse()
+        return _replay_path(template, actions)
@@ -0,0 +1,426 @@
+'''Parallel search routines.
+
+    A) Class HDAStarEngine
+
+      Hash distributed A* (HDA*) over several processes. Every state is
+      owned by one worker process, chosen by hashing its
+      hashable_state(). Each worker keeps the OPEN set and the best
+      g-values of the states it owns, expands its own nodes, and sends
+      each successor to its owner's inbox. Successors are sent in batches
+      to keep the cost of interprocess communication down.
+
+      A successor is sent without its path: only its parent's owner, the
+      parent's number among the nodes that worker has taken up, and the
+      action. Each worker keeps that (owner, number, action) row for each
+      node it takes up, so a message costs the same at any depth. When
+      the search is over the main process rebuilds the solution's path by
+      asking the owner of each node on it for its row in turn.
+
+      A worker that expands a goal reports it to the main process, which
+      records the cheapest one as the incumbent. Workers discard nodes
+      whose f-value is not below the incumbent's cost. The search ends
+      when every worker is idle and no batch is still in transit. At that
+      point no node that could lead to a cheaper solution is left, so
+      with an admissible heuristic the solution has the same (optimal)
+      cost as the 'astar' strategy of SearchEngine.
+
+      Each worker is a separate process with its own copies of the
+      StateSpace and sNode counters, so they do not interfere. If a
+      worker fails (goal_fn or heur_fn raises, or the process dies), the
+      search is stopped and search raises an Exception with the worker's
+      traceback.
+'''
+
+import heapq
+import multiprocessing
+import os
+import queue
+import traceback
+
+from search import sNode, StateSpace, SearchStats, _zero_hfn
+
+# Default number of successors a worker collects for one destination
+# before sending them as a batch. Batches are also sent whenever the
+# worker runs out of nodes to expand, and every _FLUSH_INTERVAL expansions.
+_BATCH_SIZE = 64
+_FLUSH_INTERVAL = 256
+
+# Seconds a process waits on an empty queue before checking whether the
+# search has stopped.
+_POLL_INTERVAL = 0.01
+
+
+def _default_partition(key, num_workers):
+    '''Return the worker owning the state with hashable_state() key'''
+    return hash(key) % num_workers
+
+
+def _process_context():
+    '''Return the multiprocessing context to start workers with: 'fork'
+       where available, so that functions given to the workers (goal_fn,
+       heur_fn) are inherited rather than pickled'''
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _path_actions(state):
+    '''Return the tuple of actions leading from the initial state to state'''
+    actions = []
+    while state.parent:
+        actions.append(state.action)
+        state = state.parent
+    actions.reverse()
+    return tuple(actions)
+
+
+def _replay_path(init_state, actions):
+    '''Regenerate the state reached by applying actions to init_state,
+       with its full parent chain'''
+    state = init_state
+    for action in actions:
+        for succ in state.successors():
+            if succ.action == action:
+                state = succ
+                break
+        else:
+            raise Exception("Could not rebuild path: action {} not applicable".format(action))
+    return state
+
+
+class _Shared:
+    '''State shared by the main process and the workers. counters[0] is
+       the number of idle workers and counters[1] the number of successors
+       sent but not yet taken up by their owner; both are only changed
+       while holding lock. incumbent[0] is the cost of the cheapest goal
+       found so far.'''
+
+    def __init__(self, context, num_workers):
+        self.lock = context.Lock()
+        self.counters = context.RawArray('q', [num_workers, 0])
+        self.incumbent = context.RawArray('d', [float('inf')])
+        self.stop = context.Event()
+
+
+def _worker(index, num_workers, inboxes, requests, results, shared, goal_fn, heur_fn, costbound, partition,
+            batch_size):
+    '''Run worker index, then report to the main process: its statistics,
+       or if it failed, ('error', index, traceback text). After reporting
+       its statistics the worker answers the main process's requests for
+       the rows of its nodes (see _answer_requests).'''
+    parents = None
+    try:
+        message, parents = _search_worker(index, num_workers, inboxes, results, shared, goal_fn, heur_fn,
+                                          costbound, partition, batch_size)
+    except BaseException:
+        message = ('error', index, traceback.format_exc())
+    # don't wait for batches sent to other workers to be taken up when the
+    # search stops early
+    for other in inboxes:
+        other.cancel_join_thread()
+    results.put(message)
+    if parents is not None:
+        _answer_requests(requests, results, parents)
+
+
+def _answer_requests(requests, results, parents):
+    '''Answer the main process's requests until None arrives: a node
+       number is answered with ('parent', row of that node in parents).
+       The requests have a queue of their own, which only the main process
+       writes to, so a worker that died while sending a batch cannot block
+       them.'''
+    while True:
+        number = requests.get()
+        if number is None:
+            return
+        results.put(('parent', parents[number]))
+
+
+def _search_worker(index, num_workers, inboxes, results, shared, goal_fn, heur_fn, costbound, partition,
+                   batch_size):
+    '''Main loop of worker index. States arrive in the worker's inbox as
+       batches of (gval, state, parent owner, parent number, action)
+       tuples, where state has no parent (the initial state has None for
+       the last three). Each state taken up is numbered by its row in
+       parents, which holds its (parent owner, parent number, action).
+       Returns the worker's statistics message and parents once the
+       search has stopped.'''
+    sNode.n = 0
+    StateSpace.n = 0
+    cycle_check_pruned = 0
+    cost_bound_pruned = 0
+    max_open_size = 0
+
+    open_list = []
+    parents = []
+    gvals = dict()
+    outboxes = [[] for i in range(num_workers)]
+    inbox = inboxes[index]
+    lock = shared.lock
+    counters = shared.counters
+    incumbent = shared.incumbent
+    idle = True
+
+    def send(dest):
+        batch = outboxes[dest]
+        outboxes[dest] = []
+        with lock:
+            counters[1] = counters[1] + len(batch)
+        inboxes[dest].put(batch)
+
+    def flush():
+        for dest in range(num_workers):
+            if outboxes[dest]:
+                send(dest)
+
+    def receive(batch):
+        nonlocal cycle_check_pruned, cost_bound_pruned
+        for gval, state, parent_owner, parent_number, action in batch:
+            hash_state = state.hashable_state()
+            if hash_state in gvals and gval >= gvals[hash_state]:
+                cycle_check_pruned = cycle_check_pruned + 1
+                continue
+            hval = heur_fn(state)
+            if costbound is not None and (gval > costbound[0] or
+                                          hval > costbound[1] or
+                                          gval + hval > costbound[2]):
+                cost_bound_pruned = cost_bound_pruned + 1
+                continue
+            gvals[hash_state] = gval
+            node = sNode(state, hval, None, hash_state)
+            # the node's number also breaks the remaining ties, oldest first
+            number = len(parents)
+            parents.append((parent_owner, parent_number, action))
+            heapq.heappush(open_list, (gval + hval, -gval, number, node))
+
+    while not shared.stop.is_set():
+        # take up all batches waiting in the inbox; block only if there is
+        # nothing else to do
+        while True:
+            try:
+                if open_list:
+                    batch = inbox.get_nowait()
+                else:
+                    batch = inbox.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                break
+            with lock:
+                if idle:
+                    idle = False
+                    counters[0] = counters[0] - 1
+                counters[1] = counters[1] - len(batch)
+            receive(batch)
+            if len(open_list) > max_open_size:
+                max_open_size = len(open_list)
+        if shared.stop.is_set():
+            break
+
+        if not open_list:
+            flush()
+            if not idle:
+                with lock:
+                    idle = True
+                    counters[0] = counters[0] + 1
+            continue
+
+        # expand up to _FLUSH_INTERVAL nodes before looking at the inbox again
+        for i in range(_FLUSH_INTERVAL):
+            if not open_list:
+                break
+            fval, neg_gval, number, node = heapq.heappop(open_list)
+            if gvals[node.key] < node.gval:
+                # a cheaper path to this state was found after node was queued
+                continue
+            if fval >= incumbent[0]:
+                cost_bound_pruned = cost_bound_pruned + 1
+                continue
+            if goal_fn(node.state):
+                with lock:
+                    if node.gval < incumbent[0]:
+                        incumbent[0] = node.gval
+                results.put(('goal', node.gval, index, number))
+                continue
+
+            for succ in node.state.successors():
+                succ.parent = None
+                dest = partition(succ.hashable_state(), num_workers)
+                outboxes[dest].append((succ.gval, succ, index, number, succ.action))
+                if len(outboxes[dest]) >= batch_size:
+                    send(dest)
+        flush()
+
+    return ('stats', index, sNode.n, StateSpace.n, cycle_check_pruned, cost_bound_pruned, max_open_size), parents
+
+
+class HDAStarEngine:
+    '''Hash distributed A* over num_workers processes (default: one per
+       CPU). Used like a SearchEngine running 'astar' with full cycle
+       checking: call init_search, then search.
+
+       Worker processes are started with the 'fork' method where it is
+       available, so goal_fn and heur_fn need not be picklable. The states
+       themselves are pickled when they are sent to their owner.
+
+       States are assigned to workers by partition(key, num_workers),
+       where key is the state's hashable_state(). The default hashes the
+       key; under a start method other than 'fork' keys whose hash differs
+       between processes (such as strings, unless PYTHONHASHSEED is set)
+       need a partition function of their own.'''
+
+    def __init__(self, num_workers=None, partition=_default_partition, batch_size=_BATCH_SIZE):
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        self.num_workers = num_workers
+        self.partition = partition
+        self.batch_size = batch_size
+        self.trace = 0
+
+    def trace_on(self, level=1):
+        '''For debugging, set tracking level 1 or 2'''
+        self.trace = level
+
+    def trace_off(self):
+        '''Turn off tracing'''
+        self.trace = 0
+
+    def get_strategy(self):
+        return 'hda_star with full cycle checking using {} workers'.format(self.num_workers)
+
+    def init_search(self, initState, goal_fn, heur_fn=_zero_hfn, fval_function=None):
+        """
+        Get ready to search. Call search on this object to run the search.
+
+        @param initState: the state of the puzzle to start the search from.
+        @param goal_fn: the goal function for the puzzle
+        @param heur_fn: the heuristic function to use
+        @param fval_function: ignored, the workers always order their OPEN sets on f = g + h
+        """
+        # BEGIN TRACING
+        if self.trace:
+            print("   TRACE: Search Strategy: ", self.get_strategy())
+            print("   TRACE: Initial State:", end="")
+            initState.print_state()
+        # END
+        self.init_state = initState
+        self.goal_fn = goal_fn
+        self.heur_fn = heur_fn
+
+    def search(self, timebound=None, costbound=None):
+        """
+        Start searching, using the parameters set by init_search.
+
+        @param timebound: the maximum amount of wall clock time, in seconds, to spend on this search.
+        @param costbound: the cost bound 3-tuple for pruning, as specified in the assignment.
+
+        Returns the cheapest goal state found, with its path, and a SearchStats object summed
+        over the workers (peak open size is the sum of the workers' peaks), or False and the
+        SearchStats if no solution was found. Raises an Exception if a worker fails.
+        """
+        context = _process_context()
+        start_time = os.times()[4]
+        stop_time = start_time + timebound if timebound else None
+        num_workers = self.num_workers
+        shared = _Shared(context, num_workers)
+        inboxes = [context.Queue() for i in range(num_workers)]
+        requests = [context.Queue() for i in range(num_workers)]
+        results = context.Queue()
+
+        workers = [context.Process(target=_worker,
+                                   args=(i, num_workers, inboxes, requests[i], results, shared, self.goal_fn,
+                                         self.heur_fn, costbound, self.partition, self.batch_size),
+                                   daemon=True)
+                   for i in range(num_workers)]
+        for worker in workers:
+            worker.start()
+
+        # hand the initial state to its owner
+        root = self.init_state
+        with shared.lock:
+            shared.counters[1] = 1
+        inboxes[self.partition(root.hashable_state(), num_workers)].put([(root.gval, root, None, None, None)])
+
+        best = None
+        timed_out = False
+        stats = []
+        errors = []
+        reported = set()
+        # workers found to have exited without reporting, given one more
+        # poll for their last message to arrive
+        exited = set()
+        while len(reported) < num_workers:
+            try:
+                message = results.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                message = None
+            if message is not None:
+                if message[0] == 'goal':
+                    if best is None or message[1] < best[1]:
+                        best = message
+                        # BEGIN TRACING
+                        if self.trace:
+                            print("   TRACE: New incumbent solution, cost={}".format(best[1]))
+                        # END TRACING
+                    continue
+                reported.add(message[1])
+                if message[0] == 'error':
+                    errors.append(message)
+                    shared.stop.set()
+                else:
+                    stats.append(message)
+                continue
+            for i, worker in enumerate(workers):
+                if i not in reported and worker.exitcode is not None:
+                    if i in exited:
+                        reported.add(i)
+                        errors.append(('error', i, 'exited with code {}\n'.format(worker.exitcode)))
+                        shared.stop.set()
+                    else:
+                        exited.add(i)
+            if shared.stop.is_set():
+                continue
+            with shared.lock:
+                finished = shared.counters[0] == num_workers and shared.counters[1] == 0
+            if not finished and stop_time is not None and os.times()[4] > stop_time:
+                print("TRACE: Search has exceeeded the time bound provided.")
+                timed_out = True
+                finished = True
+            if finished:
+                shared.stop.set()
+
+        actions = None
+        if best is not None and not timed_out and not errors:
+            actions = self._path_actions(best[2], best[3], workers, requests, results)
+        for request_queue in requests:
+            request_queue.put(None)
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise Exception("HDA* worker {} failed: {}".format(errors[0][1], errors[0][2]))
+
+        search_stats = SearchStats(sum(s[2] for s in stats), sum(s[3] for s in stats) + 1, sum(s[4] for s in stats),
+                                   sum(s[5] for s in stats), os.times()[4] - start_time, sum(s[6] for s in stats))
+        if actions is None:
+            # a solution found before the timebound ran out is not known to be optimal
+            return False, search_stats
+        return _replay_path(self.init_state, actions), search_stats
+
+    def _path_actions(self, owner, number, workers, requests, results):
+        '''Return the tuple of actions leading to node number of worker
+           owner, asking the owner of each node on the path for its row'''
+        actions = []
+        while True:
+            requests[owner].put(number)
+            while True:
+                try:
+                    message = results.get(timeout=_POLL_INTERVAL)
+                    break
+                except queue.Empty:
+                    if workers[owner].exitcode is not None:
+                        raise Exception("HDA* worker {} exited with code {}".format(owner,
+                                                                                  workers[owner].exitcode))
+            owner, number, action = message[1]
+            if owner is None:
+                break
+            actions.append(action)
+        actions.reverse()
+        return tuple(actions)
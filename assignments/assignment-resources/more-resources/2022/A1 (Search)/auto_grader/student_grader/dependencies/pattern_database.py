@@ -0,0 +1,327 @@
+'''Pattern database routines.
+
+    A) Class Abstraction
+
+      An abstract base class for abstractions of a state space. An
+      abstraction maps each problem state onto a smaller abstract state
+      (e.g. the positions of only some of the boxes in Sokoban), numbered
+      0 .. size()-1. The distance from an abstract state to the nearest
+      abstract goal is a lower bound on the distance from any state that
+      maps onto it, so it can be used as an admissible heuristic.
+
+    B) Pattern databases
+
+      build_pdb runs a breadth-first search backwards from the abstract
+      goals and writes the distance of every abstract state to a file,
+      one byte per state. PatternDatabase reads such a file through mmap,
+      so many processes (e.g. parallel autograder workers) share a single
+      copy of the table in memory, and can be called like any other
+      heur_fn. AdditivePDB and MaxPDB combine several of them.
+
+    C) Class SokobanBoxAbstraction
+
+      An abstraction of SokobanState keeping only some of the boxes and
+      ignoring the robots.
+'''
+
+import copy
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections import deque
+
+# File layout: magic, length of the JSON header, the header, then one
+# byte per abstract state.
+_MAGIC = b'PDB1'
+_PREFIX = struct.Struct('<4sI')
+
+# Distances are stored in one byte; _UNREACHABLE marks abstract states
+# from which no abstract goal can be reached.
+_UNREACHABLE = 255
+_MAX_DISTANCE = 254
+
+
+class Abstraction:
+    '''Abstract class for defining abstractions for pattern databases.
+       Abstract states are identified by their rank, an integer in
+       0 .. size()-1, so that distances can be stored in a flat table.
+       Abstract actions are assumed to have unit cost.'''
+
+    def signature(self):
+        '''Return a string that identifies the abstract space, e.g. the
+           level and the pattern. It is stored in the database file and
+           checked when the file is opened, and abstractions with equal
+           signatures can share one database.'''
+        raise Exception("Must be overridden in subclass.")
+
+    def size(self):
+        '''Return the number of abstract states'''
+        raise Exception("Must be overridden in subclass.")
+
+    def abstract(self, state):
+        '''Return the rank of the abstract state that state maps onto'''
+        raise Exception("Must be overridden in subclass.")
+
+    def goal_ranks(self):
+        '''Return an iterable over the ranks of the abstract goal states'''
+        raise Exception("Must be overridden in subclass.")
+
+    def predecessors(self, rank):
+        '''Return an iterable over the ranks of the abstract states from
+           which the abstract state rank can be reached in one action'''
+        raise Exception("Must be overridden in subclass.")
+
+
+def build_pdb(abstraction, path):
+    '''Compute the distance of every abstract state to the nearest abstract
+       goal with a breadth-first search backwards from the goals, and write
+       the table to path. Distances over _MAX_DISTANCE are capped. The file
+       is written under a temporary name and moved into place, so other
+       processes never see a partly written database.'''
+    size = abstraction.size()
+    distances = bytearray([_UNREACHABLE]) * size
+    queue = deque()
+    for rank in abstraction.goal_ranks():
+        if distances[rank] == _UNREACHABLE:
+            distances[rank] = 0
+            queue.append(rank)
+
+    while queue:
+        rank = queue.popleft()
+        pred_distance = min(distances[rank] + 1, _MAX_DISTANCE)
+        for pred in abstraction.predecessors(rank):
+            if distances[pred] == _UNREACHABLE:
+                distances[pred] = pred_distance
+                queue.append(pred)
+
+    header = json.dumps({'signature': abstraction.signature(), 'size': size}).encode('utf-8')
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREFIX.pack(_MAGIC, len(header)))
+        f.write(header)
+        f.write(distances)
+    os.replace(tmp_path, path)
+
+
+class PatternDatabase:
+    '''A pattern database file opened through mmap, used as a heuristic:
+       calling it on a state returns the stored distance of the state's
+       abstract state. The table is mapped read-only, so processes that
+       open the same file share its pages.'''
+
+    def __init__(self, abstraction, path, unreachable=float('inf')):
+        '''
+        @param abstraction: the Abstraction the database was built for.
+        @param path: the database file written by build_pdb.
+        @param unreachable: the value returned for abstract states from which no goal can be reached.
+        '''
+        self.abstraction = abstraction
+        self.unreachable = unreachable
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _PREFIX.unpack_from(self.data, 0)
+        if magic != _MAGIC:
+            raise Exception("{} is not a pattern database file".format(path))
+        header = json.loads(self.data[_PREFIX.size:_PREFIX.size + header_length].decode('utf-8'))
+        if header['signature'] != abstraction.signature() or header['size'] != abstraction.size():
+            raise Exception("Pattern database {} was built for a different abstraction".format(path))
+        self.offset = _PREFIX.size + header_length
+
+    def __call__(self, state):
+        return self.distance(self.abstraction.abstract(state))
+
+    def distance(self, rank):
+        '''Return the stored distance of the abstract state rank'''
+        d = self.data[self.offset + rank]
+        if d == _UNREACHABLE:
+            return self.unreachable
+        return d
+
+    def for_abstraction(self, abstraction):
+        '''Return a PatternDatabase reading the same mapped table through
+           another abstraction with the same signature'''
+        if abstraction.signature() != self.abstraction.signature():
+            raise Exception("Abstraction does not match the pattern database")
+        view = copy.copy(self)
+        view.abstraction = abstraction
+        return view
+
+    def close(self):
+        self.data.close()
+
+
+def load_pdb(abstraction, path, unreachable=float('inf')):
+    '''Open the pattern database at path, building it first if the file
+       does not exist yet'''
+    if not os.path.exists(path):
+        build_pdb(abstraction, path)
+    return PatternDatabase(abstraction, path, unreachable)
+
+
+class AdditivePDB:
+    '''Heuristic summing several pattern databases. It is admissible if
+       no action is counted by more than one of the abstractions (e.g.
+       Sokoban abstractions over disjoint groups of boxes, where each
+       push moves a box of only one group).'''
+
+    def __init__(self, pdbs):
+        self.pdbs = list(pdbs)
+
+    def __call__(self, state):
+        return sum(pdb(state) for pdb in self.pdbs)
+
+
+class MaxPDB:
+    '''Heuristic taking the maximum of several heuristics (pattern
+       databases or AdditivePDBs). Admissible if each of them is.'''
+
+    def __init__(self, pdbs):
+        self.pdbs = list(pdbs)
+
+    def __call__(self, state):
+        return max(pdb(state) for pdb in self.pdbs)
+
+
+def _binomial_table(n, k):
+    '''Return table with table[i][j] == C(i, j) for i <= n, j <= k'''
+    table = [[0] * (k + 1) for i in range(n + 1)]
+    for i in range(n + 1):
+        table[i][0] = 1
+        for j in range(1, min(i, k) + 1):
+            table[i][j] = table[i - 1][j - 1] + table[i - 1][j]
+    return table
+
+
+class SokobanBoxAbstraction(Abstraction):
+    '''Abstraction of a Sokoban level keeping the positions of a group of
+       boxes and dropping the robots and the other boxes. An abstract
+       action pushes one box of the group one square, which requires the
+       square behind the box to be free of obstacles and of the group's
+       other boxes (the robot could stand there). Every push costs at
+       least one move, so the distances are admissible for the move count.
+
+       Boxes are identical, so a group is given as positions in the
+       sorted list of a state's boxes: group (0, 1) abstracts a state
+       to its two smallest box positions. Groups of the same size share
+       the same database. Disjoint groups can be summed (AdditivePDB).
+
+       Abstract states are the sets of len(group) free squares, ranked
+       with the combinatorial number system.'''
+
+    def __init__(self, width, height, obstacles, storage, group):
+        '''
+        @param width: The room's X dimension (excluding walls).
+        @param height: The room's Y dimension (excluding walls).
+        @param obstacles: A frozenset of all the impassable obstacles.
+        @param storage: A frozenset of all the storage points.
+        @param group: The positions, in a state's sorted list of boxes, of the boxes kept by the abstraction.
+        '''
+        self.width = width
+        self.height = height
+        self.obstacles = frozenset(obstacles)
+        self.storage = frozenset(storage)
+        self.group = tuple(group)
+        self.k = len(self.group)
+        self.cells = [(x, y) for y in range(height) for x in range(width) if (x, y) not in self.obstacles]
+        self.cell_index = dict((cell, i) for i, cell in enumerate(self.cells))
+        self.binomial = _binomial_table(len(self.cells), self.k)
+
+    @classmethod
+    def for_state(cls, state, group):
+        '''Return the abstraction of state's level keeping the given group of boxes'''
+        return cls(state.width, state.height, state.obstacles, state.storage, group)
+
+    def signature(self):
+        return json.dumps(['sokoban-boxes', self.width, self.height, sorted(self.obstacles), sorted(self.storage),
+                           self.k])
+
+    def size(self):
+        return self.binomial[len(self.cells)][self.k]
+
+    def rank(self, indices):
+        '''Rank a sorted tuple of distinct cell indices'''
+        r = 0
+        for j, c in enumerate(indices):
+            r = r + self.binomial[c][j + 1]
+        return r
+
+    def unrank(self, r):
+        '''Return the sorted tuple of cell indices with rank r'''
+        indices = []
+        c = len(self.cells)
+        for j in range(self.k, 0, -1):
+            c = c - 1
+            while self.binomial[c][j] > r:
+                c = c - 1
+            indices.append(c)
+            r = r - self.binomial[c][j]
+        indices.reverse()
+        return tuple(indices)
+
+    def abstract(self, state):
+        boxes = sorted(state.boxes)
+        return self.rank(tuple(sorted(self.cell_index[boxes[i]] for i in self.group)))
+
+    def goal_ranks(self):
+        goal_cells = sorted(self.cell_index[s] for s in self.storage if s in self.cell_index)
+        indices = list(range(self.k))
+        if self.k > len(goal_cells):
+            return
+        # all k-subsets of the storage cells
+        while True:
+            yield self.rank(tuple(goal_cells[i] for i in indices))
+            j = self.k - 1
+            while j >= 0 and indices[j] == len(goal_cells) - self.k + j:
+                j = j - 1
+            if j < 0:
+                return
+            indices[j] = indices[j] + 1
+            for i in range(j + 1, self.k):
+                indices[i] = indices[i - 1] + 1
+
+    def _free(self, cell, boxes):
+        return (0 <= cell[0] < self.width and 0 <= cell[1] < self.height and
+                cell not in self.obstacles and cell not in boxes)
+
+    def predecessors(self, rank):
+        boxes = [self.cells[i] for i in self.unrank(rank)]
+        box_set = frozenset(boxes)
+        for box in boxes:
+            for dx, dy in ((0, -1), (1, 0), (0, 1), (-1, 0)):
+                # the box was pushed in direction (dx, dy) from prev by a
+                # robot standing at robot
+                prev = (box[0] - dx, box[1] - dy)
+                robot = (prev[0] - dx, prev[1] - dy)
+                if self._free(prev, box_set) and self._free(robot, box_set):
+                    indices = [self.cell_index[b] for b in boxes if b != box]
+                    indices.append(self.cell_index[prev])
+                    yield self.rank(tuple(sorted(indices)))
+
+
+def sokoban_pdb_heuristic(state, group_size, directory, combine='additive'):
+    '''Return a heuristic for the level of state made from pattern
+       databases over groups of group_size boxes, building the database
+       under directory if needed. With combine='additive' the sorted boxes
+       are split into consecutive groups and their distances summed; with
+       combine='max' the heuristic is the largest single-group distance
+       over all of those groups.'''
+    nboxes = len(state.boxes)
+    groups = [tuple(range(i, min(i + group_size, nboxes))) for i in range(0, nboxes, group_size)]
+    pdbs = []
+    databases = dict()
+    for group in groups:
+        abstraction = SokobanBoxAbstraction.for_state(state, group)
+        if not len(group) in databases:
+            # name the file after the abstract space so that every process
+            # (and every later run) finds the same database
+            digest = hashlib.sha1(abstraction.signature().encode('utf-8')).hexdigest()[:16]
+            name = 'sokoban-{}-{}.pdb'.format(digest, len(group))
+            databases[len(group)] = load_pdb(abstraction, os.path.join(directory, name))
+            pdbs.append(databases[len(group)])
+        else:
+            pdbs.append(databases[len(group)].for_abstraction(abstraction))
+    if combine == 'max':
+        return MaxPDB(pdbs)
+    return AdditivePDB(pdbs)
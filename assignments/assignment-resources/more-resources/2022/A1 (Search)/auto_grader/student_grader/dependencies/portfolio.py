@@ -0,0 +1,197 @@
+'''Portfolio search routines.
+
+    A) Class PortfolioConfig
+
+      One search configuration: the SearchEngine strategy and cycle check
+      level, and the heuristic and f-value functions to give init_search.
+
+    B) portfolio_search
+
+      Runs several PortfolioConfigs on the same initial state at once, in
+      a pool of worker processes, instead of giving each a slice of the
+      timebound in turn. The cost of the cheapest solution found so far is
+      shared between the processes and used as the f-value cost bound of
+      every search still running, so the other configurations prune any
+      node that cannot lead to a cheaper solution. The best solution found
+      when all configurations are done, or when the (wall clock) timebound
+      runs out, is returned along with the SearchStats of every
+      configuration.
+
+      Processes share the CPUs, so a search's own timebound (CPU time)
+      says little about the wall clock. Each configuration is therefore
+      run in steps of _STEP_EXPANSIONS expansions, checking the wall clock
+      in between, and stops _STOP_MARGIN seconds before the timebound
+      runs out so it can still report its SearchStats.
+'''
+
+import multiprocessing
+import time
+
+from search import SearchEngine, _zero_hfn, _fval_function
+from parallel_search import _process_context, _path_actions, _replay_path
+
+# Expansions a configuration runs between looks at the wall clock
+_STEP_EXPANSIONS = 200
+
+# Seconds before the portfolio's deadline at which configurations stop,
+# and seconds past it that their results are still waited for
+_STOP_MARGIN = 0.25
+_GRACE_PERIOD = 0.5
+
+
+class PortfolioConfig:
+    '''A search configuration for portfolio_search. setup, if given, is
+       called with the SearchEngine before init_search, e.g. to set a tie
+       breaking policy or lazy mode.'''
+
+    def __init__(self, strategy, heur_fn=_zero_hfn, fval_function=_fval_function, cc_level='default', name=None,
+                 setup=None):
+        self.strategy = strategy
+        self.heur_fn = heur_fn
+        self.fval_function = fval_function
+        self.cc_level = cc_level
+        self.name = name if name is not None else strategy
+        self.setup = setup
+
+
+class PortfolioResult:
+    '''Outcome of one configuration of a portfolio: the cost of the
+       solution it found (None if it found none), and its SearchStats (None
+       if it had not started when the timebound ran out, or could not stop
+       in time).'''
+
+    def __init__(self, name, cost, stats):
+        self.name = name
+        self.cost = cost
+        self.stats = stats
+
+    def __str__(self):
+        if self.stats is None:
+            return f'{self.name}: did not finish\n'
+        return f'{self.name}: solution cost: {self.cost}\n{self.stats}'
+
+
+class SharedCostBound:
+    '''A cost bound 3-tuple (see SearchEngine.search) whose f-value bound
+       follows the best solution cost found by any process of the
+       portfolio. Indexing it reads the shared value, so a running search
+       sees each new bound at its next cost check.'''
+
+    def __init__(self, best, costbound=None, min_improvement=0):
+        '''
+        @param best: a shared double holding the cost of the best solution found so far.
+        @param costbound: the cost bound 3-tuple to apply on top of the shared one.
+        @param min_improvement: prune nodes with g + h > best - min_improvement (1 for integer costs prunes all
+            nodes that cannot lead to a strictly cheaper solution).
+        '''
+        self.best = best
+        self.costbound = costbound if costbound is not None else (float('inf'), float('inf'), float('inf'))
+        self.min_improvement = min_improvement
+
+    def __getitem__(self, i):
+        if i == 2:
+            return min(self.costbound[2], self.best.value - self.min_improvement)
+        return self.costbound[i]
+
+    def __repr__(self):
+        return repr((self[0], self[1], self[2]))
+
+
+# Per process portfolio, set by _init_worker when the pool starts
+_worker_portfolio = None
+
+
+def _init_worker(configs, init_state, goal_fn, costbound):
+    global _worker_portfolio
+    _worker_portfolio = (configs, init_state, goal_fn, costbound)
+
+
+def _run_config(index, deadline):
+    '''Run configuration index until it finds a solution, fails, or comes
+       within _STOP_MARGIN seconds of the (wall clock) deadline. Returns
+       (index, cost, actions, stats).'''
+    configs, init_state, goal_fn, costbound = _worker_portfolio
+    config = configs[index]
+    stop_time = deadline - _STOP_MARGIN
+    if time.time() >= stop_time:
+        return index, None, None, None
+
+    se = SearchEngine(config.strategy, config.cc_level)
+    if config.setup is not None:
+        config.setup(se)
+    se.init_search(init_state, goal_fn, config.heur_fn, config.fval_function)
+    if config.strategy == 'arastar':
+        # step cannot drive ARA*; its CPU timebound can only run out later
+        # than the wall clock, so results may be lost to the deadline
+        final, stats = se.search(stop_time - time.time(), costbound)
+    else:
+        # each step reports the time of that step only
+        search_time = 0
+        while True:
+            final, stats = se.step(_STEP_EXPANSIONS, costbound)
+            search_time = search_time + stats.total_time
+            if final is not None or time.time() >= stop_time:
+                break
+        stats.total_time = search_time
+    if not final:
+        return index, None, None, stats
+
+    best = costbound.best
+    with best.get_lock():
+        if final.gval < best.value:
+            best.value = final.gval
+    return index, final.gval, _path_actions(final), stats
+
+
+def portfolio_search(initState, goal_fn, configs, timebound, costbound=None, num_workers=None, min_improvement=0):
+    """
+    Race several search configurations on initState.
+
+    @param initState: the state of the puzzle to start the search from.
+    @param goal_fn: the goal function for the puzzle
+    @param configs: the PortfolioConfigs to run.
+    @param timebound: the wall clock time, in seconds, to spend on the whole portfolio.
+    @param costbound: the cost bound 3-tuple for pruning, applied to every configuration.
+    @param num_workers: the number of processes (default: one per configuration, at most one per CPU).
+    @param min_improvement: see SharedCostBound.
+
+    Configurations are started in order; if there are more of them than
+    processes, later ones start as earlier ones finish, with the time that
+    is left. A configuration still running when the timebound runs out
+    stops and reports the SearchStats of the search so far. Returns the cheapest goal state found (False if none) and a
+    list of PortfolioResults, one per configuration in the order given.
+    """
+    configs = list(configs)
+    if num_workers is None:
+        num_workers = min(len(configs), multiprocessing.cpu_count())
+
+    context = _process_context()
+    deadline = time.time() + timebound
+    shared_bound = SharedCostBound(context.Value('d', float('inf')), costbound, min_improvement)
+    pool = context.Pool(num_workers, initializer=_init_worker, initargs=(configs, initState, goal_fn, shared_bound))
+    try:
+        pending = [pool.apply_async(_run_config, (i, deadline)) for i in range(len(configs))]
+        outcomes = []
+        for result in pending:
+            try:
+                outcomes.append(result.get(max(0, deadline + _GRACE_PERIOD - time.time())))
+            except multiprocessing.TimeoutError:
+                outcomes.append(None)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    best = None
+    results = []
+    for config, outcome in zip(configs, outcomes):
+        if outcome is None:
+            results.append(PortfolioResult(config.name, None, None))
+            continue
+        index, cost, actions, stats = outcome
+        results.append(PortfolioResult(config.name, cost, stats))
+        if cost is not None and (best is None or cost < best[0]):
+            best = (cost, actions)
+
+    if best is None:
+        return False, results
+    return _replay_path(initState, best[1]), results
@@ -0,0 +1,107 @@
+'''Search scheduling routines.
+
+    A) Class SearchTask
+
+      One search to run: a SearchEngine on which init_search has been
+      called, with the time it may take and its cost bound.
+
+    B) run_searches
+
+      Runs many SearchTasks in one thread by taking turns: each task in
+      turn runs one SearchEngine.step of slice_expansions iterations,
+      round robin, until every task has found a goal, exhausted its
+      search space or used up its timebound. Every engine keeps its own
+      counters, so the statistics of each search are the same as if it
+      had been run on its own.
+
+    C) search_async
+
+      A coroutine running one search in steps and yielding to the asyncio
+      event loop between them, so many searches (and other work) can share
+      one event loop.
+'''
+
+import asyncio
+from collections import deque
+
+from search import _ARASTAR
+
+_SLICE_EXPANSIONS = 1000
+
+
+class SearchTask:
+    '''A search to run with run_searches. engine is a SearchEngine on
+       which init_search has been called. timebound is the total time, in
+       seconds, the task may spend in its own steps (None for no limit).
+       Once the task is done, result is the goal state, or False if no
+       goal was found, and stats its SearchStats with the time of all its
+       steps (None if the timebound ran out before its first step).
+
+       arastar engines cannot be run in steps (use anytime_search).'''
+
+    def __init__(self, engine, timebound=None, costbound=None, name=None):
+        if engine.strategy == _ARASTAR:
+            raise Exception("SearchTask cannot run an arastar search in steps, use anytime_search")
+        self.engine = engine
+        self.timebound = timebound
+        self.costbound = costbound
+        self.name = name
+        self.time_used = 0
+        self.result = None
+        self.stats = None
+
+    def done(self):
+        return self.result is not None
+
+    def run_slice(self, max_expansions=_SLICE_EXPANSIONS):
+        '''Run one step of the search. Returns True when the task is done.'''
+        remaining = None
+        if self.timebound is not None:
+            remaining = self.timebound - self.time_used
+            if remaining <= 0:
+                # a timebound of 0 would mean no limit to step
+                self.result = False
+                return True
+        result, stats = self.engine.step(max_expansions, self.costbound, remaining)
+        if stats is None:
+            # the engine could not run a step
+            self.result = False
+            return True
+        self.time_used = self.time_used + stats.total_time
+        stats.total_time = self.time_used
+        self.stats = stats
+        if result is None and self.timebound is not None and self.time_used >= self.timebound:
+            result = False
+        self.result = result
+        return self.done()
+
+
+def run_searches(tasks, slice_expansions=_SLICE_EXPANSIONS):
+    '''Run tasks (SearchTasks) round robin, slice_expansions iterations at
+       a time, until all are done. Returns the list of (result, stats)
+       pairs, in the order of tasks.'''
+    tasks = list(tasks)
+    queue = deque(task for task in tasks if not task.done())
+    while queue:
+        task = queue.popleft()
+        if not task.run_slice(slice_expansions):
+            queue.append(task)
+    return [(task.result, task.stats) for task in tasks]
+
+
+async def search_async(engine, timebound=None, costbound=None, slice_expansions=_SLICE_EXPANSIONS):
+    """
+    Run the search set up on engine in steps of slice_expansions iterations, letting the event loop
+    run other tasks between steps.
+
+    @param engine: a SearchEngine on which init_search has been called.
+    @param timebound: the total time, in seconds, to spend in this search's steps.
+    @param costbound: the cost bound 3-tuple for pruning, as specified in the assignment.
+    @param slice_expansions: the number of iterations per step.
+
+    Returns the goal state (False if none was found) and the SearchStats, as SearchEngine.search does.
+    """
+    task = SearchTask(engine, timebound, costbound)
+    while not task.run_slice(slice_expansions):
+        await asyncio.sleep(0)
+    return task.result, task.stats
@@ -18,6 +18,11 @@
       include information specific to that problem. See WaterJugs.py for an
       example, and the Class implementation for more details.
 
+      Domains can opt in to Zobrist hashing (see ZobristTable), where
+      each successor's key is derived from its parent's by XOR-ing the
+      features (e.g. piece/location pairs) the action changed, instead
+      of being rebuilt from the whole state.
+
 
     B) class SearchEngine
 
@@ -29,17 +34,91 @@
       Open---these objects are used to store the set of unexpanded
       nodes. These objects are search strategy specific. For example,
       Open is implemented as a stack when doing depth-first search, as
-      a priority queue when doing astar search etc.
+      a priority queue when doing astar search etc. For the priority
+      queue strategies an IndexedOpen can be selected instead
+      (open_type='indexed'), which keeps one node per state and lowers
+      its key in place when a cheaper path to the state is found.
+      By default they use a BucketOpen, a bucket queue for integer
+      priorities that falls back to a heap for any other priority.
+      The iterative deepening strategies ('ida_star' and 'iddfs') do
+      not use an OPEN set across iterations: each iteration is a bounded
+      depth-first search from the initial state, optionally sharing a
+      transposition table (set_transposition_table) between iterations.
+      Depth-first searches with path checking keep the keys of the
+      current path in a PathSet, so checking a successor against its
+      ancestors takes constant time.
+      anytime_search (or the 'arastar' strategy) runs anytime
+      repairing A*, reporting each improved solution while keeping its
+      OPEN/INCONS lists and g-values between weight decreases.
+      With set_node_store('compact') expanded nodes are kept as rows of
+      a NodeArena rather than as StateSpace objects linked by parent
+      pointers.
 
       The main routines that the user will employ are in the SearchEngine class.
       These include the ability to set the search strategy, and to invoke
       search (using the init_search method) and resume the search after
       a goal is found (using searchOpen). See the implementation for details.
+      A search stopped by its timebound keeps its frontier, so calling
+      search again continues it; save_checkpoint and load_checkpoint
+      write it to a file and restore it, e.g. in another process.
+      step runs a search for a given number of expansions and returns;
+      each engine keeps its own node and state counters, so the steps
+      of many engines can be interleaved in one thread (scheduler.py).
 
     '''
+import contextlib
+import copy
 import heapq
-from collections import deque
+import io
+import itertools
+import json
+import operator
+from array import array
+from collections import deque, OrderedDict
 import os
+import pickle
+import random
+import sys
+import time
+import zlib
+
+
+class ZobristTable:
+    '''Random 64-bit values for the features of a domain, for Zobrist
+       hashing. A domain numbers the features a state can have (e.g.
+       "box at square 12") 0 .. num_features-1. The key of a state is the
+       XOR of the values of its features, so the key of a successor is its
+       parent's key XOR the values of the features the action removed and
+       added, which takes time proportional to the number of changes
+       rather than to the size of the state.
+
+       The values are drawn from a generator seeded with seed, so every
+       process (e.g. the workers of parallel_search) computes the same
+       keys.'''
+
+    def __init__(self, num_features, seed=0):
+        rng = random.Random(seed)
+        self.values = [rng.getrandbits(64) for i in range(num_features)]
+
+    def __len__(self):
+        return len(self.values)
+
+    def key(self, features):
+        '''Return the key of a state with the given features'''
+        values = self.values
+        key = 0
+        for feature in features:
+            key = key ^ values[feature]
+        return key
+
+    def update(self, key, removed=(), added=()):
+        '''Return key with the features removed and added toggled'''
+        values = self.values
+        for feature in removed:
+            key = key ^ values[feature]
+        for feature in added:
+            key = key ^ values[feature]
+        return key
 
 
 class StateSpace:
@@ -70,14 +149,69 @@ class StateSpace:
            Also any problem specific data must be specified property.'''
         raise Exception("Must be overridden in subclass.")
 
+    def iter_successors(self):
+        '''Generator version of successors(), used by the engine's lazy
+           mode. Yields one (gval, key, make_state) triple per successor:
+           its g-value, its hashable_state(), and a function of no
+           arguments that builds the successor state object. This lets
+           the engine cycle check a successor before the object is built.
+           The default builds every successor with successors(); domains
+           can override it to delay building the state objects.'''
+        for succ in self.successors():
+            yield succ.gval, succ.hashable_state(), (lambda succ=succ: succ)
+
     def hashable_state(self):
         '''This method must return an immutable and unique representation
            of the state represented by self. The return value, e.g., a
            string or tuple, will be used by hashing routines. So if obj1 and
            obj2, both StateSpace objects then obj1.hashable_state() == obj2.hashable_state()
-           if and only if obj1 and obj2 represent the same problem state.'''
+           if and only if obj1 and obj2 represent the same problem state.
+
+           A domain using Zobrist hashing returns self.zobrist_key, set
+           with set_zobrist_key when the state is built.'''
+        raise Exception("Must be overridden in subclass.")
+
+    def zobrist_features(self):
+        '''Domains using Zobrist hashing must override this to return the
+           features (numbers in their ZobristTable) of the state'''
+        raise Exception("Must be overridden in subclass.")
+
+    def set_zobrist_key(self, table, parent_key=None, removed=(), added=()):
+        '''Set self.zobrist_key. If parent_key is None the key is computed
+           from all of zobrist_features(); otherwise it is derived from
+           the parent's key and the features the action removed and added.'''
+        if parent_key is None:
+            self.zobrist_key = table.key(self.zobrist_features())
+        else:
+            self.zobrist_key = table.update(parent_key, removed, added)
+
+    def pack_state(self):
+        '''Return the state as a compact bytes string, from which
+           unpack_state can rebuild it. Equal states must give equal
+           strings. Only needed for domains searched with external memory
+           (see external_search.py).'''
+        raise Exception("Must be overridden in subclass.")
+
+    def unpack_state(self, data, action, gval, parent=None):
+        '''Return a new state of the same problem as self from the bytes
+           returned by pack_state, with the given action, gval and parent.'''
         raise Exception("Must be overridden in subclass.")
 
+    def full_state(self):
+        '''Return an exact representation of the state, used to verify
+           that states with equal keys are equal when hashable_state() is
+           not unique, e.g. a Zobrist key (see
+           SearchEngine.set_key_verification). By default hashable_state().'''
+        return self.hashable_state()
+
+    def problem_key(self):
+        '''Return an immutable value identifying the problem the state
+           belongs to (what all of its states share, e.g. a Sokoban level),
+           so values kept for one problem are not used for another (see
+           HeuristicCache). By default None: each initial state object is
+           then taken to be a problem of its own.'''
+        return None
+
     def print_state(self):
         '''Print a representation of the state'''
         raise Exception("Must be overridden in subclass.")
@@ -107,6 +241,16 @@ class StateSpace:
         while states:
             states.pop().draw_state()
 
+    def path_contains(self, hc):
+        '''Returns true if hc is the hashable_state() of self or of a
+           prior state on its path'''
+        s = self
+        while s:
+            if s.hashable_state() == hc:
+                return True
+            s = s.parent
+        return False
+
     def has_path_cycle(self):
         '''Returns true if self is equal to a prior state on its path'''
         s = self.parent
@@ -125,22 +269,75 @@ _BEST_FIRST = 2
 _ASTAR = 3
 _UCS = 4
 _CUSTOM = 5
-
-# For best first and astar we use a priority queue. This requires
-# a comparison function for nodes. These constants indicate if we use
-# the gval, the hval or the sum of gval and hval in the comparison.
+_IDA_STAR = 6
+_IDDFS = 7
+_ARASTAR = 8
+_DFBNB = 9
+_BEAM = 10
+
+# Default number of nodes beam search keeps in each layer.
+_BEAM_WIDTH = 100
+
+# Default weight schedule for anytime repairing A* (arastar). The last
+# weight should be 1 so that the final iteration proves optimality.
+_ARA_WEIGHTS = (5, 3, 2, 1.5, 1)
+
+# Comparison types for sNode.__lt__. These constants indicate if we use
+# the gval, the hval or the sum of gval and hval in the comparison. (The
+# priority queue OPEN sets order on precomputed keys instead, see
+# _entry_function.)
 _SUM_HG = 0
 _H = 1
 _G = 2
 _C = 3
 
+# Open list implementations for the priority queue strategies. OPEN_HEAP
+# 'heap' pushes a new node every time a state is reached; OPEN_INDEXED
+# 'indexed' keeps at most one node per state and decreases its key in place.
+# OPEN_BUCKET 'bucket' (the default) is a bucket queue that extracts nodes
+# in priority order without comparing them, and switches to the heap if it
+# meets a priority that is not an integer.
+_OPEN_HEAP = 0
+_OPEN_INDEXED = 1
+_OPEN_BUCKET = 2
+
+# Largest number of buckets a BucketOpen keeps before it falls back to a
+# heap (so a few far apart priorities cannot make it allocate a huge list).
+_MAX_BUCKETS = 1 << 16
+
 # Cycle Checking. Either CC_NONE 'none' (no cycle checking), CC_PATH
 # 'path' (path checking only) or CC_FULL 'full' (full cycle checking,
-# remembering all previously visited nodes).
+# remembering all previously visited nodes). 'fingerprint' is CC_FULL
+# with the visited states kept in a FingerprintTable instead of a dict.
 _CC_NONE = 0
 _CC_PATH = 1
 _CC_FULL = 2
 
+# Fingerprints stored by FingerprintTable are 64-bit; which slots are in
+# use is kept apart from them, so every 64-bit value is a fingerprint.
+_FP_MASK = (1 << 64) - 1
+_FP_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def _mix64(x):
+    '''Mix the 64-bit integer x so every bit of it affects every bit of
+       the result (the splitmix64 finaliser). Distinct inputs give
+       distinct results.'''
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _FP_MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _FP_MASK
+    return x ^ (x >> 31)
+
+# The timebound is checked once every _TIME_CHECK_INTERVAL expansions
+# rather than on every one.
+_TIME_CHECK_INTERVAL = 32
+
+# Checkpoint files (SearchEngine.save_checkpoint) start with this, followed
+# by the compressed pickle.
+_CHECKPOINT_MAGIC = b'SCKP1'
+
+# Phases of the search loop timed by SearchProfile.
+_PROFILE_PHASES = ('open', 'goal_test', 'successors', 'hashing', 'heuristic')
+
 
 # Zero Heuristic Function---for uninformed search don't include heur_fn
 # in call to search engine's search method, defaults heur_fn to the zero fn.
@@ -154,17 +351,341 @@ def _fval_function(state):
     return state.hval
 
 
+def _json_key(key):
+    '''Return hashable_state() key as a JSON value: the key itself if it is
+       a number or a string, otherwise the string it is printed as'''
+    if isinstance(key, (int, float, str)):
+        return key
+    return str(key)
+
+
+def _state_text(state):
+    '''Return what state.print_state() prints'''
+    text = io.StringIO()
+    with contextlib.redirect_stdout(text):
+        state.print_state()
+    return text.getvalue()
+
+
+def _state_event(state, key, hval):
+    '''Return the fields describing a state in a trace event'''
+    return {'i': state.index, 'a': state.action, 'k': _json_key(key), 'g': state.gval, 'h': hval}
+
+
+def _node_event(node):
+    '''Return the fields describing a search node in a trace event'''
+    key = node.key if node.key is not None else node.state.hashable_state()
+    return {'i': node.state.index, 'a': node.state.action, 'k': _json_key(key), 'g': node.gval, 'h': node.hval}
+
+
+def _node_text(event):
+    return "<S{}:{}:{}, g={}, h={}, f=g+h={}>".format(event['i'], event['a'], event['k'], event['g'], event['h'],
+                                                       event['g'] + event['h'])
+
+
+def render_trace_event(event):
+    '''Return the TRACE text printed for a trace event (see
+       SearchEngine.set_event_log). Each event is a dictionary whose 'e'
+       entry names the event, and whose 'level' entry is the lowest trace
+       level (see SearchEngine.trace_on) at which it is printed.'''
+    kind = event['e']
+    if kind == 'init':
+        return "   TRACE: Search Strategy:  {}\n   TRACE: Initial State:{}".format(event['strategy'], event['state'])
+    if kind == 'open':
+        return "{" + "".join("   " + _node_text(nd) for nd in event['nodes']) + "}\n   TRACE: Initial OPEN:  None\n"
+    if kind == 'cc_dict':
+        return "   TRACE: Initial CC_Dict: {}\n".format(event['cc'])
+    if kind == 'pop':
+        if 'weighted_f' in event:
+            return "   TRACE: Next State to expand: <S{}:{}:{}, g={}, h={}, f=g+w*h={}>\n".format(
+                event['i'], event['a'], event['k'], event['g'], event['h'], event['weighted_f'])
+        return "   TRACE: Next State to expand: {}\n".format(_node_text(event))
+    if kind == 'cc_check':
+        return "   TRACE: CC_dict gval={}, node.gval={}\n".format(event['cc_g'], event['g'])
+    if kind == 'expand':
+        return "   TRACE: Expanding Node. Successors = {" + "".join(
+            _node_text(succ) + ", " for succ in event['successors']) + "}\n"
+    if kind == 'successor':
+        in_cc_dict = ''
+        if 'cc_g' in event:
+            in_cc_dict = "   TRACE: Already in CC_dict, CC_dict gval={}, successor state gval={}\n".format(
+                event['cc_g'], event['g'])
+        rval = in_cc_dict + "   TRACE: Successor State:" + event['state']
+        rval = rval + "   TRACE: Heuristic Value: {}\n".format(event['h']) + in_cc_dict
+        if event.get('path_cycle'):
+            rval = rval + "   TRACE: On cyclic path\n"
+        return rval
+    if kind == 'prune':
+        if event['reason'] == 'cycle':
+            return " TRACE: Successor State pruned by cycle checking\n\n\n"
+        if event['reason'] == 'filter':
+            return " TRACE: Successor State pruned by successor filter\n\n\n"
+        return " TRACE: Successor State pruned, over current cost bound of {{}} {}\n\n\n".format(event['bound'])
+    if kind == 'push':
+        return " TRACE: Successor State added to OPEN\n\n\n"
+    if kind == 'evaluate':
+        return "   TRACE: Evaluated deferred heuristic of S{}: h={}\n".format(event['i'], event['h'])
+    if kind == 'push_deferred':
+        return " TRACE: Successor State S{} added to OPEN with deferred heuristic\n".format(event['i'])
+    if kind == 'iteration':
+        return "   TRACE: Iteration {}, bound={}\n".format(event['iteration'], event['bound'])
+    if kind == 'ara_iteration':
+        return "   TRACE: ARA* iteration, weight={}\n".format(event['weight'])
+    if kind == 'incumbent':
+        return "   TRACE: New incumbent solution, cost={}\n".format(event['g'])
+    if kind == 'beam_layer':
+        return "   TRACE: Beam layer of {} nodes (from {} successors)\n".format(event['size'], event['candidates'])
+    if kind == 'timeout':
+        return "TRACE: Search has exceeeded the time bound provided.\n"
+    # other events (e.g. 'goal') are not part of the printed trace
+    return ''
+
+
 class SearchStats:
 
-    def __init__(self, n1, n2, n3, n4, n5):
+    def __init__(self, n1, n2, n3, n4, n5, n6=0, n7=None, n8=None, n9=None, n10=None, n11=None):
         self.states_expanded = n1
         self.states_generated = n2
         self.states_pruned_cycles = n3
         self.states_pruned_cost = n4
         self.total_time = n5
+        self.max_open_size = n6
+        # heuristic cache hits and misses during the search (None if the
+        # engine has no heuristic cache)
+        self.heuristic_cache_hits = n7
+        self.heuristic_cache_misses = n8
+        # SearchProfile of the search (None unless profiling was on)
+        self.profile = n9
+        # bytes used by the closed set (only reported for cc_level 'fingerprint')
+        self.closed_set_bytes = n10
+        # successors pruned by the successor filter (None if the engine had
+        # no filter, see SearchEngine.set_successor_filter)
+        self.states_pruned_filter = n11
 
     def __str__(self):
-        return f'states generated: {self.states_generated}\nstates explored: {self.states_expanded}\nstate pruned by cycle checking: {self.states_pruned_cycles}\nstates pruned by cost checking: {self.states_pruned_cost}\ntotal search time: {self.total_time}\n'
+        rval = f'states generated: {self.states_generated}\nstates explored: {self.states_expanded}\nstate pruned by cycle checking: {self.states_pruned_cycles}\nstates pruned by cost checking: {self.states_pruned_cost}\npeak open size: {self.max_open_size}\n'
+        if self.states_pruned_filter is not None:
+            rval = rval + f'states pruned by successor filter: {self.states_pruned_filter}\n'
+        if self.heuristic_cache_hits is not None:
+            rval = rval + f'heuristic cache hits: {self.heuristic_cache_hits}\nheuristic cache misses: {self.heuristic_cache_misses}\n'
+        if self.closed_set_bytes is not None:
+            rval = rval + f'closed set memory: {self.closed_set_bytes} bytes\n'
+        rval = rval + f'total search time: {self.total_time}\n'
+        if self.profile is not None:
+            rval = rval + str(self.profile)
+        return rval
+
+    def as_dict(self):
+        '''Return the statistics as a dictionary of plain values'''
+        rval = {'states_expanded': self.states_expanded,
+                'states_generated': self.states_generated,
+                'states_pruned_cycles': self.states_pruned_cycles,
+                'states_pruned_cost': self.states_pruned_cost,
+                'states_pruned_filter': self.states_pruned_filter,
+                'total_time': self.total_time,
+                'max_open_size': self.max_open_size,
+                'heuristic_cache_hits': self.heuristic_cache_hits,
+                'heuristic_cache_misses': self.heuristic_cache_misses,
+                'closed_set_bytes': self.closed_set_bytes}
+        if self.profile is not None:
+            rval['profile'] = self.profile.as_dict()
+        return rval
+
+    def to_json(self, **kwargs):
+        '''Return the statistics as a JSON string (kwargs are passed to json.dumps)'''
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+class SearchProfile:
+    '''Instrumentation collected by a search when profiling is on (see
+       SearchEngine.set_profiling).
+
+       Every expansion is counted, along with the size of OPEN and the
+       node's f-value (g + h) at that point. One in every sample_interval
+       iterations of the search loop is also timed phase by phase with
+       time.perf_counter: extracting and inserting OPEN nodes, the goal
+       test, successors(), hashable_state() and heur_fn. The sampled
+       times are scaled up to estimates for the whole search.'''
+
+    def __init__(self, sample_interval=100):
+        self.sample_interval = sample_interval
+        self.iterations = 0
+        self.sampled_iterations = 0
+        self.sampled_times = dict((phase, 0.0) for phase in _PROFILE_PHASES)
+        self.expansions = 0
+        self.open_size_total = 0
+        self.max_open_size = 0
+        self.f_histogram = dict()
+        self.start_time = time.perf_counter()
+        self.elapsed = 0.0
+
+    def start_iteration(self):
+        '''Count an iteration of the search loop. Returns true if its
+           phases should be timed.'''
+        self.iterations = self.iterations + 1
+        if self.iterations % self.sample_interval:
+            return False
+        self.sampled_iterations = self.sampled_iterations + 1
+        return True
+
+    def add(self, phase, seconds):
+        '''Add seconds spent in phase during a sampled iteration'''
+        self.sampled_times[phase] = self.sampled_times[phase] + seconds
+
+    def expansion(self, node, open_size):
+        '''Record the expansion of node with open_size nodes on OPEN'''
+        self.expansions = self.expansions + 1
+        self.open_size_total = self.open_size_total + open_size
+        if open_size > self.max_open_size:
+            self.max_open_size = open_size
+        fval = node.gval + node.hval
+        self.f_histogram[fval] = self.f_histogram.get(fval, 0) + 1
+
+    def stop(self):
+        '''Record the time since the profile was started'''
+        self.elapsed = time.perf_counter() - self.start_time
+
+    def expansions_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.expansions / self.elapsed
+
+    def mean_open_size(self):
+        if self.expansions == 0:
+            return 0.0
+        return self.open_size_total / self.expansions
+
+    def phase_times(self):
+        '''Return the estimated time spent in each phase over the whole
+           search, and under 'other' the rest of the elapsed time'''
+        scale = self.iterations / self.sampled_iterations if self.sampled_iterations else 0
+        times = dict((phase, t * scale) for phase, t in self.sampled_times.items())
+        times['other'] = max(0.0, self.elapsed - sum(times.values()))
+        return times
+
+    def as_dict(self):
+        '''Return the profile as a dictionary of plain values'''
+        return {'elapsed': self.elapsed,
+                'expansions': self.expansions,
+                'expansions_per_second': self.expansions_per_second(),
+                'mean_open_size': self.mean_open_size(),
+                'max_open_size': self.max_open_size,
+                'sample_interval': self.sample_interval,
+                'sampled_iterations': self.sampled_iterations,
+                'phase_times': self.phase_times(),
+                'f_histogram': [[fval, count] for fval, count in sorted(self.f_histogram.items())]}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def __str__(self):
+        rval = f'expansions per second: {self.expansions_per_second():.1f}\nmean open size: {self.mean_open_size():.1f}\n'
+        for phase, t in self.phase_times().items():
+            rval = rval + f'time in {phase} (estimated): {t:.4f}\n'
+        rval = rval + 'f-values at expansion: ' + ', '.join(
+            f'{fval}:{count}' for fval, count in sorted(self.f_histogram.items())) + '\n'
+        return rval
+
+
+class HeuristicCache:
+    '''Memoises a heuristic function on hashable_state(), so a state
+       reached along several paths (or again in a later search of the
+       same problem) has its heuristic computed only once.
+
+       At most max_entries values are kept. When the cache is full an
+       entry is evicted using either the 'lru' policy (least recently
+       used) or the 'clock' policy (second chance: entries used since
+       the clock hand last passed are skipped once), which avoids
+       reordering on every hit.
+
+       A cache can be given to several SearchEngines or kept across
+       repeated init_search/search calls on the same problem (see
+       SearchEngine.set_heuristic_cache). It is cleared if it is used
+       with a different heuristic function or on a different problem
+       (see StateSpace.problem_key), so values of one problem are never
+       returned for another.'''
+
+    def __init__(self, max_entries=100000, policy='lru'):
+        if not policy in ['lru', 'clock']:
+            raise Exception("Unknown eviction policy {}, must be one of ['lru', 'clock']".format(policy))
+        if max_entries < 1:
+            raise Exception("Heuristic cache size must be at least 1, not {}".format(max_entries))
+        self.max_entries = max_entries
+        self.policy = policy
+        self.heur_fn = None
+        self.problem = None
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        '''Forget all cached values'''
+        if self.policy == 'lru':
+            self.values = OrderedDict()
+        else:
+            self.values = dict()    # key -> slot
+            self.slot_keys = []
+            self.slot_values = []
+            self.referenced = []
+            self.hand = 0
+
+    def use(self, heur_fn, init_state=None):
+        '''Cache values of heur_fn on the problem of init_state, clearing
+           the cache if it held values of another function or problem.
+           Functions are compared with ==, so a bound method fetched again
+           (obj.h) is the same function. The problem is init_state's class
+           and problem_key(), or if that is None, the init_state object.'''
+        key = init_state.problem_key() if init_state is not None else None
+        problem = init_state if key is None else (init_state.__class__, key)
+        if heur_fn != self.heur_fn or problem != self.problem:
+            self.clear()
+            self.heur_fn = heur_fn
+            self.problem = problem
+
+    def __len__(self):
+        return len(self.values)
+
+    def __call__(self, state):
+        key = state.hashable_state()
+        if self.policy == 'lru':
+            values = self.values
+            if key in values:
+                self.hits = self.hits + 1
+                values.move_to_end(key)
+                return values[key]
+            self.misses = self.misses + 1
+            hval = self.heur_fn(state)
+            values[key] = hval
+            if len(values) > self.max_entries:
+                values.popitem(last=False)
+            return hval
+
+        slot = self.values.get(key)
+        if slot is not None:
+            self.hits = self.hits + 1
+            self.referenced[slot] = True
+            return self.slot_values[slot]
+        self.misses = self.misses + 1
+        hval = self.heur_fn(state)
+        if len(self.slot_keys) < self.max_entries:
+            self.values[key] = len(self.slot_keys)
+            self.slot_keys.append(key)
+            self.slot_values.append(hval)
+            self.referenced.append(False)
+            return hval
+        # sweep the clock hand to the first entry not referenced since
+        # the last sweep, clearing reference bits on the way
+        referenced = self.referenced
+        hand = self.hand
+        while referenced[hand]:
+            referenced[hand] = False
+            hand = (hand + 1) % self.max_entries
+        del self.values[self.slot_keys[hand]]
+        self.values[key] = hand
+        self.slot_keys[hand] = key
+        self.slot_values[hand] = hval
+        self.hand = (hand + 1) % self.max_entries
+        return hval
 
 
 class sNode:
@@ -177,12 +698,23 @@ class sNode:
     n = 0
     lt_type = _SUM_HG
 
-    def __init__(self, state, hval, fval_function):
+    def __init__(self, state, hval, fval_function, key=None):
         self.state = state
         self.hval = hval
         self.gval = state.gval
         self.index = sNode.n
         self.fval_function = fval_function
+        # hashable_state() of the node's state, if the engine has already
+        # computed it (used by IndexedOpen to avoid rehashing the state).
+        self.key = key
+        # index of the node in the engine's NodeArena (compact node store only)
+        self.arena_index = None
+        # true if hval is the parent's h-value, standing in for this
+        # node's own until it is evaluated (lazy mode only)
+        self.hval_deferred = False
+        # number of actions from the initial state (only kept by depth
+        # first searches with path checking, see PathSet)
+        self.depth = 0
         sNode.n = sNode.n + 1
 
     def __lt__(self, other):
@@ -195,7 +727,12 @@ class sNode:
            we wish to break ties by letting node1 < node2 if they both
            have identical f-values but if node1 has a GREATER g
            value. This means that we expand nodes along deeper paths
-           first causing the search to proceed directly to the goal'''
+           first causing the search to proceed directly to the goal.
+
+           The OPEN set no longer calls this function: it orders nodes
+           on a priority key computed once per node (_entry_function),
+           which by default compares exactly as this function does.
+           It is kept for code that compares nodes directly.'''
 
         if sNode.lt_type == _SUM_HG:
             if (self.gval + self.hval) == (other.gval + other.hval):
@@ -216,6 +753,83 @@ class sNode:
         return self.gval < other.gval
 
 
+def _priority_function(search_strategy):
+    '''Return the function computing the primary priority of a node on
+       the priority queue of the given strategy (smallest first).'''
+    if search_strategy == _UCS:
+        return lambda node: node.gval
+    if search_strategy == _BEST_FIRST:
+        return lambda node: node.hval
+    if search_strategy == _ASTAR:
+        return lambda node: node.gval + node.hval
+    if search_strategy == _CUSTOM:
+        return lambda node: node.fval_function(node)
+
+
+class _HeapEntry(tuple):
+    '''A priority queue entry for 'default' tie breaking: a tuple of the
+       key fields only, (priority,) or for astar (f-value, -gval), with
+       the node kept in its node attribute. It compares as a plain tuple,
+       so entries with equal keys are neither smaller nor greater than
+       each other and the heap leaves them in the order it left the
+       nodes themselves in when it held sNode objects.'''
+
+
+def _entry_function(search_strategy, tie_break):
+    '''Return a function mapping a node to the entry stored for it on a
+       priority queue OPEN set, computed once when the node is inserted
+       so that fval_function is called once per node rather than on
+       every comparison. Every entry compares as a tuple, so the heap
+       orders entries without calling back into python code.
+
+       tie_break decides the order of nodes with equal priority:
+       'deeper' (greatest gval first), 'fifo' (oldest first), 'lifo'
+       (newest first), or a function of the node returning a value
+       where smaller values are expanded first. Those entries are
+       tuples (priority, [tie break,] insertion counter, node); the
+       insertion counter is unique, so the node itself is never
+       compared.
+
+       'default' keeps the order of the original OPEN set, a heap of
+       sNode objects compared with sNode.__lt__: the entry is a
+       _HeapEntry holding the key that function compares (for astar,
+       the f-value then the greatest gval), and nodes with equal keys
+       come out in whatever order the heap leaves them.
+
+       _entry_node(tie_break) gives the function returning an entry's
+       node.'''
+    priority = _priority_function(search_strategy)
+    counter = itertools.count()
+    if tie_break == 'default':
+        if search_strategy == _ASTAR:
+            def make_entry(node):
+                entry = _HeapEntry((node.gval + node.hval, -node.gval))
+                entry.node = node
+                return entry
+        else:
+            def make_entry(node):
+                entry = _HeapEntry((priority(node),))
+                entry.node = node
+                return entry
+        return make_entry
+
+    if tie_break == 'deeper':
+        return lambda node: (priority(node), -node.gval, next(counter), node)
+    if tie_break == 'fifo':
+        return lambda node: (priority(node), next(counter), node)
+    if tie_break == 'lifo':
+        return lambda node: (priority(node), -next(counter), node)
+    return lambda node: (priority(node), tie_break(node), next(counter), node)
+
+
+def _entry_node(tie_break):
+    '''Return the function giving the node of an entry made by
+       _entry_function for tie_break'''
+    if tie_break == 'default':
+        return operator.attrgetter('node')
+    return operator.itemgetter(-1)
+
+
 class Open:
     '''Open objects hold the search frontier---the set of unexpanded
        nodes. Depending on the search strategy used we want to extract
@@ -223,74 +837,673 @@ class Open:
        functions to operate as needed by the particular search
        strategy'''
 
-    def __init__(self, search_strategy):
+    def __init__(self, search_strategy, tie_break='default'):
         if search_strategy == _DEPTH_FIRST:
             # use stack for OPEN set (last in---most recent successor added---is first out)
             self.open = []
             self.insert = self.open.append
             self.extract = self.open.pop
+            self.pushpop = lambda node: node
+            self.nodes = lambda: list(self.open)
+            self.restore_order = self.nodes
         elif search_strategy == _BREADTH_FIRST:
             # use queue for OPEN (first in---earliest node not yet expanded---is first out)
             self.open = deque()
             self.insert = self.open.append
             self.extract = self.open.popleft
-        elif search_strategy == _UCS:
-            # use priority queue for OPEN (first out is node with lowest gval)
-            self.open = []
-            # set node less than function to compare gvals only
-            sNode.lt_type = _G
-            self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
-        elif search_strategy == _BEST_FIRST:
-            # use priority queue for OPEN (first out is node with lowest hval)
-            self.open = []
-            # set node less than function to compare hvals only
-            sNode.lt_type = _H
-            self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
-        elif search_strategy == _ASTAR:
-            # use priority queue for OPEN (first out is node with lowest fval = gval+hval)
-            self.open = []
-            # set node less than function to compare sums of hval and gval
-            sNode.lt_type = _SUM_HG
-            self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
-        elif search_strategy == _CUSTOM:
-            # use priority queue for OPEN (first out is node with lowest fval)
+            self.pushpop = lambda node: node
+            self.nodes = lambda: list(self.open)
+            self.restore_order = self.nodes
+        else:
+            # use priority queue for OPEN. First out is the node with the
+            # lowest gval (ucs), hval (best_first), gval+hval (astar) or
+            # fval_function value (custom). The priority is computed once
+            # per node when it is inserted (see _entry_function).
             self.open = []
-            # set node less than function to compare sums of fval
-            sNode.lt_type = _C
-            self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            make_entry = _entry_function(search_strategy, tie_break)
+            entry_node = _entry_node(tie_break)
+            self.insert = lambda node: heapq.heappush(self.open, make_entry(node))
+            self.extract = lambda: entry_node(heapq.heappop(self.open))
+            self.pushpop = lambda node: entry_node(heapq.heappushpop(self.open, make_entry(node)))
+            self.nodes = lambda: [entry_node(entry) for entry in self.open]
+            if tie_break == 'default':
+                self.restore_order = self.nodes
+            else:
+                lifo = tie_break == 'lifo'
+                self.restore_order = lambda: [entry_node(entry) for entry in sorted(self.open, reverse=lifo)]
+
+    # pushpop(node): insert node then extract the first node out, which
+    # may be node itself. The stack and queue do not order on h-values so
+    # for them this just returns node.
+    #
+    # restore_order(): the nodes on OPEN in the order in which inserting
+    # them into a new, empty Open of the same kind gives back the same
+    # OPEN (used by checkpoints). For the priority queues that is the
+    # order they would be extracted in (the reverse for 'lifo' tie
+    # breaking), so that nodes with equal priority keep their order.
+    # With 'default' tie breaking it is the heap's own array: pushing a
+    # valid heap's entries in array order moves none of them, so the
+    # heap comes back exactly as it was.
 
     def empty(self):
         return not self.open
 
+    def __len__(self):
+        return len(self.open)
+
     def print_open(self):
+        nodes = self.nodes()
         print("{", end="")
-        if len(self.open) == 1:
-            print("   <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(self.open[0].state.index, self.open[0].state.action,
-                                                                self.open[0].state.hashable_state(), self.open[0].gval,
-                                                                self.open[0].hval,
-                                                                self.open[0].gval + self.open[0].hval), end="")
-        else:
-            for nd in self.open:
-                print("   <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(nd.state.index, nd.state.action,
-                                                                    nd.state.hashable_state(), nd.gval, nd.hval,
-                                                                    nd.gval + nd.hval), end="")
+        for nd in nodes:
+            print("   <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(nd.state.index, nd.state.action,
+                                                                nd.state.hashable_state(), nd.gval, nd.hval,
+                                                                nd.gval + nd.hval), end="")
         print("}")
 
 
+class IndexedOpen(Open):
+    '''Priority queue OPEN set that holds at most one node per state.
+       The heap is indexed by hashable_state(), so when a cheaper path
+       to a state that is already on OPEN is found, the existing node
+       is replaced and moved to its new position in place (decrease-key)
+       instead of a second copy of the state being pushed. The heap
+       therefore never grows beyond the number of distinct states on the
+       frontier. Only used for the priority queue strategies.'''
+
+    def __init__(self, search_strategy, tie_break='default'):
+        # binary heap of priority entries (see _entry_function), and the
+        # position of each state's entry in it
+        self.open = []
+        self.position = dict()
+        self.make_entry = _entry_function(search_strategy, tie_break)
+        self.entry_node = _entry_node(tie_break)
+        self.tie_break = tie_break
+
+    def nodes(self):
+        return [self.entry_node(entry) for entry in self.open]
+
+    def restore_order(self):
+        if self.tie_break == 'default':
+            return self.nodes()
+        return [self.entry_node(entry) for entry in sorted(self.open, reverse=self.tie_break == 'lifo')]
+
+    def insert(self, node):
+        '''Add node to OPEN. If a node for the same state is already on
+           OPEN keep whichever of the two has the lower g-value.'''
+        if node.key is None:
+            node.key = node.state.hashable_state()
+        pos = self.position.get(node.key)
+        if pos is None:
+            self.open.append(self.make_entry(node))
+            self._sift_up(len(self.open) - 1)
+        elif node.gval < self.entry_node(self.open[pos]).gval:
+            self.open[pos] = self.make_entry(node)
+            # a custom fval function need not be monotone in gval so the
+            # replacement may have to move in either direction
+            self._sift_down(self._sift_up(pos))
+
+    def extract(self):
+        heap = self.open
+        last = heap.pop()
+        if heap:
+            top = heap[0]
+            heap[0] = last
+            self._sift_down(0)
+        else:
+            top = last
+        node = self.entry_node(top)
+        del self.position[node.key]
+        return node
+
+    def pushpop(self, node):
+        self.insert(node)
+        return self.extract()
+
+    def _sift_up(self, pos):
+        '''Move the entry at pos towards the root until the heap property
+           holds. Returns the entry's final position.'''
+        heap = self.open
+        position = self.position
+        entry_node = self.entry_node
+        entry = heap[pos]
+        while pos > 0:
+            parent_pos = (pos - 1) >> 1
+            parent = heap[parent_pos]
+            if not entry < parent:
+                break
+            heap[pos] = parent
+            position[entry_node(parent).key] = pos
+            pos = parent_pos
+        heap[pos] = entry
+        position[entry_node(entry).key] = pos
+        return pos
+
+    def _sift_down(self, pos):
+        '''Move the entry at pos towards the leaves until the heap property
+           holds.'''
+        heap = self.open
+        position = self.position
+        entry_node = self.entry_node
+        size = len(heap)
+        entry = heap[pos]
+        child_pos = 2 * pos + 1
+        while child_pos < size:
+            right_pos = child_pos + 1
+            if right_pos < size and heap[right_pos] < heap[child_pos]:
+                child_pos = right_pos
+            child = heap[child_pos]
+            if not child < entry:
+                break
+            heap[pos] = child
+            position[entry_node(child).key] = pos
+            pos = child_pos
+            child_pos = 2 * pos + 1
+        heap[pos] = entry
+        position[entry_node(entry).key] = pos
+
+
+class BucketOpen(Open):
+    '''Priority queue OPEN set for integer priorities (bucket queue).
+       Bucket i of a list holds the nodes with priority base + i, and
+       extract takes a node from the first nonempty bucket, so neither
+       operation compares nodes. Inside a bucket nodes come out in the
+       order of the tie breaking policy, exactly as from Open: a 'fifo'
+       bucket is a deque, a 'lifo' bucket a stack, and a 'deeper' bucket
+       is itself a list of deques indexed by g-value, emptied from the
+       highest g-value down. A 'default' bucket is a heap of the entries
+       Open makes for 'default' (see _entry_function), so astar still
+       takes the greatest gval first and the remaining ties come out in
+       the order a heap leaves them in. That is the order of a heap
+       holding the bucket's nodes only, so it can differ from Open's
+       order, where the heap holds every node.
+
+       Priorities (and for 'deeper', g-values) that are integral floats
+       (3.0) are bucketed too. The first time a node with any other
+       priority or g-value is inserted, or one that would make a list
+       longer than _MAX_BUCKETS, every node moves to a heap Open which is
+       used from then on.'''
+
+    def __init__(self, search_strategy, tie_break='default'):
+        self.search_strategy = search_strategy
+        self.tie_break = tie_break
+        self.priority = _priority_function(search_strategy)
+        # buckets[i] is None until a node with priority base + i arrives;
+        # no bucket before low holds a node
+        self.buckets = []
+        self.base = None
+        self.low = 0
+        self.size = 0
+        # the heap Open taking over after a priority that cannot be bucketed
+        self.heap = None
+        if tie_break == 'default':
+            self.make_entry = _entry_function(search_strategy, tie_break)
+            self.insert = self._insert_default
+            self.extract = self._extract_default
+        elif tie_break == 'deeper':
+            self.insert = self._insert_deeper
+            self.extract = self._extract_deeper
+        elif tie_break == 'lifo':
+            self.take = deque.pop
+        else:
+            self.take = deque.popleft
+
+    def empty(self):
+        if self.heap is not None:
+            return self.heap.empty()
+        return self.size == 0
+
+    def __len__(self):
+        if self.heap is not None:
+            return len(self.heap)
+        return self.size
+
+    def _index(self, node):
+        '''Return the bucket for node's priority, growing the list if
+           needed, or None if the priority cannot be bucketed'''
+        priority = self.priority(node)
+        if priority.__class__ is not int:
+            if not (priority.__class__ is float and priority.is_integer()):
+                return None
+            priority = int(priority)
+        if self.base is None:
+            self.base = priority
+        i = priority - self.base
+        if i < 0:
+            if len(self.buckets) - i > _MAX_BUCKETS:
+                return None
+            self.buckets[0:0] = [None] * -i
+            self.base = priority
+            self.low = 0
+            return 0
+        if i >= len(self.buckets):
+            if i >= _MAX_BUCKETS:
+                return None
+            self.buckets.extend([None] * (i + 1 - len(self.buckets)))
+        if i < self.low:
+            self.low = i
+        return i
+
+    def insert(self, node):
+        i = self._index(node)
+        if i is None:
+            self._use_heap().insert(node)
+            return
+        bucket = self.buckets[i]
+        if bucket is None:
+            bucket = self.buckets[i] = deque()
+        bucket.append(node)
+        self.size = self.size + 1
+
+    def extract(self):
+        buckets = self.buckets
+        low = self.low
+        while not buckets[low]:
+            low = low + 1
+        self.low = low
+        self.size = self.size - 1
+        return self.take(buckets[low])
+
+    def _insert_default(self, node):
+        i = self._index(node)
+        if i is None:
+            self._use_heap().insert(node)
+            return
+        bucket = self.buckets[i]
+        if bucket is None:
+            bucket = self.buckets[i] = []
+        heapq.heappush(bucket, self.make_entry(node))
+        self.size = self.size + 1
+
+    def _extract_default(self):
+        buckets = self.buckets
+        low = self.low
+        while not buckets[low]:
+            low = low + 1
+        self.low = low
+        self.size = self.size - 1
+        return heapq.heappop(buckets[low]).node
+
+    def _insert_deeper(self, node):
+        # a 'deeper' bucket is [count, top, by_gval]: the number of nodes
+        # in it, the highest g-value that may have nodes, and a deque of
+        # nodes for each g-value
+        gval = node.gval
+        if gval.__class__ is not int:
+            if not (gval.__class__ is float and gval.is_integer()):
+                gval = -1
+            else:
+                gval = int(gval)
+        i = self._index(node) if 0 <= gval < _MAX_BUCKETS else None
+        if i is None:
+            self._use_heap().insert(node)
+            return
+        bucket = self.buckets[i]
+        if bucket is None:
+            bucket = self.buckets[i] = [0, gval, []]
+        by_gval = bucket[2]
+        if gval >= len(by_gval):
+            by_gval.extend([None] * (gval + 1 - len(by_gval)))
+        same_gval = by_gval[gval]
+        if same_gval is None:
+            same_gval = by_gval[gval] = deque()
+        same_gval.append(node)
+        bucket[0] = bucket[0] + 1
+        if gval > bucket[1]:
+            bucket[1] = gval
+        self.size = self.size + 1
+
+    def _extract_deeper(self):
+        buckets = self.buckets
+        low = self.low
+        while buckets[low] is None or not buckets[low][0]:
+            low = low + 1
+        self.low = low
+        self.size = self.size - 1
+        bucket = buckets[low]
+        by_gval = bucket[2]
+        top = bucket[1]
+        while not by_gval[top]:
+            top = top - 1
+        bucket[1] = top
+        bucket[0] = bucket[0] - 1
+        return by_gval[top].popleft()
+
+    def pushpop(self, node):
+        self.insert(node)
+        return self.extract()
+
+    def nodes(self):
+        '''Return the nodes on OPEN in the order they would be extracted.
+           For 'default' the nodes of a bucket are in the order of its
+           heap's array, so that inserting them in that order into a new
+           BucketOpen gives back the same heap (see restore_order).'''
+        if self.heap is not None:
+            return self.heap.nodes()
+        nodes = []
+        for bucket in self.buckets[self.low:]:
+            if bucket is None:
+                continue
+            if self.tie_break == 'deeper':
+                for same_gval in reversed(bucket[2]):
+                    if same_gval is not None:
+                        nodes.extend(same_gval)
+            elif self.tie_break == 'default':
+                nodes.extend(entry.node for entry in bucket)
+            elif self.tie_break == 'lifo':
+                nodes.extend(reversed(bucket))
+            else:
+                nodes.extend(bucket)
+        return nodes
+
+    def restore_order(self):
+        nodes = self.nodes()
+        if self.tie_break == 'lifo':
+            nodes.reverse()
+        return nodes
+
+    def _use_heap(self):
+        '''Move every node to a heap Open and use it from now on. Nodes
+           are inserted in the order they would have been extracted (the
+           reverse for 'lifo'), so the heap keeps their order.'''
+        heap = Open(self.search_strategy, self.tie_break)
+        for node in self.restore_order():
+            heap.insert(node)
+        self.heap = heap
+        self.buckets = []
+        self.size = 0
+        self.insert = heap.insert
+        self.extract = heap.extract
+        self.pushpop = heap.pushpop
+        self.nodes = heap.nodes
+        self.restore_order = heap.restore_order
+        return heap
+
+
+class NodeArena:
+    '''Compact store for the nodes generated by a search, used instead
+       of parent pointers when the engine's node store is 'compact'.
+
+       Nodes are kept as rows of array-backed columns (g-value, h-value,
+       parent row and an action code) plus the node's hashable_state()
+       key, so once a state has been expanded the StateSpace object
+       itself can be released. Action names are interned: each distinct
+       action string is stored once and rows refer to it by number.
+
+       The path to a node is rebuilt on demand by replaying its actions
+       from the initial state (rebuild_path), which gives back ordinary
+       StateSpace objects with parent pointers for print_path/draw_path.'''
+
+    def __init__(self):
+        self.gvals = array('d')
+        self.hvals = array('d')
+        self.parents = array('q')
+        self.actions = array('l')
+        self.keys = []
+        self.action_codes = dict()
+        self.action_names = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, gval, hval, parent, action):
+        '''Store a node and return its row. parent is the row of the
+           node it was generated from (-1 for the initial state).'''
+        code = self.action_codes.get(action)
+        if code is None:
+            code = len(self.action_names)
+            self.action_codes[action] = code
+            self.action_names.append(action)
+        self.gvals.append(gval)
+        self.hvals.append(hval)
+        self.parents.append(parent)
+        self.actions.append(code)
+        self.keys.append(key)
+        return len(self.keys) - 1
+
+    def on_path(self, index, key):
+        '''Returns true if key is the key of the node at row index or of
+           one of its ancestors'''
+        parents = self.parents
+        keys = self.keys
+        while index >= 0:
+            if keys[index] == key:
+                return True
+            index = parents[index]
+        return False
+
+    def path(self, index):
+        '''Return the list of (action, key) pairs on the path from the
+           initial state to the node at row index'''
+        steps = []
+        while index >= 0:
+            steps.append((self.action_names[self.actions[index]], self.keys[index]))
+            index = self.parents[index]
+        steps.reverse()
+        return steps
+
+    def rebuild_path(self, index, init_state):
+        '''Regenerate the state at row index, with its full parent chain,
+           by replaying the stored actions from init_state'''
+        state = init_state
+        for action, key in self.path(index)[1:]:
+            for succ in state.successors():
+                if succ.action == action and succ.hashable_state() == key:
+                    state = succ
+                    break
+            else:
+                raise Exception("Could not rebuild path: action {} not applicable".format(action))
+        return state
+
+    def memory_size(self):
+        '''Approximate number of bytes held by the columns (not counting
+           the keys themselves, which are shared with the cycle check
+           dictionary)'''
+        size = 0
+        for column in (self.gvals, self.hvals, self.parents, self.actions):
+            size = size + column.itemsize * len(column)
+        return size + 8 * len(self.keys)
+
+
+class PathSet:
+    '''The keys of the states on the current path of a depth-first
+       search, for path checking in O(1) instead of walking the parent
+       chain. The path is kept as a stack of keys alongside a set of the
+       same keys. Nodes come off a depth-first OPEN stack in the order of
+       the path, so when a node at depth d is expanded the path above it
+       is exactly its ancestors: enter(d, key) pops the keys below depth
+       d (the subtree that was just finished) and pushes key.
+
+       Path checking never lets a state onto the path twice, so each key
+       is on the stack at most once.'''
+
+    def __init__(self):
+        self.keys = []
+        self.members = set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.members
+
+    def enter(self, depth, key):
+        '''Make key, at depth (0 for the initial state), the last state on the path'''
+        keys = self.keys
+        members = self.members
+        while len(keys) > depth:
+            members.discard(keys.pop())
+        keys.append(key)
+        members.add(key)
+
+
+class FingerprintTable:
+    '''Compact closed set for full cycle checking (cc_level
+       'fingerprint'): a map from hashable_state() keys to g-values that
+       stores only a 64-bit fingerprint of each key. Integer keys (e.g.
+       Zobrist keys or packed states) are mixed 64 bits at a time, so
+       distinct keys of up to 64 bits never share a fingerprint and wider
+       ones differing in any bit rarely do; other keys are fingerprinted
+       by mixing hash(). Fingerprints and g-values are kept in two arrays
+       forming an open addressing hash table with linear probing, with a
+       third marking the slots in use, which is doubled when it becomes
+       more than max_load full.
+
+       Two different keys with the same fingerprint would be taken for the
+       same state. With verify=True the table also keeps the key of each
+       fingerprint, and keys whose fingerprint is already taken by another
+       key are stored in a separate dictionary, so the table behaves
+       exactly like a dict (at the cost of storing the keys again).
+
+       Supports the parts of the mapping protocol the search engine uses:
+       in, [], []=, get and len.'''
+
+    def __init__(self, capacity=1024, verify=False, max_load=0.7):
+        bits = 1
+        while (1 << bits) < capacity:
+            bits = bits + 1
+        self.max_load = max_load
+        self._allocate(bits)
+        self.count = 0
+        # with verify: the key of each fingerprint, and the keys whose
+        # fingerprint belongs to another key
+        self.keys = dict() if verify else None
+        self.overflow = dict() if verify else None
+
+    def _allocate(self, bits):
+        self.bits = bits
+        self.capacity = 1 << bits
+        self.fingerprints = array('Q', bytes(8 * self.capacity))
+        self.gvals = array('d', bytes(8 * self.capacity))
+        self.used = bytearray(self.capacity)
+
+    def _fingerprint(self, key):
+        if type(key) is not int:
+            return _mix64(hash(key) & _FP_MASK)
+        if 0 <= key <= _FP_MASK:
+            return _mix64(key)
+        # wider or negative integers: fold in 64 bits at a time, starting
+        # from a value that marks them apart from the 64-bit keys
+        fp = _FP_MULTIPLIER if key > 0 else ~_FP_MULTIPLIER & _FP_MASK
+        if key < 0:
+            key = ~key
+        while True:
+            fp = _mix64(fp ^ (key & _FP_MASK))
+            key = key >> 64
+            if not key:
+                return fp
+
+    def _slot(self, fp):
+        '''Return the slot holding fp, or the empty slot where it would go'''
+        fingerprints = self.fingerprints
+        used = self.used
+        mask = self.capacity - 1
+        i = fp >> (64 - self.bits)
+        while used[i] and fingerprints[i] != fp:
+            i = (i + 1) & mask
+        return i
+
+    def __len__(self):
+        if self.overflow is not None:
+            return self.count + len(self.overflow)
+        return self.count
+
+    def __contains__(self, key):
+        if self.overflow is not None and key in self.overflow:
+            return True
+        fp = self._fingerprint(key)
+        if not self.used[self._slot(fp)]:
+            return False
+        return self.keys is None or self.keys[fp] == key
+
+    def __getitem__(self, key):
+        if self.overflow is not None and key in self.overflow:
+            return self.overflow[key]
+        fp = self._fingerprint(key)
+        i = self._slot(fp)
+        if not self.used[i] or (self.keys is not None and self.keys[fp] != key):
+            raise KeyError(key)
+        return self.gvals[i]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, gval):
+        fp = self._fingerprint(key)
+        i = self._slot(fp)
+        if not self.used[i]:
+            self.used[i] = 1
+            self.fingerprints[i] = fp
+            self.gvals[i] = gval
+            self.count = self.count + 1
+            if self.keys is not None:
+                self.keys[fp] = key
+            if self.count > self.max_load * self.capacity:
+                self._grow()
+        elif self.keys is not None and self.keys[fp] != key:
+            self.overflow[key] = gval
+        else:
+            self.gvals[i] = gval
+
+    def _grow(self):
+        '''Double the capacity and reinsert every fingerprint'''
+        fingerprints = self.fingerprints
+        gvals = self.gvals
+        used = self.used
+        self._allocate(self.bits + 1)
+        for j in range(len(fingerprints)):
+            if used[j]:
+                i = self._slot(fingerprints[j])
+                self.used[i] = 1
+                self.fingerprints[i] = fingerprints[j]
+                self.gvals[i] = gvals[j]
+
+    def __repr__(self):
+        return 'FingerprintTable({} entries)'.format(len(self))
+
+    def memory_size(self):
+        '''Approximate number of bytes used by the table (with verify, not
+           counting the key objects themselves)'''
+        size = (self.fingerprints.itemsize * len(self.fingerprints) + self.gvals.itemsize * len(self.gvals) +
+                len(self.used))
+        if self.keys is not None:
+            size = size + sys.getsizeof(self.keys) + sys.getsizeof(self.overflow)
+        return size
+
+
 class SearchEngine:
-    def __init__(self, strategy='depth_first', cc_level='default'):
-        self.set_strategy(strategy, cc_level)
+    def __init__(self, strategy='depth_first', cc_level='default', open_type='default'):
+        self.set_strategy(strategy, cc_level, open_type)
         self.trace = 0
+        self.event_log = None
+        self.event_log_owned = False
+        self.event_log_level = 0
+        self.trace_detail = 0
+        self.tie_break = 'default'
+        self.node_store = 'default'
+        self.transposition_table_size = None
+        self.lazy = False
+        self.heur_cache = None
+        self.profile_interval = None
+        self.profile = None
+        self.verify_keys = False
+        self.expansion_budget = None
+        self.beam_width = _BEAM_WIDTH
+        self.successor_filter = None
 
     def initStats(self):
         sNode.n = 0
         StateSpace.n = 1  # initial state already generated
+        # this engine's values of sNode.n and StateSpace.n, swapped into
+        # the class counters while it searches (see _resume_counters)
+        self.node_count = 0
+        self.state_count = 1
         self.cycle_check_pruned = 0
         self.cost_bound_pruned = 0
+        self.filter_pruned = 0
+        self.max_open_size = 0
+        self.key_collisions = 0
 
     def trace_on(self, level=1):
         '''For debugging, set tracking level 1 or 2'''
@@ -300,17 +1513,174 @@ class SearchEngine:
         '''Turn off tracing'''
         self.trace = 0
 
-    def set_strategy(self, s, cc='default'):
-        if not s in ['depth_first', 'breadth_first', 'ucs', 'best_first', 'astar', 'custom']:
+    def set_event_log(self, log=None, level=2):
+        '''Write the trace of each search as a stream of events to log, a
+           file name or an open text file, one JSON object per line
+           (NDJSON). Events are recorded up to the given trace level
+           whether or not tracing is on, and trace_viewer.py turns a log
+           back into the text trace_on would have printed (see
+           render_trace_event). None stops logging, closing the file if it
+           was opened by name. Takes effect at the next init_search.'''
+        if self.event_log_owned:
+            self.event_log.close()
+        self.event_log_owned = False
+        if isinstance(log, str):
+            log = open(log, 'w')
+            self.event_log_owned = True
+        self.event_log = log
+        self.event_log_level = level
+
+    def _emit(self, event):
+        '''Record a trace event: write it to the event log, and print it if
+           the trace level is high enough'''
+        if self.event_log is not None:
+            self.event_log.write(json.dumps(event) + '\n')
+        if self.trace >= event['level']:
+            print(render_trace_event(event), end="")
+
+    def set_tie_break(self, policy='default'):
+        '''Set how the priority queue strategies order nodes with equal
+           priority: 'deeper' (greatest gval first), 'fifo', 'lifo', or a
+           function of the node returning a value where smaller values are
+           expanded first. 'default' keeps the original order: greatest
+           gval first for astar, and for ties that remain, and for the
+           other strategies, whatever order the heap leaves nodes in.
+           Takes effect at the next init_search.'''
+        if not callable(policy) and not policy in ['default', 'deeper', 'fifo', 'lifo']:
+            print('Unknown tie breaking policy', policy)
+            print("Must be a function or one of ['default', 'deeper', 'fifo', 'lifo']")
+        else:
+            self.tie_break = policy
+
+    def set_node_store(self, store='default'):
+        '''Set how generated nodes are remembered. 'default' keeps every
+           state object alive through its parent pointer. 'compact' keeps
+           expanded nodes only as rows of a NodeArena (g, h, parent row,
+           action code and hashable_state() key) and rebuilds the path of
+           the goal state when it is returned. Takes effect at the next
+           init_search.'''
+        if not store in ['default', 'compact']:
+            print('Unknown node store', store)
+            print("Must be one of ['default', 'compact']")
+        else:
+            self.node_store = store
+
+    def set_transposition_table(self, max_entries=None):
+        '''Give the iterative deepening strategies (ida_star and iddfs) a
+           transposition table remembering, for up to max_entries states,
+           the lowest g-value (depth for iddfs) each state has been
+           reached with. It is kept across iterations, and a state reached
+           again with a higher value, or with the same value in the same
+           iteration, is pruned. When the table is full, states already in
+           it are still updated but no new states are added. None (the
+           default) disables the table. Takes effect at the next
+           init_search.'''
+        if max_entries is not None and max_entries <= 0:
+            print('Transposition table size must be positive or None')
+        else:
+            self.transposition_table_size = max_entries
+
+    def set_heuristic_cache(self, cache=None):
+        '''Memoise the heuristic function given to init_search with cache,
+           a HeuristicCache (None to stop caching). Passing the same cache
+           to later init_search calls on the same problem, e.g. in an
+           iterative weighted astar loop, reuses the values it already
+           holds; using it on another problem clears it. Takes effect at the
+           next init_search.'''
+        self.heur_cache = cache
+
+    def set_lazy(self, lazy=True):
+        '''Turn lazy mode on or off for the OPEN based strategies. In lazy
+           mode successors are generated with StateSpace.iter_successors(),
+           so they are cycle checked before their state objects are built,
+           and are put on OPEN with their parent's h-value. A node's own
+           h-value is only computed when it is extracted from OPEN; if that
+           changes its priority it goes back on OPEN before it can be
+           expanded, so heuristic calls are saved on every node that is
+           never extracted. The hval cost bound is checked at that point
+           too. Takes effect at the next search.'''
+        self.lazy = lazy
+
+    def set_key_verification(self, verify=True):
+        '''Turn key verification on or off for full cycle checking in the
+           OPEN based strategies. With verification on, the engine also
+           remembers each state's full_state(), and when a state has the
+           same hashable_state() as a different state seen before (possible
+           with Zobrist keys) it is keyed by (key, full_state) instead, so
+           the two are not mistaken for each other. The number of such
+           collisions is kept in self.key_collisions. Takes effect at the
+           next init_search.'''
+        self.verify_keys = verify
+
+    def set_successor_filter(self, prune=None):
+        '''Prune successors with prune, a function of a successor state
+           returning True if the state should not be searched, e.g. because
+           it is known to be a dead end (see sokoban_deadlock.py). It is
+           called after cycle checking and before the heuristic, with the
+           successor's parent set, so it can look at what the last action
+           changed. The number of states pruned is reported in
+           SearchStats.states_pruned_filter. None removes the filter.
+           Takes effect at the next search.'''
+        self.successor_filter = prune
+
+    def _verified_key(self, state, key):
+        '''Return the cycle check key of state, whose hashable_state() is
+           key (see set_key_verification)'''
+        full_state = state.full_state()
+        seen = self.key_states.setdefault(key, full_state)
+        if seen == full_state:
+            return key
+        self.key_collisions = self.key_collisions + 1
+        return (key, full_state)
+
+    def set_beam_width(self, width=_BEAM_WIDTH):
+        '''Set the number of nodes the 'beam' strategy keeps in each
+           layer. Takes effect at the next search.'''
+        if width < 1:
+            print('Beam width must be at least 1')
+        else:
+            self.beam_width = width
+
+    def set_profiling(self, profile=True, sample_interval=100):
+        '''Turn profiling on or off. With profiling on, each search records
+           a SearchProfile (returned in its SearchStats): expansions per
+           second, mean and peak OPEN size, a histogram of the f-values
+           (g + h) of expanded nodes, and estimated time per phase, from
+           timing one in every sample_interval iterations of the search
+           loop. Takes effect at the next search.'''
+        if profile and sample_interval < 1:
+            print('Profiling sample interval must be at least 1')
+        elif profile:
+            self.profile_interval = sample_interval
+        else:
+            self.profile_interval = None
+
+    def set_strategy(self, s, cc='default', open_type='default'):
+        if not s in ['depth_first', 'breadth_first', 'ucs', 'best_first', 'astar', 'custom', 'ida_star', 'iddfs',
+                     'arastar', 'dfbnb', 'beam']:
             print('Unknown search strategy specified:', s)
-            print("Must be one of 'depth_first', 'ucs', 'breadth_first', 'best_first', 'custom' or 'astar'")
-        elif not cc in ['default', 'none', 'path', 'full']:
+            print("Must be one of 'depth_first', 'ucs', 'breadth_first', 'best_first', 'custom', 'astar', "
+                  "'ida_star', 'iddfs', 'arastar', 'dfbnb' or 'beam'")
+        elif not cc in ['default', 'none', 'path', 'full', 'fingerprint']:
             print('Unknown cycle check level', cc)
-            print("Must be one of ['default', 'none', 'path', 'full']")
+            print("Must be one of ['default', 'none', 'path', 'full', 'fingerprint']")
+        elif cc in ['full', 'fingerprint'] and s in ['ida_star', 'iddfs']:
+            print('Full cycle checking is not available for iterative deepening strategies')
+            print("Use 'path' cycle checking and/or set_transposition_table")
+        elif cc in ['none', 'path'] and s == 'arastar':
+            print('arastar requires full cycle checking')
+            print("Must be one of ['default', 'full', 'fingerprint']")
+        elif not open_type in ['default', 'heap', 'indexed', 'bucket']:
+            print('Unknown open list type', open_type)
+            print("Must be one of ['default', 'heap', 'indexed', 'bucket']")
+        elif open_type in ['indexed', 'bucket'] and s in ['depth_first', 'breadth_first', 'ida_star', 'iddfs',
+                                                          'arastar', 'dfbnb', 'beam']:
+            print('The', open_type, 'open list is only available for priority queue strategies')
+            print("Must be one of 'ucs', 'best_first', 'custom' or 'astar'")
 
         else:
             if cc == 'default':
-                if s == 'depth_first':
+                if s in ['depth_first', 'ida_star', 'iddfs', 'dfbnb']:
                     self.cycle_check = _CC_PATH
                 else:
                     self.cycle_check = _CC_FULL
@@ -318,8 +1688,9 @@ class SearchEngine:
                 self.cycle_check = _CC_NONE
             elif cc == 'path':
                 self.cycle_check = _CC_PATH
-            elif cc == 'full':
+            elif cc in ['full', 'fingerprint']:
                 self.cycle_check = _CC_FULL
+            self.cc_fingerprints = cc == 'fingerprint'
 
             if s == 'depth_first':
                 self.strategy = _DEPTH_FIRST
@@ -333,6 +1704,23 @@ class SearchEngine:
                 self.strategy = _ASTAR
             elif s == 'custom':
                 self.strategy = _CUSTOM
+            elif s == 'ida_star':
+                self.strategy = _IDA_STAR
+            elif s == 'iddfs':
+                self.strategy = _IDDFS
+            elif s == 'arastar':
+                self.strategy = _ARASTAR
+            elif s == 'dfbnb':
+                self.strategy = _DFBNB
+            elif s == 'beam':
+                self.strategy = _BEAM
+
+            if open_type == 'indexed':
+                self.open_type = _OPEN_INDEXED
+            elif open_type == 'heap':
+                self.open_type = _OPEN_HEAP
+            else:
+                self.open_type = _OPEN_BUCKET
 
     def get_strategy(self):
         if self.strategy == _DEPTH_FIRST:
@@ -347,6 +1735,16 @@ class SearchEngine:
             rval = 'astar'
         elif self.strategy == _CUSTOM:
             rval = 'custom'
+        elif self.strategy == _IDA_STAR:
+            rval = 'ida_star'
+        elif self.strategy == _IDDFS:
+            rval = 'iddfs'
+        elif self.strategy == _ARASTAR:
+            rval = 'arastar'
+        elif self.strategy == _DFBNB:
+            rval = 'dfbnb'
+        elif self.strategy == _BEAM:
+            rval = 'beam (width {})'.format(self.beam_width)
 
         rval = rval + ' with '
 
@@ -356,6 +1754,17 @@ class SearchEngine:
             rval = rval + 'path checking'
         elif self.cycle_check == _CC_FULL:
             rval = rval + 'full cycle checking'
+            if self.cc_fingerprints:
+                rval = rval + ' on state fingerprints'
+
+        if self.open_type == _OPEN_INDEXED:
+            rval = rval + ' using an indexed open list'
+
+        if self.node_store == 'compact':
+            rval = rval + ' (compact node store)'
+
+        if self.transposition_table_size is not None and self.strategy in (_IDA_STAR, _IDDFS):
+            rval = rval + ' and a transposition table'
 
         return rval
 
@@ -380,26 +1789,89 @@ class SearchEngine:
 
         self.initStats()
 
+        if self.heur_cache is not None:
+            self.heur_cache.use(heur_fn, initState)
+            heur_fn = self.heur_cache
+
+        self._set_trace_detail()
         # BEGIN TRACING
-        if self.trace:
-            print("   TRACE: Search Strategy: ", self.get_strategy())
-            print("   TRACE: Initial State:", end="")
-            initState.print_state()
+        if self.trace_detail:
+            self._emit({'e': 'init', 'level': 1, 'strategy': self.get_strategy(), 'state': _state_text(initState)})
         # END
-        self.open = Open(self.strategy)
+        self.open = self._make_open()
+
+        root_key = initState.hashable_state()
+        node = sNode(initState, heur_fn(initState), fval_function, root_key)
+        self.root_node = node
 
-        node = sNode(initState, heur_fn(initState), fval_function)
+        if self.transposition_table_size is not None:
+            self.transposition_table = dict()
+        else:
+            self.transposition_table = None
+
+        # with the compact node store, nodes are recorded in the arena and
+        # states drop their parent pointers once they are put on OPEN.
+        self.init_state = initState
+        if self.node_store == 'compact' and not self.strategy in (_IDA_STAR, _IDDFS, _ARASTAR, _DFBNB, _BEAM):
+            self.arena = NodeArena()
+            node.arena_index = self.arena.add(root_key, initState.gval, node.hval, -1, initState.action)
+        else:
+            self.arena = None
 
         # the cycle check dictionary stores the cheapest path (g-val) found
         # so far to a state.
         if self.cycle_check == _CC_FULL:
-            self.cc_dictionary = dict()
-            self.cc_dictionary[initState.hashable_state()] = initState.gval
+            self.cc_dictionary = self._closed_set()
+            self.cc_dictionary[root_key] = initState.gval
+
+        # with key verification, the full state of every key seen so far
+        if self.verify_keys and self.cycle_check == _CC_FULL:
+            self.key_states = {root_key: initState.full_state()}
+        else:
+            self.key_states = None
+
+        # the iteration a timed out iterative deepening search was in
+        self.id_progress = None
+        # the best goal dfbnb has found so far, and the successors of the
+        # current layer that beam search chooses its next layer from
+        self.incumbent = None
+        self.beam_candidates = []
+
+        # depth first searches keep the keys of the current path in a
+        # PathSet, so path checking does not walk the parent chain
+        if self.cycle_check == _CC_PATH and self.strategy in (_DEPTH_FIRST, _IDA_STAR, _IDDFS, _DFBNB):
+            self.path_set = PathSet()
+        else:
+            self.path_set = None
 
         self.open.insert(node)
         self.fval_function = fval_function
         self.goal_fn = goal_fn
         self.heur_fn = heur_fn
+        self._suspend_counters()
+
+    def _make_open(self):
+        '''Return an empty OPEN set for the engine's strategy'''
+        if self.strategy in (_IDA_STAR, _IDDFS):
+            # iterative deepening restarts each iteration from the initial
+            # node using its own depth-first stack
+            return Open(_DEPTH_FIRST)
+        if self.strategy == _ARASTAR:
+            # replaced by anytime_search, which re-keys OPEN for each weight
+            return IndexedOpen(_ASTAR, self.tie_break)
+        if self.strategy == _DFBNB:
+            return Open(_DEPTH_FIRST)
+        if self.strategy == _BEAM:
+            # holds the layer being expanded
+            return Open(_BREADTH_FIRST)
+        if self.open_type == _OPEN_INDEXED:
+            return IndexedOpen(self.strategy, self.tie_break)
+        if (self.open_type == _OPEN_BUCKET and self.strategy in (_UCS, _BEST_FIRST, _ASTAR, _CUSTOM) and
+                not callable(self.tie_break)):
+            # costs and heuristic values are almost always integers; if
+            # not, the bucket queue hands over to a heap by itself
+            return BucketOpen(self.strategy, self.tie_break)
+        return Open(self.strategy, self.tie_break)
 
     def search(self, timebound=None, costbound=None):
         """
@@ -410,23 +1882,413 @@ class SearchEngine:
 
         This code will return a goal path (if one is found) as well as a SearchStat object containing
         statistics about the given search (assuming a solution is found).
+
+        If the timebound runs out, OPEN and the cycle check dictionary (for iterative deepening, the
+        iteration in progress) are kept, so calling search again carries on where this call stopped,
+        with a new time slice. The statistics other than the search time cover the whole search.
         """
 
         ###NOW do the search and return the result
+        self._start_clock(timebound)
+
+        if self.strategy == _ARASTAR:
+            # run the anytime search to the end (or the timebound) and
+            # return the best solution it found
+            goal_state = False
+            for goal_state, stats in self.anytime_search(timebound, costbound):
+                pass
+            return goal_state, self._search_stats()
+
+        goal_state, stats = self._run(costbound)
+        if goal_state is None and self.incumbent is not None:
+            # dfbnb ran out of time: return the best solution it found
+            return self.incumbent.state, stats
+        if not goal_state:  # exited the while without finding goal---search failed
+            return False, stats
+        return goal_state, stats
+
+    def _run(self, costbound):
+        '''Run the search loop of the engine's strategy and return the goal
+           state (or False, or None, as returned by _searchOpen) and the
+           SearchStats'''
+        if self.strategy in (_IDA_STAR, _IDDFS):
+            goal_node = self._searchIterativeDeepening(self.goal_fn, self.heur_fn, costbound)
+        elif self.strategy == _DFBNB:
+            goal_node = self._searchBranchAndBound(self.goal_fn, self.heur_fn, costbound)
+        elif self.strategy == _BEAM:
+            goal_node = self._searchBeam(self.goal_fn, self.heur_fn, costbound)
+        else:
+            goal_node = self._searchOpen(self.goal_fn, self.heur_fn, self.fval_function, costbound)
+
+        stats = self._search_stats()
+
+        if goal_node:
+            if self.arena is not None:
+                return self.arena.rebuild_path(goal_node.arena_index, self.init_state), stats
+            return goal_node.state, stats
+        return goal_node, stats
+
+    def step(self, max_expansions, costbound=None, timebound=None):
+        """
+        Run the search set up by init_search for at most max_expansions iterations (nodes taken off
+        OPEN), then return control to the caller. Used to run many searches in one thread, taking
+        turns (see scheduler.py); each engine keeps its own counters, so steps of different engines
+        can be interleaved freely.
+
+        @param max_expansions: the number of nodes to take off OPEN in this step.
+        @param costbound: the cost bound 3-tuple for pruning, as specified in the assignment.
+        @param timebound: the maximum amount of time, in seconds, to spend on this step.
+
+        Returns a pair (result, SearchStats), where result is the goal state if one was found, False
+        if the search space is exhausted, or None if the search stopped first and the next step
+        carries on from there.
+        """
+        if self.strategy == _ARASTAR:
+            print('step is not available for arastar, use anytime_search')
+            return False, None
+        self._start_clock(timebound)
+        self.expansion_budget = max_expansions
+        try:
+            return self._run(costbound)
+        finally:
+            self.expansion_budget = None
+
+    def search_slices(self, max_expansions=1000, costbound=None):
+        """
+        Generator running the search set up by init_search in steps of max_expansions iterations
+        (see step). Yields a (result, SearchStats) pair after every step; result is None until the
+        last step, which yields the goal state or False.
+        """
+        while True:
+            result, stats = self.step(max_expansions, costbound)
+            yield result, stats
+            if result is not None:
+                return
+
+    def save_checkpoint(self, path):
+        '''Write the search so far to path, so that load_checkpoint can
+           carry it on later, in this or another process: OPEN (or the
+           iteration in progress, for iterative deepening), the cycle
+           check dictionary and the other tables, the counters, and the
+           engine's settings. Use it between calls of search.
+
+           The file is a zlib compressed pickle, so the states must be
+           picklable. Each state's parent chain is stored as indices into
+           a flat list of states, so long paths do not make pickle
+           recurse. The goal, heuristic and f-value functions are not
+           saved and must be given to load_checkpoint again.'''
+        if self.strategy == _ARASTAR:
+            print('Checkpoints are not available for arastar')
+            return
+
+        states = []
+        parents = []
+        state_ids = dict()
+
+        def state_id(state):
+            # number state and its ancestors not numbered yet
+            first = state
+            while state is not None and id(state) not in state_ids:
+                state_ids[id(state)] = len(states)
+                saved = copy.copy(state)
+                saved.parent = None
+                states.append(saved)
+                parents.append(state.parent)
+                state = state.parent
+            return state_ids[id(first)]
+
+        def node_record(node):
+            return (state_id(node.state), node.hval, node.key, node.arena_index, node.hval_deferred, node.depth,
+                    node.index)
+
+        frontier = [node_record(node) for node in self.open.restore_order()]
+        root = node_record(self.root_node)
+        incumbent = node_record(self.incumbent) if self.incumbent is not None else None
+        beam_candidates = [node_record(node) for node in self.beam_candidates]
+        init_state = state_id(self.init_state)
+        id_progress = None
+        if self.id_progress is not None:
+            iteration, bound, next_bound, stack = self.id_progress
+            id_progress = (iteration, bound, next_bound, [(node_record(node), depth) for node, depth in stack])
+        parents = [-1 if parent is None else state_ids[id(parent)] for parent in parents]
+
+        checkpoint = {
+            'settings': (self.strategy, self.cycle_check, self.cc_fingerprints, self.open_type, self.tie_break,
+                         self.node_store, self.transposition_table_size, self.lazy, self.verify_keys),
+            'counters': (self.node_count, self.state_count, self.cycle_check_pruned, self.cost_bound_pruned,
+                         self.max_open_size, self.key_collisions, self.filter_pruned),
+            'states': states,
+            'parents': parents,
+            'init_state': init_state,
+            'root': root,
+            'frontier': frontier,
+            'id_progress': id_progress,
+            'incumbent': incumbent,
+            'beam_candidates': beam_candidates,
+            'cc_dictionary': self.cc_dictionary if self.cycle_check == _CC_FULL else None,
+            'key_states': self.key_states,
+            'transposition_table': self.transposition_table,
+            'path_set': self.path_set,
+            'arena': self.arena,
+        }
+        data = zlib.compress(pickle.dumps(checkpoint, pickle.HIGHEST_PROTOCOL))
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(_CHECKPOINT_MAGIC)
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self, path, goal_fn, heur_fn=_zero_hfn, fval_function=_fval_function):
+        """
+        Restore a search written by save_checkpoint, in place of init_search. Call search to carry it on.
+
+        @param path: the checkpoint file.
+        @param goal_fn: the goal function for the puzzle
+        @param heur_fn: the heuristic function the search was using
+        @param fval_function: the f-value function the search was using
+
+        The engine's strategy and settings are those of the saved search. The trace and event log
+        settings, the heuristic cache and profiling are this engine's own.
+        """
+        with open(path, 'rb') as f:
+            magic = f.read(len(_CHECKPOINT_MAGIC))
+            if magic != _CHECKPOINT_MAGIC:
+                raise Exception("{} is not a search checkpoint file".format(path))
+            checkpoint = pickle.loads(zlib.decompress(f.read()))
+
+        (self.strategy, self.cycle_check, self.cc_fingerprints, self.open_type, self.tie_break, self.node_store,
+         self.transposition_table_size, self.lazy, self.verify_keys) = checkpoint['settings']
+        self.initStats()
+        if self.heur_cache is not None:
+            self.heur_cache.use(heur_fn, checkpoint['states'][checkpoint['init_state']])
+            heur_fn = self.heur_cache
+        self._set_trace_detail()
+
+        states = checkpoint['states']
+        for state, parent in zip(states, checkpoint['parents']):
+            if parent >= 0:
+                state.parent = states[parent]
+
+        def make_node(record):
+            state, hval, key, arena_index, hval_deferred, depth, index = record
+            node = sNode(states[state], hval, fval_function, key)
+            node.arena_index = arena_index
+            node.hval_deferred = hval_deferred
+            node.depth = depth
+            node.index = index
+            return node
+
+        self.init_state = states[checkpoint['init_state']]
+        self.root_node = make_node(checkpoint['root'])
+        self.open = self._make_open()
+        for record in checkpoint['frontier']:
+            self.open.insert(make_node(record))
+        self.id_progress = checkpoint['id_progress']
+        if self.id_progress is not None:
+            iteration, bound, next_bound, stack = self.id_progress
+            self.id_progress = (iteration, bound, next_bound, [(make_node(record), depth) for record, depth in stack])
+        self.incumbent = None
+        if checkpoint['incumbent'] is not None:
+            self.incumbent = make_node(checkpoint['incumbent'])
+        self.beam_candidates = [make_node(record) for record in checkpoint['beam_candidates']]
+        if checkpoint['cc_dictionary'] is not None:
+            self.cc_dictionary = checkpoint['cc_dictionary']
+        self.key_states = checkpoint['key_states']
+        self.transposition_table = checkpoint['transposition_table']
+        self.path_set = checkpoint['path_set']
+        self.arena = checkpoint['arena']
+
+        (self.node_count, self.state_count, self.cycle_check_pruned, self.cost_bound_pruned, self.max_open_size,
+         self.key_collisions, self.filter_pruned) = checkpoint['counters']
+        self._resume_counters()
+        self.fval_function = fval_function
+        self.goal_fn = goal_fn
+        self.heur_fn = heur_fn
+
+    def _search_stats(self):
+        '''Return a SearchStats object for the search so far'''
+        self._suspend_counters()
+        total_search_time = os.times()[0] - self.search_start_time
+        cache_hits = cache_misses = None
+        if self.heur_cache is not None:
+            cache_hits = self.heur_cache.hits - self.search_start_cache_hits
+            cache_misses = self.heur_cache.misses - self.search_start_cache_misses
+        if self.profile is not None:
+            self.profile.stop()
+        if self.event_log is not None:
+            self.event_log.flush()
+        closed_set_bytes = None
+        if self.cycle_check == _CC_FULL and self.cc_fingerprints:
+            closed_set_bytes = self.cc_dictionary.memory_size()
+        filter_pruned = self.filter_pruned if self.successor_filter is not None else None
+        return SearchStats(self.node_count, self.state_count, self.cycle_check_pruned, self.cost_bound_pruned,
+                           total_search_time, self.max_open_size, cache_hits, cache_misses, self.profile,
+                           closed_set_bytes, filter_pruned)
+
+    def _closed_set(self):
+        '''Return an empty map from states to g-values for full cycle checking'''
+        if self.cc_fingerprints:
+            return FingerprintTable(verify=self.verify_keys)
+        return dict()
+
+    def _set_trace_detail(self):
+        '''Set the level of detail of the trace events the search records'''
+        self.trace_detail = self.trace
+        if self.event_log is not None and self.event_log_level > self.trace_detail:
+            self.trace_detail = self.event_log_level
+
+    def _resume_counters(self):
+        '''Set the class counters sNode.n and StateSpace.n, which number
+           the nodes and states as they are made, to this engine's values.
+           Engines interleaved in one thread (see step) each swap in their
+           own values when they run, so their counts and numbering do not
+           mix.'''
+        sNode.n = self.node_count
+        StateSpace.n = self.state_count
+
+    def _suspend_counters(self):
+        '''Save the class counters as this engine's values'''
+        self.node_count = sNode.n
+        self.state_count = StateSpace.n
+
+    def _start_clock(self, timebound):
+        '''Record the start of a search (or of a new time slice)'''
+        self._resume_counters()
+        self._set_trace_detail()
         self.search_start_time = os.times()[0]
         self.search_stop_time = None
         if timebound:
             self.search_stop_time = self.search_start_time + timebound
+        if self.heur_cache is not None:
+            self.search_start_cache_hits = self.heur_cache.hits
+            self.search_start_cache_misses = self.heur_cache.misses
+        if self.profile_interval is not None:
+            self.profile = SearchProfile(self.profile_interval)
+        else:
+            self.profile = None
 
-        goal_node = self._searchOpen(self.goal_fn, self.heur_fn, self.fval_function, costbound)
+    def anytime_search(self, timebound=None, costbound=None, weights=_ARA_WEIGHTS):
+        """
+        Anytime repairing A* (ARA*), using the parameters set by init_search.
+
+        Runs weighted A* (f = g + w*h) for each weight in turn, but unlike
+        restarting the search for every weight it keeps its work between
+        iterations: the best g-value found for each state, the OPEN list,
+        and the INCONS list of already expanded states whose g-value has
+        since improved. When the weight is lowered, OPEN and INCONS are
+        merged and re-keyed, so only states whose path cost can still
+        improve are expanded again. An iteration stops as soon as no node
+        on OPEN can lead to a cheaper solution under the current weight.
+
+        This is a generator: iterate over it to receive a
+        (goal state, SearchStats) pair each time a cheaper solution is
+        found, as soon as it is generated (the search carries on from
+        there when the next pair is asked for). It stops when the last
+        weight's iteration is done or the timebound runs out.
 
-        total_search_time = os.times()[0] - self.search_start_time
-        stats = SearchStats(sNode.n, StateSpace.n, self.cycle_check_pruned, self.cost_bound_pruned, total_search_time)
+        @param timebound: the maximum amount of time, in seconds, to spend on this search.
+        @param costbound: the cost bound 3-tuple for pruning, as specified in the assignment.
+        @param weights: the decreasing sequence of heuristic weights to use.
+        """
+        self._start_clock(timebound)
+
+        goal_fn = self.goal_fn
+        heur_fn = self.heur_fn
+        tie_break = 'deeper' if self.tie_break == 'default' else self.tie_break
+
+        root = self.root_node
+        if root.key is None:
+            root.key = root.state.hashable_state()
+        # best g-value found for each state, kept across iterations
+        gvals = self._closed_set()
+        gvals[root.key] = root.gval
+        self.cc_dictionary = gvals
+
+        best = None
+        if goal_fn(root.state):
+            best = root
+            yield root.state, self._search_stats()
+            return
+
+        frontier = [root]
+        incons = dict()
+        successor_filter = self.successor_filter
+        time_check = _TIME_CHECK_INTERVAL
+        for weight in weights:
+            fval = lambda node, w=weight: node.gval + w * node.hval
 
-        if goal_node:
-            return goal_node.state, stats
-        else:  # exited the while without finding goal---search failed
-            return False, stats
+            # BEGIN TRACING
+            if self.trace_detail:
+                self._emit({'e': 'ara_iteration', 'level': 1, 'weight': weight})
+            # END TRACING
+
+            # OPEN = OPEN u INCONS, keyed by the new weight; CLOSED is emptied
+            self.open = IndexedOpen(_CUSTOM, tie_break)
+            for node in frontier:
+                node.fval_function = fval
+                self.open.insert(node)
+            for node in incons.values():
+                node.fval_function = fval
+                self.open.insert(node)
+            incons = dict()
+            closed = set()
+
+            while not self.open.empty():
+                if best is not None and best.gval <= self.open.open[0][0]:
+                    # no node on OPEN can improve on the incumbent at this weight
+                    break
+                if self.search_stop_time:  # timebound check, every _TIME_CHECK_INTERVAL expansions
+                    time_check = time_check - 1
+                    if time_check == 0:
+                        time_check = _TIME_CHECK_INTERVAL
+                        if os.times()[0] > self.search_stop_time:
+                            self._emit({'e': 'timeout', 'level': 0})
+                            return
+
+                node = self.open.extract()
+                closed.add(node.key)
+                if self.profile is not None:
+                    self.profile.expansion(node, len(self.open) + len(incons))
+
+                # BEGIN TRACING
+                if self.trace_detail:
+                    self._emit(dict(_node_event(node), e='pop', level=1, weighted_f=fval(node)))
+                # END TRACING
+
+                for succ in node.state.successors():
+                    hash_state = succ.hashable_state()
+                    if hash_state in gvals and succ.gval >= gvals[hash_state]:
+                        self.cycle_check_pruned = self.cycle_check_pruned + 1
+                        continue
+                    if successor_filter is not None and successor_filter(succ):
+                        self.filter_pruned = self.filter_pruned + 1
+                        continue
+
+                    succ_hval = heur_fn(succ)
+                    if costbound is not None and (succ.gval > costbound[0] or
+                                                  succ_hval > costbound[1] or
+                                                  succ.gval + succ_hval > costbound[2]):
+                        self.cost_bound_pruned = self.cost_bound_pruned + 1
+                        continue
+
+                    gvals[hash_state] = succ.gval
+                    succ_node = sNode(succ, succ_hval, fval, hash_state)
+                    if goal_fn(succ) and (best is None or succ.gval < best.gval):
+                        best = succ_node
+                        yield best.state, self._search_stats()
+                        # other engines may have run while this one was suspended
+                        self._resume_counters()
+                    if hash_state in closed:
+                        # already expanded at this weight: defer to the next iteration
+                        incons[hash_state] = succ_node
+                    else:
+                        self.open.insert(succ_node)
+
+                open_size = len(self.open) + len(incons)
+                if open_size > self.max_open_size:
+                    self.max_open_size = open_size
+
+            frontier = self.open.nodes()
 
     def _searchOpen(self, goal_fn, heur_fn, fval_function, costbound):
         """
@@ -436,122 +2298,749 @@ class SearchEngine:
         @param heur_fn: the heuristic function.
         @param fval_function: the f-value function (only relevant when using a custom search strategy).
         @param costbound: the cost bound 3-tuple, as described in the assignment.
+
+        This is the untraced search loop. Searches that are traced, logged
+        (set_event_log) or profiled run _searchOpenTraced instead, so none
+        of the instrumentation is checked here.
+
+        Returns the goal node, False if OPEN runs out, or None if the search
+        stops first (timebound or expansion budget, see step) and can be
+        carried on.
+        """
+        if self.trace_detail or self.profile is not None:
+            return self._searchOpenTraced(goal_fn, heur_fn, fval_function, costbound)
+
+        open_list = self.open
+        cycle_check = self.cycle_check
+        cc_dictionary = self.cc_dictionary if cycle_check == _CC_FULL else None
+        arena = self.arena
+        key_states = self.key_states
+        path_set = self.path_set
+        stop_time = self.search_stop_time
+        time_check = _TIME_CHECK_INTERVAL
+        budget = self.expansion_budget
+        lazy = self.lazy
+        successor_filter = self.successor_filter
+        # in lazy mode a node whose f-value changes on evaluation may no
+        # longer be first, so for astar and custom it goes back on OPEN.
+        # best_first expands it straight away (deferred evaluation: the
+        # order of OPEN is by the parent's h-value).
+        lazy_reorder = self.strategy in (_ASTAR, _CUSTOM)
+        while not open_list.empty():
+            if stop_time:  # timebound check, every _TIME_CHECK_INTERVAL expansions
+                time_check = time_check - 1
+                if time_check == 0:
+                    time_check = _TIME_CHECK_INTERVAL
+                    if os.times()[0] > stop_time:
+                        # exceeded time bound, must terminate search. The
+                        # next node is still on OPEN, so a later call of
+                        # search carries on from here.
+                        print("TRACE: Search has exceeeded the time bound provided.")
+                        return None
+            if budget is not None:
+                if budget == 0:
+                    return None
+                budget = budget - 1
+
+            node = open_list.extract()
+
+            if lazy and node.hval_deferred:
+                node = self._evaluate_deferred(node, heur_fn, costbound, lazy_reorder)
+                if node is None:
+                    continue
+
+            if goal_fn(node.state):
+                # node at front of OPEN is a goal...search is completed.
+                return node
+
+            # only expand the node if no cheaper path to its state has
+            # been found since it was put on OPEN
+            if cc_dictionary is not None and cc_dictionary[node.key] < node.gval:
+                continue
+
+            if path_set is not None:
+                path_set.enter(node.depth, node.key)
+
+            if lazy:
+                self._expand_lazy(node, costbound)
+            else:
+                for succ in node.state.successors():
+                    hash_state = succ.hashable_state()
+                    if key_states is not None:
+                        hash_state = self._verified_key(succ, hash_state)
+                    if cc_dictionary is not None:
+                        if hash_state in cc_dictionary and succ.gval > cc_dictionary[hash_state]:
+                            self.cycle_check_pruned = self.cycle_check_pruned + 1
+                            continue
+                    elif path_set is not None:
+                        if hash_state in path_set:
+                            self.cycle_check_pruned = self.cycle_check_pruned + 1
+                            continue
+                    elif cycle_check == _CC_PATH and (succ.has_path_cycle() if arena is None
+                                                      else arena.on_path(node.arena_index, hash_state)):
+                        self.cycle_check_pruned = self.cycle_check_pruned + 1
+                        continue
+                    if successor_filter is not None and successor_filter(succ):
+                        self.filter_pruned = self.filter_pruned + 1
+                        continue
+
+                    succ_hval = heur_fn(succ)
+                    if costbound is not None and (succ.gval > costbound[0] or
+                                                  succ_hval > costbound[1] or
+                                                  succ.gval + succ_hval > costbound[2]):
+                        self.cost_bound_pruned = self.cost_bound_pruned + 1
+                        continue
+
+                    # passed all cycle checks and costbound checks ...add to open
+                    succ_node = sNode(succ, succ_hval, node.fval_function, hash_state)
+                    if path_set is not None:
+                        succ_node.depth = node.depth + 1
+                    if arena is not None:
+                        succ.parent = None
+                        succ_node.arena_index = arena.add(hash_state, succ.gval, succ_hval, node.arena_index,
+                                                          succ.action)
+                    open_list.insert(succ_node)
+
+                    # record cost of this path in dictionary.
+                    if cc_dictionary is not None:
+                        cc_dictionary[hash_state] = succ.gval
+
+            open_size = len(open_list)
+            if open_size > self.max_open_size:
+                self.max_open_size = open_size
+
+        # end of while--OPEN is empty and no solution
+        return False
+
+    def _searchOpenTraced(self, goal_fn, heur_fn, fval_function, costbound):
+        """
+        The search loop of _searchOpen with tracing, the event log and
+        profiling. Each successor's hashable_state() and h-value are
+        computed once and used both for the trace and for the search.
         """
+        detail = self.trace_detail
         # BEGIN TRACING
-        if self.trace:
-            print("   TRACE: Initial OPEN: ", self.open.print_open())
+        if detail:
+            self._emit({'e': 'open', 'level': 1, 'nodes': [_node_event(nd) for nd in self.open.nodes()]})
             if self.cycle_check == _CC_FULL:
-                print("   TRACE: Initial CC_Dict:", self.cc_dictionary)
+                self._emit({'e': 'cc_dict', 'level': 1, 'cc': str(self.cc_dictionary)})
         # END TRACING
+        lazy = self.lazy
+        lazy_reorder = self.strategy in (_ASTAR, _CUSTOM)
+        profile = self.profile
+        sampling = False
+        clock = time.perf_counter
+        time_check = _TIME_CHECK_INTERVAL
+        budget = self.expansion_budget
         while not self.open.empty():
+            if self.search_stop_time:  # timebound check, every _TIME_CHECK_INTERVAL expansions
+                time_check = time_check - 1
+                if time_check == 0:
+                    time_check = _TIME_CHECK_INTERVAL
+                    if os.times()[0] > self.search_stop_time:
+                        self._emit({'e': 'timeout', 'level': 0})
+                        return None
+            if budget is not None:
+                if budget == 0:
+                    return None
+                budget = budget - 1
+
+            if profile is not None:
+                sampling = profile.start_iteration()
+                if sampling:
+                    start = clock()
             node = self.open.extract()
+            if sampling:
+                profile.add('open', clock() - start)
+
+            if lazy and node.hval_deferred:
+                if sampling:
+                    start = clock()
+                node = self._evaluate_deferred(node, heur_fn, costbound, lazy_reorder)
+                if sampling:
+                    profile.add('heuristic', clock() - start)
+                if node is None:
+                    continue
 
             # BEGIN TRACING
-            if self.trace:
-                print("   TRACE: Next State to expand: <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(
-                    node.state.index, node.state.action, node.state.hashable_state(), node.gval, node.hval,
-                    node.gval + node.hval))
+            if detail:
+                self._emit(dict(_node_event(node), e='pop', level=1))
                 if node.state.gval != node.gval:
                     print("ERROR: Node gval not equal to state gval!")
             # END TRACING
-            if goal_fn(node.state):
-                # node at front of OPEN is a goal...search is completed.
+            if sampling:
+                start = clock()
+            is_goal = goal_fn(node.state)
+            if sampling:
+                profile.add('goal_test', clock() - start)
+            if is_goal:
+                # BEGIN TRACING
+                if detail:
+                    self._emit(dict(_node_event(node), e='goal', level=1))
+                # END TRACING
                 return node
-            if self.search_stop_time:  # timebound check
-                if os.times()[0] > self.search_stop_time:
-                    # exceeded time bound, must terminate search
-                    print("TRACE: Search has exceeeded the time bound provided.")
-                    return False
-
-            # All states reached by a search node on OPEN have already
-            # been hashed into the self.cc_dictionary. However,
-            # before expanding a node we might have already expanded
-            # an equivalent state with lower g-value. So only expand
-            # the node if the hashed g-value is no greater than the
-            # node's current g-value.
 
             # BEGIN TRACING
-            if self.trace:
-                if self.cycle_check == _CC_FULL: print("   TRACE: CC_dict gval={}, node.gval={}".format(
-                    self.cc_dictionary[node.state.hashable_state()], node.gval))
+            if detail and self.cycle_check == _CC_FULL:
+                self._emit({'e': 'cc_check', 'level': 1, 'cc_g': self.cc_dictionary[node.key], 'g': node.gval})
             # END TRACING
 
-            if self.cycle_check == _CC_FULL and self.cc_dictionary[node.state.hashable_state()] < node.gval:
+            if self.cycle_check == _CC_FULL and self.cc_dictionary[node.key] < node.gval:
                 continue
 
+            if self.path_set is not None:
+                self.path_set.enter(node.depth, node.key)
+
+            if profile is not None:
+                profile.expansion(node, len(self.open))
+
+            if lazy:
+                # in lazy mode heuristic calls happen in _evaluate_deferred,
+                # so the whole expansion is timed as generating successors
+                if sampling:
+                    start = clock()
+                self._expand_lazy(node, costbound)
+                if sampling:
+                    profile.add('successors', clock() - start)
+                open_size = len(self.open)
+                if open_size > self.max_open_size:
+                    self.max_open_size = open_size
+                continue
+
+            if sampling:
+                start = clock()
             successors = node.state.successors()
+            if sampling:
+                profile.add('successors', clock() - start)
+                start = clock()
+            keys = [succ.hashable_state() for succ in successors]
+            if self.key_states is not None:
+                keys = [self._verified_key(succ, key) for succ, key in zip(successors, keys)]
+            if sampling:
+                profile.add('hashing', clock() - start)
 
             # BEGIN TRACING
-            if self.trace:
-                print("   TRACE: Expanding Node. Successors = {", end="")
-                for ss in successors:
-                    print("<S{}:{}:{}, g={}, h={}, f=g+h={}>, ".format(
-                        ss.index, ss.action, ss.hashable_state(), ss.gval, heur_fn(ss), ss.gval + heur_fn(ss)), end="")
-                print("}")
+            hvals = None
+            if detail:
+                # the trace shows the h-value of every successor, so compute
+                # them all up front
+                if sampling:
+                    start = clock()
+                hvals = [heur_fn(succ) for succ in successors]
+                if sampling:
+                    profile.add('heuristic', clock() - start)
+                self._emit({'e': 'expand', 'level': 1,
+                            'successors': [_state_event(succ, key, hval)
+                                           for succ, key, hval in zip(successors, keys, hvals)]})
             # END TRACING
 
-            for succ in successors:
-                hash_state = succ.hashable_state()
-                if self.trace > 1:
-                    if self.cycle_check == _CC_FULL and hash_state in self.cc_dictionary:
-                        print("   TRACE: Already in CC_dict, CC_dict gval={}, successor state gval={}".format(
-                            self.cc_dictionary[hash_state], succ.gval))
-
-                        # BEGIN TRACING
-                if self.trace > 1:
-                    print("   TRACE: Successor State:", end="")
-                    succ.print_state()
-                    print("   TRACE: Heuristic Value:", heur_fn(succ))
-
-                    if self.cycle_check == _CC_FULL and hash_state in self.cc_dictionary:
-                        print("   TRACE: Already in CC_dict, CC_dict gval={}, successor state gval={}".format(
-                            self.cc_dictionary[hash_state], succ.gval))
-
-                    if self.cycle_check == _CC_PATH and succ.has_path_cycle():
-                        print("   TRACE: On cyclic path")
-                # END TRACING
-
+            for i, succ in enumerate(successors):
+                hash_state = keys[i]
                 prune_succ = (self.cycle_check == _CC_FULL and
                               hash_state in self.cc_dictionary and
                               succ.gval > self.cc_dictionary[hash_state]
                               ) or (
                                      self.cycle_check == _CC_PATH and
-                                     succ.has_path_cycle()
+                                     (hash_state in self.path_set if self.path_set is not None
+                                      else succ.has_path_cycle() if self.arena is None
+                                      else self.arena.on_path(node.arena_index, hash_state))
                              )
 
+                # BEGIN TRACING
+                if detail > 1:
+                    event = {'e': 'successor', 'level': 2, 'state': _state_text(succ), 'h': hvals[i]}
+                    if self.cycle_check == _CC_FULL and hash_state in self.cc_dictionary:
+                        event['cc_g'] = self.cc_dictionary[hash_state]
+                        event['g'] = succ.gval
+                    if self.cycle_check == _CC_PATH and prune_succ:
+                        event['path_cycle'] = True
+                    self._emit(event)
+                # END TRACING
+
                 if prune_succ:
                     self.cycle_check_pruned = self.cycle_check_pruned + 1
                     # BEGIN TRACING
-                    if self.trace > 1:
-                        print(" TRACE: Successor State pruned by cycle checking")
-                        print("\n")
-                        # END TRACING
+                    if detail > 1:
+                        self._emit({'e': 'prune', 'level': 2, 'reason': 'cycle'})
+                    # END TRACING
+                    continue
+                if self.successor_filter is not None and self.successor_filter(succ):
+                    self.filter_pruned = self.filter_pruned + 1
+                    # BEGIN TRACING
+                    if detail > 1:
+                        self._emit({'e': 'prune', 'level': 2, 'reason': 'filter'})
+                    # END TRACING
                     continue
 
-                succ_hval = heur_fn(succ)
+                if hvals is not None:
+                    succ_hval = hvals[i]
+                else:
+                    if sampling:
+                        start = clock()
+                    succ_hval = heur_fn(succ)
+                    if sampling:
+                        profile.add('heuristic', clock() - start)
                 if costbound is not None and (succ.gval > costbound[0] or
                                               succ_hval > costbound[1] or
                                               succ.gval + succ_hval > costbound[2]):
                     self.cost_bound_pruned = self.cost_bound_pruned + 1
-                    if self.trace > 1:
-                        print(" TRACE: Successor State pruned, over current cost bound of {}", costbound)
-                        print("\n")
+                    # BEGIN TRACING
+                    if detail > 1:
+                        self._emit({'e': 'prune', 'level': 2, 'reason': 'cost', 'bound': str(costbound)})
+                    # END TRACING
                     continue
 
-                    # passed all cycle checks and costbound checks ...add to open
-                self.open.insert(sNode(succ, succ_hval, node.fval_function))
+                # passed all cycle checks and costbound checks ...add to open
+                succ_node = sNode(succ, succ_hval, node.fval_function, hash_state)
+                if self.path_set is not None:
+                    succ_node.depth = node.depth + 1
+                if self.arena is not None:
+                    succ.parent = None
+                    succ_node.arena_index = self.arena.add(hash_state, succ.gval, succ_hval, node.arena_index,
+                                                           succ.action)
+                if sampling:
+                    start = clock()
+                self.open.insert(succ_node)
+                if sampling:
+                    profile.add('open', clock() - start)
 
                 # BEGIN TRACING
-                if self.trace > 1:
-                    print(" TRACE: Successor State added to OPEN")
-                    print("\n")
+                if detail > 1:
+                    self._emit(dict(_node_event(succ_node), e='push', level=2))
                 # END TRACING
 
                 # record cost of this path in dictionary.
                 if self.cycle_check == _CC_FULL:
                     self.cc_dictionary[hash_state] = succ.gval
 
+            open_size = len(self.open)
+            if open_size > self.max_open_size:
+                self.max_open_size = open_size
+
         # end of while--OPEN is empty and no solution
         return False
 
+    def _evaluate_deferred(self, node, heur_fn, costbound, reorder):
+        """
+        Lazy mode: compute the h-value of nodes extracted from OPEN that
+        still carry their parent's. Each evaluated node is put back on
+        OPEN (if OPEN orders on h) and the first node out is taken
+        instead, until that node's h-value is its own. Returns that node,
+        or None if the node is pruned by the cost bound.
+        """
+        while node.hval_deferred:
+            node.hval = heur_fn(node.state)
+            node.hval_deferred = False
+            if self.arena is not None:
+                self.arena.hvals[node.arena_index] = node.hval
+            # BEGIN TRACING
+            if self.trace_detail > 1:
+                self._emit({'e': 'evaluate', 'level': 2, 'i': node.state.index, 'h': node.hval})
+            # END TRACING
+            if costbound is not None and (node.hval > costbound[1] or
+                                          node.gval + node.hval > costbound[2]):
+                self.cost_bound_pruned = self.cost_bound_pruned + 1
+                return None
+            if reorder:
+                node = self.open.pushpop(node)
+        return node
+
+    def _expand_lazy(self, node, costbound):
+        """
+        Lazy mode: put the successors of node on OPEN. Successors are
+        cycle checked (and checked against the gval cost bound) from the
+        key and g-value given by iter_successors(), before their state
+        objects are built, and are inserted with node's h-value.
+        """
+        cc_dictionary = self.cc_dictionary if self.cycle_check == _CC_FULL else None
+        path_check = self.cycle_check == _CC_PATH
+        path_set = self.path_set
+        for gval, hash_state, make_succ in node.state.iter_successors():
+            succ = None
+            if self.key_states is not None:
+                # verifying the key needs the state itself
+                succ = make_succ()
+                hash_state = self._verified_key(succ, hash_state)
+            if cc_dictionary is not None and hash_state in cc_dictionary and gval > cc_dictionary[hash_state]:
+                self.cycle_check_pruned = self.cycle_check_pruned + 1
+                continue
+            if path_check and (hash_state in path_set if path_set is not None
+                               else node.state.path_contains(hash_state) if self.arena is None
+                               else self.arena.on_path(node.arena_index, hash_state)):
+                self.cycle_check_pruned = self.cycle_check_pruned + 1
+                continue
+            if costbound is not None and gval > costbound[0]:
+                self.cost_bound_pruned = self.cost_bound_pruned + 1
+                continue
+
+            if succ is None:
+                succ = make_succ()
+            if self.successor_filter is not None and self.successor_filter(succ):
+                self.filter_pruned = self.filter_pruned + 1
+                continue
+            succ_node = sNode(succ, node.hval, node.fval_function, hash_state)
+            succ_node.hval_deferred = True
+            if path_set is not None:
+                succ_node.depth = node.depth + 1
+            if self.arena is not None:
+                succ.parent = None
+                succ_node.arena_index = self.arena.add(hash_state, gval, node.hval, node.arena_index, succ.action)
+            self.open.insert(succ_node)
+
+            # BEGIN TRACING
+            if self.trace_detail > 1:
+                self._emit({'e': 'push_deferred', 'level': 2, 'i': succ.index})
+            # END TRACING
+
+            if cc_dictionary is not None:
+                cc_dictionary[hash_state] = gval
+
+    def _searchIterativeDeepening(self, goal_fn, heur_fn, costbound):
+        """
+        Iterative deepening search from the initial node.
+
+        Each iteration is a depth-first search from the initial state that
+        does not go past the current bound: f = g + h for ida_star, the
+        number of actions for iddfs. The next iteration's bound is the
+        smallest value that exceeded the current one. Only the DFS stack
+        (the current path and the unexpanded siblings along it) is kept,
+        plus the transposition table if one has been set.
+
+        @param goal_fn: the goal function.
+        @param heur_fn: the heuristic function.
+        @param costbound: the cost bound 3-tuple, as described in the assignment.
+
+        Returns as _searchOpen does. When the search stops early the
+        iteration in progress is kept in self.id_progress.
+        """
+        ida = self.strategy == _IDA_STAR
+        table = self.transposition_table
+        path_set = self.path_set
+        successor_filter = self.successor_filter
+        root = self.root_node
+        if self.id_progress is not None:
+            # carry on with the iteration the last call ran out of time in
+            iteration, bound, next_bound, stack = self.id_progress
+            self.id_progress = None
+        else:
+            iteration = 0
+            if ida:
+                bound = root.gval + root.hval
+            else:
+                bound = 0
+            stack = None
+
+        profile = self.profile
+        sampling = False
+        clock = time.perf_counter
+        time_check = _TIME_CHECK_INTERVAL
+        budget = self.expansion_budget
+        while True:
+            if stack is None:
+                iteration = iteration + 1
+                next_bound = None
+                # BEGIN TRACING
+                if self.trace_detail:
+                    self._emit({'e': 'iteration', 'level': 1, 'iteration': iteration, 'bound': bound})
+                # END TRACING
+                stack = [(root, 0)]
+
+            while stack:
+                if self.search_stop_time:  # timebound check, every _TIME_CHECK_INTERVAL expansions
+                    time_check = time_check - 1
+                    if time_check == 0:
+                        time_check = _TIME_CHECK_INTERVAL
+                        if os.times()[0] > self.search_stop_time:
+                            self._emit({'e': 'timeout', 'level': 0})
+                            self.id_progress = (iteration, bound, next_bound, stack)
+                            return None
+                if budget is not None:
+                    if budget == 0:
+                        self.id_progress = (iteration, bound, next_bound, stack)
+                        return None
+                    budget = budget - 1
+
+                if profile is not None:
+                    sampling = profile.start_iteration()
+                node, depth = stack.pop()
+
+                # BEGIN TRACING
+                if self.trace_detail:
+                    self._emit(dict(_node_event(node), e='pop', level=1))
+                # END TRACING
+
+                if sampling:
+                    start = clock()
+                is_goal = goal_fn(node.state)
+                if sampling:
+                    profile.add('goal_test', clock() - start)
+                if is_goal:
+                    return node
+
+                if path_set is not None:
+                    path_set.enter(depth, node.key)
+                if profile is not None:
+                    profile.expansion(node, len(stack))
+                succ_depth = depth + 1
+                if sampling:
+                    start = clock()
+                successors = node.state.successors()
+                if sampling:
+                    profile.add('successors', clock() - start)
+                for succ in successors:
+                    if sampling:
+                        start = clock()
+                    hash_state = succ.hashable_state()
+                    if sampling:
+                        profile.add('hashing', clock() - start)
+                    if path_set is not None and hash_state in path_set:
+                        self.cycle_check_pruned = self.cycle_check_pruned + 1
+                        continue
+                    if successor_filter is not None and successor_filter(succ):
+                        self.filter_pruned = self.filter_pruned + 1
+                        continue
+                    if table is not None:
+                        # prune states already reached more cheaply, or
+                        # just as cheaply earlier in this iteration
+                        reached = succ.gval if ida else succ_depth
+                        entry = table.get(hash_state)
+                        if entry is not None and (reached > entry[0] or
+                                                  (reached == entry[0] and entry[1] == iteration)):
+                            self.cycle_check_pruned = self.cycle_check_pruned + 1
+                            continue
+                        if entry is not None or len(table) < self.transposition_table_size:
+                            table[hash_state] = (reached, iteration)
+
+                    if sampling:
+                        start = clock()
+                    succ_hval = heur_fn(succ)
+                    if sampling:
+                        profile.add('heuristic', clock() - start)
+                    if costbound is not None and (succ.gval > costbound[0] or
+                                                  succ_hval > costbound[1] or
+                                                  succ.gval + succ_hval > costbound[2]):
+                        self.cost_bound_pruned = self.cost_bound_pruned + 1
+                        continue
+
+                    if ida:
+                        succ_bound = succ.gval + succ_hval
+                    else:
+                        succ_bound = succ_depth
+                    if succ_bound > bound:
+                        # over this iteration's bound, remember it for the next one
+                        if next_bound is None or succ_bound < next_bound:
+                            next_bound = succ_bound
+                        continue
+
+                    stack.append((sNode(succ, succ_hval, node.fval_function, hash_state), succ_depth))
+
+                if len(stack) > self.max_open_size:
+                    self.max_open_size = len(stack)
+
+            if next_bound is None:
+                # nothing was cut off by the bound, the space is exhausted
+                return False
+            bound = next_bound
+            stack = None
+
+    def _generate(self, node, heur_fn, costbound, bound=None):
+        '''Return the successors of node as sNodes, leaving out those
+           pruned by cycle checking, by costbound, or (if bound is not
+           None) by g + h >= bound. Used by dfbnb and beam, which never
+           expand a state again unless it is reached more cheaply, so a
+           successor no cheaper than the g-value in the cycle check
+           dictionary is pruned.'''
+        cc_dictionary = self.cc_dictionary if self.cycle_check == _CC_FULL else None
+        path_check = self.cycle_check == _CC_PATH
+        successor_filter = self.successor_filter
+        succ_depth = node.depth + 1
+        nodes = []
+        for succ in node.state.successors():
+            hash_state = succ.hashable_state()
+            if self.key_states is not None:
+                hash_state = self._verified_key(succ, hash_state)
+            if cc_dictionary is not None:
+                if hash_state in cc_dictionary and succ.gval >= cc_dictionary[hash_state]:
+                    self.cycle_check_pruned = self.cycle_check_pruned + 1
+                    continue
+            elif path_check and (hash_state in self.path_set if self.path_set is not None
+                                 else succ.has_path_cycle()):
+                self.cycle_check_pruned = self.cycle_check_pruned + 1
+                continue
+            if successor_filter is not None and successor_filter(succ):
+                self.filter_pruned = self.filter_pruned + 1
+                continue
+
+            succ_hval = heur_fn(succ)
+            if costbound is not None and (succ.gval > costbound[0] or
+                                          succ_hval > costbound[1] or
+                                          succ.gval + succ_hval > costbound[2]):
+                self.cost_bound_pruned = self.cost_bound_pruned + 1
+                continue
+            if bound is not None and succ.gval + succ_hval >= bound:
+                self.cost_bound_pruned = self.cost_bound_pruned + 1
+                continue
+
+            succ_node = sNode(succ, succ_hval, node.fval_function, hash_state)
+            succ_node.depth = succ_depth
+            nodes.append(succ_node)
+        return nodes
+
+    def _searchBranchAndBound(self, goal_fn, heur_fn, costbound):
+        """
+        Depth-first branch and bound, from self.open (a stack).
+
+        The successors of a node are pushed so that the one with the lowest
+        g + h is expanded first. A goal that is cheaper than the incumbent
+        (the best goal found so far) becomes the new incumbent, and from
+        then on nodes with g + h >= the incumbent's cost are pruned, when
+        they are generated and again when they are taken off the stack. So
+        with an admissible heuristic the last incumbent is optimal. Goals
+        are not expanded.
+
+        @param goal_fn: the goal function.
+        @param heur_fn: the heuristic function.
+        @param costbound: the cost bound 3-tuple, as described in the assignment.
+
+        Returns the incumbent once the stack is empty (False if no goal was
+        found), or None if the search stops first; the incumbent found so
+        far is kept in self.incumbent.
+        """
+        open_list = self.open
+        path_set = self.path_set
+        cc_dictionary = self.cc_dictionary if self.cycle_check == _CC_FULL else None
+        profile = self.profile
+        time_check = _TIME_CHECK_INTERVAL
+        budget = self.expansion_budget
+        while not open_list.empty():
+            if self.search_stop_time:  # timebound check, every _TIME_CHECK_INTERVAL expansions
+                time_check = time_check - 1
+                if time_check == 0:
+                    time_check = _TIME_CHECK_INTERVAL
+                    if os.times()[0] > self.search_stop_time:
+                        self._emit({'e': 'timeout', 'level': 0})
+                        return None
+            if budget is not None:
+                if budget == 0:
+                    return None
+                budget = budget - 1
+
+            node = open_list.extract()
+            incumbent = self.incumbent
+            if incumbent is not None and node.gval + node.hval >= incumbent.gval:
+                # the bound was tightened after node was pushed
+                self.cost_bound_pruned = self.cost_bound_pruned + 1
+                continue
+            if cc_dictionary is not None and cc_dictionary[node.key] < node.gval:
+                continue
+
+            # BEGIN TRACING
+            if self.trace_detail:
+                self._emit(dict(_node_event(node), e='pop', level=1))
+            # END TRACING
+
+            if goal_fn(node.state):
+                self.incumbent = node
+                # BEGIN TRACING
+                if self.trace_detail:
+                    self._emit(dict(_node_event(node), e='incumbent', level=1))
+                # END TRACING
+                continue
+
+            if path_set is not None:
+                path_set.enter(node.depth, node.key)
+            if profile is not None:
+                profile.expansion(node, len(open_list))
+
+            successors = self._generate(node, heur_fn, costbound,
+                                        incumbent.gval if incumbent is not None else None)
+            # push the most promising successor last, so it is expanded first
+            successors.sort(key=lambda succ_node: succ_node.gval + succ_node.hval, reverse=True)
+            for succ_node in successors:
+                open_list.insert(succ_node)
+                if cc_dictionary is not None:
+                    cc_dictionary[succ_node.key] = succ_node.gval
+
+            if len(open_list) > self.max_open_size:
+                self.max_open_size = len(open_list)
+
+        if self.incumbent is None:
+            return False
+        return self.incumbent
+
+    def _searchBeam(self, goal_fn, heur_fn, costbound):
+        """
+        Beam search: breadth-first, layer by layer, keeping only the
+        self.beam_width successors of each layer with the lowest g + h
+        (ties in the order they were generated). self.open holds the layer
+        being expanded and self.beam_candidates the successors generated
+        from it so far, so memory is bounded by about the beam width times
+        the branching factor. Nodes are goal tested as they are taken off
+        OPEN, in order of g + h within their layer.
+
+        With full cycle checking, a state that has been in a layer is not
+        put in a later one unless it is reached more cheaply, and each
+        state appears at most once in a layer.
+
+        Beam search is incomplete: it fails if every path to a goal is cut
+        from some layer. Returns as _searchOpen does.
+        """
+        open_list = self.open
+        candidates = self.beam_candidates
+        cc_dictionary = self.cc_dictionary if self.cycle_check == _CC_FULL else None
+        profile = self.profile
+        time_check = _TIME_CHECK_INTERVAL
+        budget = self.expansion_budget
+        while True:
+            if open_list.empty():
+                if not candidates:
+                    return False
+                if cc_dictionary is not None:
+                    # keep the cheapest node for each state
+                    cheapest = dict()
+                    for succ_node in candidates:
+                        other = cheapest.get(succ_node.key)
+                        if other is None or succ_node.gval < other.gval:
+                            cheapest[succ_node.key] = succ_node
+                    candidates = cheapest.values()
+                layer = heapq.nsmallest(self.beam_width, candidates,
+                                        key=lambda succ_node: succ_node.gval + succ_node.hval)
+                # BEGIN TRACING
+                if self.trace_detail:
+                    self._emit({'e': 'beam_layer', 'level': 1, 'size': len(layer),
+                                'candidates': len(self.beam_candidates)})
+                # END TRACING
+                candidates = self.beam_candidates = []
+                for succ_node in layer:
+                    open_list.insert(succ_node)
+                    if cc_dictionary is not None:
+                        cc_dictionary[succ_node.key] = succ_node.gval
+
+            if self.search_stop_time:  # timebound check, every _TIME_CHECK_INTERVAL expansions
+                time_check = time_check - 1
+                if time_check == 0:
+                    time_check = _TIME_CHECK_INTERVAL
+                    if os.times()[0] > self.search_stop_time:
+                        self._emit({'e': 'timeout', 'level': 0})
+                        return None
+            if budget is not None:
+                if budget == 0:
+                    return None
+                budget = budget - 1
+
+            node = open_list.extract()
+
+            # BEGIN TRACING
+            if self.trace_detail:
+                self._emit(dict(_node_event(node), e='pop', level=1))
+            # END TRACING
+
+            if goal_fn(node.state):
+                return node
+            if profile is not None:
+                profile.expansion(node, len(open_list) + len(candidates))
 
+            candidates.extend(self._generate(node, heur_fn, costbound))
+            open_size = len(open_list) + len(candidates)
+            if open_size > self.max_open_size:
+                self.max_open_size = open_size
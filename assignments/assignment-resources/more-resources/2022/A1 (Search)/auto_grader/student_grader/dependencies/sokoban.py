@@ -9,13 +9,32 @@
     An encoding of the directions of movement that are possible for robots in Sokoban.
 
     Code also contains a list of 40 Sokoban problems for the purpose of testing.
+
+    Distances and other facts about a level that do not depend on where the
+    boxes and robots are can be looked up in state.analysis() (see
+    sokoban_analysis).
 '''
 
 from search import *
+from array import array
+from sokoban_analysis import level_analysis
+
+# Zobrist tables, shared by all states of rooms with the same number of
+# squares and robots
+_zobrist_tables = dict()
+
+def _zobrist_table(width, height, nrobots):
+    '''Returns the ZobristTable for a room: one feature per robot and square
+       ("robot i on square c") plus one per square ("a box on square c")'''
+    table = _zobrist_tables.get((width * height, nrobots))
+    if table is None:
+        table = ZobristTable(width * height * (nrobots + 1))
+        _zobrist_tables[(width * height, nrobots)] = table
+    return table
 
 class SokobanState(StateSpace):
 
-    def __init__(self, action, gval, parent, width, height, robots, boxes, storage, obstacles):
+    def __init__(self, action, gval, parent, width, height, robots, boxes, storage, obstacles, zobrist_key=None):
         '''
         Creates a new Sokoban state.
         @param width: The room's X dimension (excluding walls).
@@ -24,6 +43,7 @@ class SokobanState(StateSpace):
         @param boxes: A frozenset of all the boxes.
         @param storage: A frozenset of all the storage points.
         @param obstacles: A frozenset of all the impassable obstacles.
+        @param zobrist_key: The state's Zobrist key, if already derived from the parent's (computed from scratch if None).
         '''
         StateSpace.__init__(self, action, gval, parent)
         self.width = width
@@ -32,6 +52,23 @@ class SokobanState(StateSpace):
         self.boxes = boxes
         self.storage = storage
         self.obstacles = obstacles    
+        self.zobrist_table = _zobrist_table(width, height, len(robots))
+        if zobrist_key is None:
+            self.set_zobrist_key(self.zobrist_table)
+        else:
+            self.zobrist_key = zobrist_key
+
+    def __getstate__(self):
+        '''Pickles the state without its ZobristTable, which is shared by every state of the room.'''
+        state = self.__dict__.copy()
+        del state['zobrist_table']
+        return state
+
+    def __setstate__(self, state):
+        '''Unpickles a state, looking its ZobristTable up again (its values are seeded, so they are the same in
+           every process).'''
+        self.__dict__.update(state)
+        self.zobrist_table = _zobrist_table(self.width, self.height, len(self.robots))
 
     def successors(self):
         '''
@@ -39,9 +76,37 @@ class SokobanState(StateSpace):
         '''
         successors = []
         transition_cost = 1
+
+        for action, new_robots, new_boxes, key in self.moves():
+            new_state = SokobanState(action, self.gval + transition_cost, self, self.width, self.height, new_robots, new_boxes, self.storage, self.obstacles, key)
+            successors.append(new_state)
+
+        return successors
+
+    def iter_successors(self):
+        '''
+        Yields (gval, key, make_state) for each successor, with the key derived from this
+        state's before the SokobanState object is built (see StateSpace.iter_successors).
+        '''
+        transition_cost = 1
+        gval = self.gval + transition_cost
+
+        for action, new_robots, new_boxes, key in self.moves():
+            yield gval, key, (lambda action=action, new_robots=new_robots, new_boxes=new_boxes, key=key:
+                SokobanState(action, gval, self, self.width, self.height, new_robots, new_boxes, self.storage, self.obstacles, key))
+
+    def moves(self):
+        '''
+        Generates (action, robots, boxes, zobrist key) for every move that can be performed from this state.
+        The key is this state's key with the moved robot's (and box's) old and new squares toggled.
+        '''
         moved_boxes = frozenset()
+        values = self.zobrist_table.values
+        squares = self.width * self.height
+        box_base = len(self.robots) * squares
 
         for robot in range(0, len(self.robots)):
+          robot_base = robot * squares
           for direction in (UP, RIGHT, DOWN, LEFT):
               new_location = direction.move(self.robots[robot])
               new_robots = list(self.robots);
@@ -61,6 +126,8 @@ class SokobanState(StateSpace):
               if new_location in moved_boxes:
                   continue
               
+              key = (self.zobrist_key ^ values[robot_base + self.robots[robot][1] * self.width + self.robots[robot][0]]
+                     ^ values[robot_base + new_location[1] * self.width + new_location[0]])
               if new_location in self.boxes:
                   new_box_location = direction.move(new_location)
                   
@@ -78,19 +145,54 @@ class SokobanState(StateSpace):
                   new_boxes.remove(new_location)
                   new_boxes.add(new_box_location)
                   new_moved_boxes.add(new_box_location)
+                  key = (key ^ values[box_base + new_location[1] * self.width + new_location[0]]
+                         ^ values[box_base + new_box_location[1] * self.width + new_box_location[0]])
               
               new_robots = list(self.robots)
               new_robots[robot] = new_location
               new_robots = tuple(new_robots)
 
-              new_state = SokobanState(str(robot) + " " + direction.name, self.gval + transition_cost, self, self.width, self.height, new_robots, frozenset(new_boxes), self.storage, self.obstacles)
-              successors.append(new_state)
-
-        return successors
+              yield str(robot) + " " + direction.name, new_robots, frozenset(new_boxes), key
 
     def hashable_state(self):
         '''Return a data item that can be used as a dictionary key to UNIQUELY represent a state.'''
-        return hash((self.robots, self.boxes))       
+        return self.zobrist_key
+
+    def zobrist_features(self):
+        '''Returns the state's features in its ZobristTable (see _zobrist_table).'''
+        squares = self.width * self.height
+        for i, robot in enumerate(self.robots):
+            yield i * squares + robot[1] * self.width + robot[0]
+        box_base = len(self.robots) * squares
+        for box in self.boxes:
+            yield box_base + box[1] * self.width + box[0]
+
+    def full_state(self):
+        '''Returns the robots and boxes, which determine the state exactly.'''
+        return (self.robots, self.boxes)
+
+    def problem_key(self):
+        '''Returns the level: the room's size, obstacles and storage points, which all its states share.'''
+        return (self.width, self.height, self.obstacles, self.storage)
+
+    def analysis(self):
+        '''Returns the LevelAnalysis of this state's level (see sokoban_analysis), shared by all of its states.'''
+        return level_analysis(self)
+
+    def pack_state(self):
+        '''Returns the squares of the robots, in order, and of the boxes, sorted, as 16-bit numbers.'''
+        squares = [robot[1] * self.width + robot[0] for robot in self.robots]
+        squares.extend(sorted(box[1] * self.width + box[0] for box in self.boxes))
+        return array('H', squares).tobytes()
+
+    def unpack_state(self, data, action, gval, parent=None):
+        '''Returns the state of this level packed by pack_state.'''
+        squares = array('H')
+        squares.frombytes(data)
+        nrobots = len(self.robots)
+        robots = tuple((square % self.width, square // self.width) for square in squares[:nrobots])
+        boxes = frozenset((square % self.width, square // self.width) for square in squares[nrobots:])
+        return SokobanState(action, gval, parent, self.width, self.height, robots, boxes, self.storage, self.obstacles)
 
     def state_string(self):
         '''Returns a string representation fo a state that can be printed to stdout.'''        
@@ -0,0 +1,248 @@
+'''Sokoban level analysis routines.
+
+    A) Class LevelAnalysis
+
+      Everything about a level that does not depend on where the boxes
+      and robots are, computed once per level: the room's width, height,
+      obstacles and storage points. It holds
+
+        - push distances between all pairs of squares: the least number
+          of pushes that moves a box from one square to the other if
+          there were no other boxes, and the push distance from every
+          square to every storage point;
+        - walk distances between all pairs of squares, for a robot with
+          no boxes in its way;
+        - the dead squares (from which no storage point can be reached)
+          and, for every square, the storage points a box on it can reach;
+        - the rooms (connected parts of the floor), and the tunnel and
+          articulation squares: squares with walls on both sides, and
+          squares whose blocking splits a room in two.
+
+      Distances that cannot be achieved are float('inf'), so sums of them
+      are infinite too.
+
+    B) The analysis cache
+
+      level_analysis(state) returns the analysis of a state's level,
+      building it the first time; every state type with width, height,
+      storage and obstacles works, and SokobanState.analysis() is a
+      shortcut for it. A heuristic can therefore look its distances up
+      instead of computing them, e.g.
+
+        def heur(state):
+            analysis = state.analysis()
+            return sum(analysis.nearest_storage[box] for box in state.boxes)
+
+      which is heur_nearest_storage below. The analyses are kept in
+      memory for the whole run; use_cache_file(path) also keeps them in a
+      file, so later runs load them instead of building them again.
+'''
+
+import os
+import pickle
+import zlib
+
+_DIRECTIONS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+_INF = float('inf')
+
+# Cache files start with this, followed by a zlib compressed pickle of a
+# dictionary from level signatures to analyses.
+_CACHE_MAGIC = b'SLA1'
+
+# One LevelAnalysis per level, keyed by (width, height, obstacles, storage)
+_analyses = dict()
+
+# File the analyses are also kept in (see use_cache_file), or None
+_cache_file = None
+
+
+def level_analysis(state):
+    '''Returns the LevelAnalysis for the level of a Sokoban state, building
+       it the first time'''
+    return analysis_for(state.width, state.height, state.obstacles, state.storage)
+
+
+def analysis_for(width, height, obstacles, storage):
+    '''Returns the LevelAnalysis for a level, building it the first time
+       (and adding it to the cache file, if one is in use)'''
+    signature = (width, height, obstacles, storage)
+    analysis = _analyses.get(signature)
+    if analysis is None:
+        analysis = LevelAnalysis(width, height, obstacles, storage)
+        _analyses[signature] = analysis
+        if _cache_file is not None:
+            save_analyses(_cache_file)
+    return analysis
+
+
+def use_cache_file(path):
+    '''Load the analyses kept in the file at path (if it exists), and from
+       now on add every analysis built to it. None stops using a file.'''
+    global _cache_file
+    _cache_file = path
+    if path is not None and os.path.exists(path):
+        load_analyses(path)
+
+
+def load_analyses(path):
+    '''Add the analyses in the file at path (written by save_analyses) to
+       the cache, returning how many were read'''
+    with open(path, 'rb') as f:
+        magic = f.read(len(_CACHE_MAGIC))
+        if magic != _CACHE_MAGIC:
+            raise Exception("{} is not a level analysis file".format(path))
+        analyses = pickle.loads(zlib.decompress(f.read()))
+    for signature, analysis in analyses.items():
+        _analyses.setdefault(signature, analysis)
+    return len(analyses)
+
+
+def save_analyses(path):
+    '''Write every cached analysis, and those already in the file at path,
+       to path. The file is written under a temporary name and moved into
+       place, so other processes never see a partly written file.'''
+    analyses = dict()
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read(len(_CACHE_MAGIC)) == _CACHE_MAGIC:
+                analyses = pickle.loads(zlib.decompress(f.read()))
+    analyses.update(_analyses)
+    data = zlib.compress(pickle.dumps(analyses, pickle.HIGHEST_PROTOCOL))
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_CACHE_MAGIC)
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class LevelAnalysis:
+    '''The analysis of one level (see the module docstring).
+
+       squares lists the floor squares and index maps each to its position
+       in squares; push[i][j] and walk[i][j] are the push and walk
+       distances from squares[i] to squares[j] (push_distance and
+       walk_distance look them up by square). targets is the sorted list
+       of storage points, storage_distance[square] the list of push
+       distances from square to each of them, nearest_storage[square] the
+       least of those and reachable_storage[square] the set of those that
+       are finite. room[square] numbers the rooms from 0.'''
+
+    def __init__(self, width, height, obstacles, storage):
+        self.width = width
+        self.height = height
+        self.obstacles = obstacles
+        self.storage = storage
+        self.squares = [(x, y) for y in range(height) for x in range(width) if (x, y) not in obstacles]
+        self.index = {square: i for i, square in enumerate(self.squares)}
+        self.floor = frozenset(self.squares)
+
+        # neighbours[i][d] is the index of the square next to squares[i]
+        # in direction d, or None if that is not floor
+        neighbours = []
+        for x, y in self.squares:
+            neighbours.append([self.index.get((x + dx, y + dy)) for dx, dy in _DIRECTIONS])
+        self.walk = [self._bfs(i, neighbours, False) for i in range(len(self.squares))]
+        self.push = [self._bfs(i, neighbours, True) for i in range(len(self.squares))]
+
+        self.targets = sorted(storage)
+        target_indices = [self.index[target] for target in self.targets]
+        self.storage_distance = dict()
+        self.nearest_storage = dict()
+        self.reachable_storage = dict()
+        for i, square in enumerate(self.squares):
+            distances = [self.push[i][t] for t in target_indices]
+            self.storage_distance[square] = distances
+            self.nearest_storage[square] = min(distances) if distances else _INF
+            self.reachable_storage[square] = frozenset(target for target, d in zip(self.targets, distances)
+                                                       if d < _INF)
+        self.dead_squares = frozenset(square for square in self.squares if not self.reachable_storage[square])
+
+        self.room = dict()
+        rooms = 0
+        for i, square in enumerate(self.squares):
+            if square not in self.room:
+                for j, d in enumerate(self.walk[i]):
+                    if d < _INF:
+                        self.room[self.squares[j]] = rooms
+                rooms = rooms + 1
+        self.rooms = rooms
+
+        self.tunnels = frozenset(square for i, square in enumerate(self.squares)
+                                 if (neighbours[i][0] is None and neighbours[i][2] is None) or
+                                 (neighbours[i][1] is None and neighbours[i][3] is None))
+        self.articulation = self._articulation(neighbours)
+
+    def _bfs(self, start, neighbours, pushes):
+        '''Returns the list of distances from squares[start] to every square,
+           walking, or if pushes is true, pushing a box (which needs the
+           square behind the box to be floor too)'''
+        dist = [_INF] * len(self.squares)
+        dist[start] = 0
+        frontier = [start]
+        for i in frontier:
+            for d, n in enumerate(neighbours[i]):
+                if n is None or dist[n] < _INF:
+                    continue
+                if pushes and neighbours[i][(d + 2) % 4] is None:
+                    continue
+                dist[n] = dist[i] + 1
+                frontier.append(n)
+        return dist
+
+    def _articulation(self, neighbours):
+        '''Returns the set of articulation squares of the floor (Tarjan's
+           algorithm, without recursion)'''
+        count = len(self.squares)
+        order = [0] * count
+        low = [0] * count
+        found = set()
+        time = 0
+        for root in range(count):
+            if order[root]:
+                continue
+            time = time + 1
+            order[root] = low[root] = time
+            root_children = 0
+            stack = [(root, -1, iter(neighbours[root]))]
+            while stack:
+                i, parent, rest = stack[-1]
+                for n in rest:
+                    if n is None or n == parent:
+                        continue
+                    if order[n]:
+                        low[i] = min(low[i], order[n])
+                    else:
+                        time = time + 1
+                        order[n] = low[n] = time
+                        stack.append((n, i, iter(neighbours[n])))
+                        break
+                else:
+                    stack.pop()
+                    if parent == -1:
+                        continue
+                    low[parent] = min(low[parent], low[i])
+                    if parent == root:
+                        root_children = root_children + 1
+                    elif low[i] >= order[parent]:
+                        found.add(self.squares[parent])
+            if root_children > 1:
+                found.add(self.squares[root])
+        return frozenset(found)
+
+    def push_distance(self, start, end):
+        '''The least number of pushes moving a box from start to end, with
+           no other boxes in the room'''
+        return self.push[self.index[start]][self.index[end]]
+
+    def walk_distance(self, start, end):
+        '''The least number of moves taking a robot from start to end, with
+           no boxes in the room'''
+        return self.walk[self.index[start]][self.index[end]]
+
+
+def heur_nearest_storage(state):
+    '''The sum over the boxes of the push distance to the nearest storage
+       point (admissible; infinite if a box is on a dead square)'''
+    nearest_storage = level_analysis(state).nearest_storage
+    return sum(nearest_storage[box] for box in state.boxes)
@@ -0,0 +1,313 @@
+'''Sokoban assignment heuristic routines.
+
+    A) Class DistanceTable
+
+      The distance from every square of a level to every storage point,
+      computed once per level and cached. With the 'push' metric it is
+      the least number of pushes that moves a box from the square to the
+      storage point if there were no other boxes (taken from the level's
+      LevelAnalysis, see sokoban_analysis), so squares from which a
+      storage point can never be reached get _UNREACHABLE. The
+      'manhattan' metric ignores the walls.
+
+    B) Assignment solvers
+
+      solve_assignment finds the cheapest way of giving every box its own
+      storage point with the shortest augmenting path form of the
+      Hungarian algorithm, keeping the dual values (potentials) of the
+      rows and columns. When there are more storage points than boxes,
+      rows of zero cost are added to make the matrix square, so every
+      storage point is assigned. When NumPy is installed, the inner loop
+      over the storage points can run vectorised (worthwhile for large
+      levels only); otherwise, or for small levels, it runs in plain
+      Python.
+
+    C) Class AssignmentHeuristic
+
+      A heuristic function: the cost of the cheapest assignment of boxes
+      to storage points. Matchings are remembered per set of boxes (so
+      moves that push nothing cost one dictionary lookup). When a state's
+      parent has a remembered matching and one box moved, the parent's
+      matching and dual values are reused: only the moved box's row is
+      unassigned and one augmenting path is searched, instead of solving
+      from scratch.
+'''
+
+from collections import OrderedDict
+
+from sokoban_analysis import analysis_for
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Distance of a square from which a storage point cannot be reached. An
+# assignment costing this much or more means a box can reach no free
+# storage point, and the heuristic value is infinite.
+_UNREACHABLE = 1 << 30
+
+# Levels with at least this many storage points use the NumPy solver
+# (when NumPy is installed); below it the Python loops are faster, since
+# NumPy's per call overhead outweighs the short loops.
+_NUMPY_MIN_SIZE = 96
+
+# One DistanceTable per level and metric
+_tables = dict()
+
+
+def distance_table(state, metric='push'):
+    '''Returns the DistanceTable for the level of a Sokoban state, building
+       it the first time'''
+    signature = (state.width, state.height, state.storage, state.obstacles, metric)
+    table = _tables.get(signature)
+    if table is None:
+        table = DistanceTable(state.width, state.height, state.storage, state.obstacles, metric)
+        _tables[signature] = table
+    return table
+
+
+class DistanceTable:
+    '''Distances from the squares of a level to its storage points.
+       costs[(x, y)] is the list of distances from square (x, y) to each
+       storage point, in the order of self.targets.'''
+
+    def __init__(self, width, height, storage, obstacles, metric='push'):
+        if not metric in ['push', 'manhattan']:
+            raise Exception("Unknown distance metric {}, must be one of ['push', 'manhattan']".format(metric))
+        self.metric = metric
+        self.targets = sorted(storage)
+        floor = [(x, y) for x in range(width) for y in range(height) if (x, y) not in obstacles]
+        if metric == 'manhattan':
+            self.costs = {square: [abs(square[0] - target[0]) + abs(square[1] - target[1])
+                                   for target in self.targets] for square in floor}
+            return
+
+        storage_distance = analysis_for(width, height, obstacles, storage).storage_distance
+        self.costs = {square: [min(d, _UNREACHABLE) for d in storage_distance[square]]
+                      for square in floor}
+
+
+def _augment(cost, u, v, p, way, i, m):
+    '''Assign row i (numbered from 1) by a shortest augmenting path in the
+       reduced costs cost[r - 1][j - 1] - u[r] - v[j], updating the dual
+       values u and v and the assignment p (p[j] is the row assigned to
+       column j, 0 if none; p[0] is scratch) in place'''
+    inf = float('inf')
+    minv = [inf] * (m + 1)
+    used = [False] * (m + 1)
+    p[0] = i
+    j0 = 0
+    while True:
+        used[j0] = True
+        i0 = p[j0]
+        row = cost[i0 - 1]
+        ui0 = u[i0]
+        delta = inf
+        j1 = 0
+        for j in range(1, m + 1):
+            if not used[j]:
+                cur = row[j - 1] - ui0 - v[j]
+                if cur < minv[j]:
+                    minv[j] = cur
+                    way[j] = j0
+                if minv[j] < delta:
+                    delta = minv[j]
+                    j1 = j
+        for j in range(m + 1):
+            if used[j]:
+                u[p[j]] = u[p[j]] + delta
+                v[j] = v[j] - delta
+            else:
+                minv[j] = minv[j] - delta
+        j0 = j1
+        if p[j0] == 0:
+            break
+    while j0:
+        j1 = way[j0]
+        p[j0] = p[j1]
+        j0 = j1
+
+
+def _augment_numpy(cost, u, v, p, way, i, m):
+    '''_augment with NumPy arrays (cost is an n by m array), the loops
+       over the columns vectorised'''
+    minv = numpy.full(m + 1, numpy.inf)
+    used = numpy.zeros(m + 1, dtype=bool)
+    p[0] = i
+    j0 = 0
+    while True:
+        used[j0] = True
+        i0 = p[j0]
+        free = ~used[1:]
+        cur = cost[i0 - 1] - u[i0] - v[1:]
+        better = free & (cur < minv[1:])
+        minv[1:][better] = cur[better]
+        way[1:][better] = j0
+        candidates = numpy.where(free, minv[1:], numpy.inf)
+        j1 = int(candidates.argmin()) + 1
+        delta = candidates[j1 - 1]
+        u[p[used]] += delta
+        v[used] -= delta
+        minv[~used] -= delta
+        j0 = j1
+        if p[j0] == 0:
+            break
+    while j0:
+        j1 = way[j0]
+        p[j0] = p[j1]
+        j0 = j1
+
+
+class Matching:
+    '''An optimal assignment of rows (boxes) to columns (storage points)
+       with its dual values: rows[r] is the box of row r + 1, p[j] the row
+       assigned to column j (0 if none), u and v the row and column duals.
+       total is the cost of the assignment.'''
+
+    def __init__(self, rows, p, u, v, total):
+        self.rows = rows
+        self.p = p
+        self.u = u
+        self.v = v
+        self.total = total
+
+
+def _square(cost, m):
+    '''Returns cost (n rows of m >= n costs) with m - n rows of zeros added'''
+    return cost + [[0] * m for i in range(m - len(cost))]
+
+
+def solve_assignment(cost, m, use_numpy=False):
+    '''Returns the Matching of least total cost for the cost matrix cost,
+       a list of rows of m costs (at most m rows), with rows left as None.
+       With use_numpy, NumPy is used for the inner loops.'''
+    cost = _square(cost, m)
+    n = m
+    if use_numpy:
+        array = numpy.array(cost, dtype=float)
+        u = numpy.zeros(n + 1)
+        v = numpy.zeros(m + 1)
+        p = numpy.zeros(m + 1, dtype=int)
+        way = numpy.zeros(m + 1, dtype=int)
+        for i in range(1, n + 1):
+            _augment_numpy(array, u, v, p, way, i, m)
+    else:
+        u = [0] * (n + 1)
+        v = [0] * (m + 1)
+        p = [0] * (m + 1)
+        way = [0] * (m + 1)
+        for i in range(1, n + 1):
+            _augment(cost, u, v, p, way, i, m)
+    return Matching(None, p, u, v, _total(cost, p, m))
+
+
+def _total(cost, p, m):
+    total = 0
+    for j in range(1, m + 1):
+        if p[j]:
+            total = total + cost[p[j] - 1][j - 1]
+    return total
+
+
+class AssignmentHeuristic:
+    '''Heuristic function giving the cost of the cheapest assignment of
+       the boxes of a Sokoban state to distinct storage points, with the
+       distances of a DistanceTable ('push' by default, which is
+       admissible and infinite for states where a box can reach no free
+       storage point). Can be given to init_search as heur_fn.
+
+       Up to max_entries matchings are remembered (least recently used
+       are dropped first). incremental and full count how many values
+       were found by reusing the parent's matching and by solving from
+       scratch. use_numpy is True, False, or None to use NumPy when it is
+       installed and the level has at least _NUMPY_MIN_SIZE storage
+       points.'''
+
+    def __init__(self, metric='push', max_entries=100000, use_numpy=None):
+        self.metric = metric
+        self.max_entries = max_entries
+        self.use_numpy = use_numpy
+        self.matchings = OrderedDict()
+        self.table = None
+        self.numpy = False
+        self.incremental = 0
+        self.full = 0
+
+    def _level(self, state):
+        '''Switch to the distance table of state's level if needed'''
+        table = distance_table(state, self.metric)
+        if table is not self.table:
+            self.table = table
+            self.matchings = OrderedDict()
+            use_numpy = self.use_numpy
+            if use_numpy is None:
+                use_numpy = numpy is not None and len(table.targets) >= _NUMPY_MIN_SIZE
+            self.numpy = use_numpy
+
+    def __call__(self, state):
+        self._level(state)
+        boxes = state.boxes
+        matchings = self.matchings
+        matching = matchings.get(boxes)
+        if matching is not None:
+            matchings.move_to_end(boxes)
+            return self._value(matching)
+
+        if len(boxes) > len(self.table.targets):
+            return float('inf')
+        parent = state.parent
+        parent_matching = matchings.get(parent.boxes) if parent is not None else None
+        if parent_matching is not None and len(parent.boxes) == len(boxes) and len(parent.boxes - boxes) == 1:
+            matching = self._resolve(parent_matching, parent.boxes, boxes)
+            self.incremental = self.incremental + 1
+        else:
+            rows = list(boxes)
+            costs = self.table.costs
+            matching = solve_assignment([costs[box] for box in rows], len(self.table.targets), self.numpy)
+            matching.rows = rows
+            self.full = self.full + 1
+
+        matchings[boxes] = matching
+        if len(matchings) > self.max_entries:
+            matchings.popitem(last=False)
+        return self._value(matching)
+
+    def _value(self, matching):
+        if matching.total >= _UNREACHABLE:
+            return float('inf')
+        return matching.total
+
+    def _resolve(self, parent_matching, parent_boxes, boxes):
+        '''Returns the Matching for boxes from the one for parent_boxes,
+           which differ in one box: the moved box's row gets its new
+           costs and its dual value is lowered until it is feasible again,
+           and the row is assigned by one augmenting path, which ends at
+           the only free column. The other rows' dual values stay feasible
+           and their assignments tight, so the result is optimal.'''
+        (old_box,) = parent_boxes - boxes
+        (new_box,) = boxes - parent_boxes
+        rows = list(parent_matching.rows)
+        r = rows.index(old_box)
+        rows[r] = new_box
+        costs = self.table.costs
+        m = len(self.table.targets)
+        cost = _square([costs[box] for box in rows], m)
+        new_costs = cost[r]
+        if self.numpy:
+            p = parent_matching.p.copy()
+            u = parent_matching.u.copy()
+            v = parent_matching.v.copy()
+            way = numpy.zeros(m + 1, dtype=int)
+            p[p == r + 1] = 0
+            u[r + 1] = (numpy.array(new_costs, dtype=float) - v[1:]).min()
+            _augment_numpy(numpy.array(cost, dtype=float), u, v, p, way, r + 1, m)
+        else:
+            p = list(parent_matching.p)
+            u = list(parent_matching.u)
+            v = list(parent_matching.v)
+            way = [0] * (m + 1)
+            p[p.index(r + 1, 1)] = 0
+            u[r + 1] = min(new_costs[j - 1] - v[j] for j in range(1, m + 1))
+            _augment(cost, u, v, p, way, r + 1, m)
+        return Matching(rows, p, u, v, _total(cost, p, m))
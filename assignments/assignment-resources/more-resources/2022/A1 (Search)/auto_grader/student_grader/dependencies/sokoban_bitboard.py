@@ -0,0 +1,361 @@
+'''Bitboard Sokoban routines.
+
+    A) Class BitboardLevel
+
+      The fixed part of a Sokoban level (its size, obstacles and storage
+      points) with tables computed once per level: for every square, the
+      squares a robot can step to, and the square beyond each of them
+      that a box would be pushed to. Squares are numbered over the room
+      padded with a border of walls, (y + 1) * (width + 2) + x + 1, so
+      the tables need no bounds checks.
+
+    B) Class BitboardSokobanState
+
+      A SokobanState with the robots and boxes kept as integer bitboards
+      over the padded room, so generating a successor is a few bit
+      operations and table lookups instead of copying sets. Successors
+      are generated in the same order, with the same action names and
+      the same Zobrist keys (hashable_state()) as SokobanState, so a
+      search expands the same states in the same order with either.
+      robots, boxes, storage, obstacles, width and height are available
+      as in SokobanState, so the existing heuristics and goal function
+      work unchanged.
+
+    Code also contains the problems of sokoban.PROBLEMS as bitboard
+    states, and a goal function using the bitboards.
+'''
+
+from array import array
+from functools import cached_property
+
+from search import StateSpace
+from sokoban import SokobanState, UP, RIGHT, DOWN, LEFT, _zobrist_table
+from sokoban_analysis import level_analysis
+import sokoban
+
+_DIRECTIONS = (UP, RIGHT, DOWN, LEFT)
+
+# One BitboardLevel per level, shared by all of its states
+_levels = dict()
+
+
+def bitboard_level(width, height, storage, obstacles, nrobots):
+    '''Returns the BitboardLevel for a level, building it the first time'''
+    signature = (width, height, storage, obstacles, nrobots)
+    level = _levels.get(signature)
+    if level is None:
+        level = BitboardLevel(width, height, storage, obstacles, nrobots)
+        _levels[signature] = level
+    return level
+
+
+class BitboardLevel:
+    '''The size, obstacles and storage points of a level, and its move
+       tables.
+
+       A state keeps the squares of its robots packed in one integer,
+       robot i's square in bits i * square_bits and up. robot_moves[i][c]
+       lists the moves of robot i from square c, in the order of
+       SokobanState's successors: for each direction in which it can step
+       without hitting a wall, the tuple (action name, square stepped to
+       shifted into robot i's bits, its bit, the change to the Zobrist key
+       of stepping there, the bit of the square beyond it, the change to
+       the key of pushing a box there). The bit of the square beyond is 0
+       if it is a wall.'''
+
+    def __init__(self, width, height, storage, obstacles, nrobots):
+        self.width = width
+        self.height = height
+        self.storage = storage
+        self.obstacles = obstacles
+        self.nrobots = nrobots
+        self.padded_width = width + 2
+        size = self.padded_width * (height + 2)
+        self.square_bits = size.bit_length()
+        self.square_mask = (1 << self.square_bits) - 1
+
+        # xy[c] is the (x, y) location of square c, None for walls
+        self.xy = [None] * size
+        for y in range(height):
+            for x in range(width):
+                if (x, y) not in obstacles:
+                    self.xy[self.square((x, y))] = (x, y)
+        self.storage_bits = 0
+        for location in storage:
+            self.storage_bits = self.storage_bits | 1 << self.square(location)
+
+        # the Zobrist values of SokobanState's features, by padded square
+        self.zobrist_table = _zobrist_table(width, height, nrobots)
+        values = self.zobrist_table.values
+        squares = width * height
+        self.robot_values = [[0] * size for robot in range(nrobots)]
+        box_values = [0] * size
+        for c, location in enumerate(self.xy):
+            if location is None:
+                continue
+            square = location[1] * width + location[0]
+            for robot in range(nrobots):
+                self.robot_values[robot][c] = values[robot * squares + square]
+            box_values[c] = values[nrobots * squares + square]
+
+        deltas = (-self.padded_width, 1, self.padded_width, -1)
+        self.robot_moves = []
+        for robot in range(nrobots):
+            shift = robot * self.square_bits
+            robot_values = self.robot_values[robot]
+            names = [str(robot) + " " + direction.name for direction in _DIRECTIONS]
+            moves = [()] * size
+            for c in range(size):
+                if self.xy[c] is None:
+                    continue
+                square_moves = []
+                for name, delta in zip(names, deltas):
+                    n = c + delta
+                    if self.xy[n] is None:
+                        continue
+                    b = n + delta
+                    if self.xy[b] is None:
+                        square_moves.append((name, n << shift, 1 << n, robot_values[n], 0, 0))
+                    else:
+                        square_moves.append((name, n << shift, 1 << n, robot_values[n], 1 << b,
+                                             robot_values[n] ^ box_values[n] ^ box_values[b]))
+                moves[c] = tuple(square_moves)
+            self.robot_moves.append(moves)
+
+    def square(self, location):
+        '''Returns the padded square number of an (x, y) location'''
+        return (location[1] + 1) * self.padded_width + location[0] + 1
+
+    def pack_robots(self, squares):
+        '''Returns the robots' padded squares, in robot order, packed in one integer'''
+        packed = 0
+        for robot, square in enumerate(squares):
+            packed = packed | square << robot * self.square_bits
+        return packed
+
+    def unpack_robots(self, packed):
+        '''Returns the robots' padded squares packed by pack_robots, in robot order'''
+        return [packed >> robot * self.square_bits & self.square_mask for robot in range(self.nrobots)]
+
+    def locations(self, bits):
+        '''Returns the (x, y) locations of the squares set in bits'''
+        xy = self.xy
+        locations = []
+        while bits:
+            low = bits & -bits
+            locations.append(xy[low.bit_length() - 1])
+            bits = bits ^ low
+        return locations
+
+
+class BitboardSokobanState(StateSpace):
+
+    def __init__(self, action, gval, parent, level, robot_squares, box_bits, robot_bits, zobrist_key):
+        '''
+        Creates a new bitboard Sokoban state. from_state and unpack_state build states from scratch.
+        @param level: The state's BitboardLevel.
+        @param robot_squares: The robots' padded squares, packed by level.pack_robots.
+        @param box_bits: The bitboard of the boxes' squares.
+        @param robot_bits: The bitboard of the robots' squares.
+        @param zobrist_key: The state's Zobrist key, the same as the equal SokobanState's.
+        '''
+        StateSpace.__init__(self, action, gval, parent)
+        self.level = level
+        self.robot_squares = robot_squares
+        self.box_bits = box_bits
+        self.robot_bits = robot_bits
+        self.zobrist_key = zobrist_key
+
+    @classmethod
+    def from_state(cls, state):
+        '''Returns the bitboard state for a SokobanState (without its parent)'''
+        level = bitboard_level(state.width, state.height, state.storage, state.obstacles, len(state.robots))
+        return cls._build(level, state.action, state.gval, None, [level.square(robot) for robot in state.robots],
+                          [level.square(box) for box in state.boxes])
+
+    @classmethod
+    def _build(cls, level, action, gval, parent, robot_squares, box_squares):
+        '''Returns the state with robots on the padded squares robot_squares (in robot order) and boxes on
+           box_squares'''
+        robot_bits = 0
+        for square in robot_squares:
+            robot_bits = robot_bits | 1 << square
+        box_bits = 0
+        for square in box_squares:
+            box_bits = box_bits | 1 << square
+        state = cls(action, gval, parent, level, level.pack_robots(robot_squares), box_bits, robot_bits, None)
+        state.set_zobrist_key(level.zobrist_table)
+        return state
+
+    def to_state(self):
+        '''Returns the SokobanState for this state (without its parent)'''
+        level = self.level
+        return SokobanState(self.action, self.gval, None, level.width, level.height, self.robots, self.boxes,
+                            level.storage, level.obstacles, self.zobrist_key)
+
+    @property
+    def width(self):
+        return self.level.width
+
+    @property
+    def height(self):
+        return self.level.height
+
+    @property
+    def storage(self):
+        return self.level.storage
+
+    @property
+    def obstacles(self):
+        return self.level.obstacles
+
+    @cached_property
+    def robots(self):
+        '''A tuple of the robots' (x, y) locations, as in SokobanState'''
+        xy = self.level.xy
+        return tuple(xy[square] for square in self.level.unpack_robots(self.robot_squares))
+
+    @cached_property
+    def boxes(self):
+        '''A frozenset of the boxes' (x, y) locations, as in SokobanState'''
+        return frozenset(self.level.locations(self.box_bits))
+
+    def successors(self):
+        '''
+        Generates all the actions that can be performed from this state, and the states those actions will create,
+        in the same order as SokobanState.successors.
+        '''
+        successors = []
+        append = successors.append
+        gval = self.gval + 1
+        level = self.level
+        square_bits = level.square_bits
+        square_mask = level.square_mask
+        robot_squares = self.robot_squares
+        robot_bits = self.robot_bits
+        box_bits = self.box_bits
+        occupied = robot_bits | box_bits
+
+        # the same loop as moves(), written out as it is the inner loop of every search
+        for robot in range(level.nrobots):
+            square = robot_squares >> robot * square_bits & square_mask
+            others = robot_squares ^ square << robot * square_bits
+            other_bits = robot_bits ^ 1 << square
+            key = self.zobrist_key ^ level.robot_values[robot][square]
+            for action, n_squares, n_bit, step_key, b_bit, push_key in level.robot_moves[robot][square]:
+                if robot_bits & n_bit:
+                    continue
+                if box_bits & n_bit:
+                    if not b_bit or occupied & b_bit:
+                        continue
+                    append(BitboardSokobanState(action, gval, self, level, others | n_squares, box_bits ^ n_bit ^ b_bit,
+                                                other_bits | n_bit, key ^ push_key))
+                else:
+                    append(BitboardSokobanState(action, gval, self, level, others | n_squares, box_bits,
+                                                other_bits | n_bit, key ^ step_key))
+
+        return successors
+
+    def iter_successors(self):
+        '''
+        Yields (gval, key, make_state) for each successor, with the key derived from this
+        state's before the state object is built (see StateSpace.iter_successors).
+        '''
+        gval = self.gval + 1
+        level = self.level
+
+        for action, robot_squares, robot_bits, box_bits, key in self.moves():
+            yield gval, key, (lambda action=action, robot_squares=robot_squares, robot_bits=robot_bits,
+                              box_bits=box_bits, key=key:
+                              BitboardSokobanState(action, gval, self, level, robot_squares, box_bits, robot_bits, key))
+
+    def moves(self):
+        '''
+        Generates (action, robot squares, robot bitboard, box bitboard, zobrist key) for every move that can be
+        performed from this state.
+        '''
+        level = self.level
+        square_bits = level.square_bits
+        robot_squares = self.robot_squares
+        robot_bits = self.robot_bits
+        box_bits = self.box_bits
+        occupied = robot_bits | box_bits
+
+        for robot in range(level.nrobots):
+            square = robot_squares >> robot * square_bits & level.square_mask
+            others = robot_squares ^ square << robot * square_bits
+            other_bits = robot_bits ^ 1 << square
+            key = self.zobrist_key ^ level.robot_values[robot][square]
+            for action, n_squares, n_bit, step_key, b_bit, push_key in level.robot_moves[robot][square]:
+                if robot_bits & n_bit:
+                    continue
+                if box_bits & n_bit:
+                    if not b_bit or occupied & b_bit:
+                        continue
+                    yield action, others | n_squares, other_bits | n_bit, box_bits ^ n_bit ^ b_bit, key ^ push_key
+                else:
+                    yield action, others | n_squares, other_bits | n_bit, box_bits, key ^ step_key
+
+    def hashable_state(self):
+        '''Return a data item that can be used as a dictionary key to UNIQUELY represent a state.
+           The same as the key of the equal SokobanState.'''
+        return self.zobrist_key
+
+    def zobrist_features(self):
+        '''Returns the state's features in its ZobristTable, numbered as in SokobanState.'''
+        width = self.level.width
+        squares = width * self.level.height
+        for i, robot in enumerate(self.robots):
+            yield i * squares + robot[1] * width + robot[0]
+        box_base = self.level.nrobots * squares
+        for box in self.boxes:
+            yield box_base + box[1] * width + box[0]
+
+    def problem_key(self):
+        '''Returns the level: the room's size, obstacles and storage points, as SokobanState.problem_key'''
+        return (self.width, self.height, self.obstacles, self.storage)
+
+    def analysis(self):
+        '''Returns the LevelAnalysis of this state's level (see sokoban_analysis)'''
+        return level_analysis(self)
+
+    def full_state(self):
+        '''Returns the packed robot squares and the box bitboard, which determine the state exactly.'''
+        return (self.robot_squares, self.box_bits)
+
+    def pack_state(self):
+        '''Returns the state packed as by SokobanState.pack_state.'''
+        width = self.level.width
+        squares = [robot[1] * width + robot[0] for robot in self.robots]
+        squares.extend(sorted(box[1] * width + box[0] for box in self.boxes))
+        return array('H', squares).tobytes()
+
+    def unpack_state(self, data, action, gval, parent=None):
+        '''Returns the state of this level packed by pack_state.'''
+        level = self.level
+        squares = array('H')
+        squares.frombytes(data)
+        squares = [level.square((square % level.width, square // level.width)) for square in squares]
+        return self._build(level, action, gval, parent, squares[:level.nrobots], squares[level.nrobots:])
+
+    def state_string(self):
+        '''Returns a string representation of a state that can be printed to stdout.'''
+        return self.to_state().state_string()
+
+    def print_state(self):
+        '''
+        Prints the string representation of the state.
+        '''
+        print("ACTION was " + self.action)
+        print(self.state_string())
+
+
+def bitboard_goal_state(state):
+    '''Returns True if every box of a BitboardSokobanState is on a storage point'''
+    return not state.box_bits & ~state.level.storage_bits
+
+
+'''
+The problems of sokoban.PROBLEMS, as bitboard states
+'''
+PROBLEMS = tuple(BitboardSokobanState.from_state(state) for state in sokoban.PROBLEMS)
@@ -0,0 +1,202 @@
+'''Sokoban deadlock detection routines.
+
+    A) Dead squares
+
+      A square is dead if a box on it can never reach a storage point,
+      whatever the other boxes and the robots do. The live squares are
+      found once per level by pulling a box backwards from every storage
+      point: a box can be pulled from square t to its neighbour c if c
+      and the square beyond c are both in the room (that is where the
+      robot would have stood to push it from c to t). Every other square
+      is dead. They come from the level's LevelAnalysis (see
+      sokoban_analysis).
+
+    B) Freeze deadlocks
+
+      A box is frozen if it can never be pushed again: it is blocked
+      horizontally (a wall on either side, dead squares on both sides, or
+      a frozen box on either side) and vertically. While checking a
+      neighbouring box, the box being checked counts as a wall. A frozen
+      box off storage, or a frozen group of boxes one of which is off
+      storage, is a deadlock. Only a push can freeze a box, and only the
+      pushed box and the boxes next to it, so after a push only the
+      pushed box needs checking.
+
+    C) Corral deadlocks
+
+      A corral is a region of the room the robots cannot reach, fenced off
+      by boxes and walls. If every box on a corral's fence is frozen, no
+      robot can ever enter it, so no box in it can ever be moved. Then a
+      box in it that is off storage is a deadlock, and so is an empty
+      storage point in it when there are no spare storage points.
+
+    D) Class DeadlockDetector
+
+      The dead squares of a level, and the checks above. A detector can be
+      given to SearchEngine.set_successor_filter, e.g.
+
+        se.set_successor_filter(deadlock_detector(initState))
+
+      to prune deadlocked successors as they are generated.
+'''
+
+from sokoban_analysis import analysis_for
+
+_DIRECTIONS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+# One DeadlockDetector per level and setting, shared by all of its states
+_detectors = dict()
+
+
+def deadlock_detector(state, corrals=False):
+    '''Returns the DeadlockDetector for the level of a Sokoban state (a
+       SokobanState or BitboardSokobanState), building it the first time'''
+    signature = (state.width, state.height, state.storage, state.obstacles, corrals)
+    detector = _detectors.get(signature)
+    if detector is None:
+        detector = DeadlockDetector(state.width, state.height, state.storage, state.obstacles, corrals)
+        _detectors[signature] = detector
+    return detector
+
+
+class DeadlockDetector:
+    '''Deadlock checks for one level. Works on any state with robots,
+       boxes and parent as in SokobanState.
+
+       Calling the detector on a state returns True if the state is
+       deadlocked, checking only what the last action changed: if it
+       pushed a box, whether that box is on a dead square, is part of a
+       frozen group off storage, or (if corrals is true) closed a corral
+       that can never be entered. States without a parent are checked in
+       full (see is_deadlocked).'''
+
+    def __init__(self, width, height, storage, obstacles, corrals=False):
+        self.width = width
+        self.height = height
+        self.storage = storage
+        self.obstacles = obstacles
+        self.corrals = corrals
+        analysis = analysis_for(width, height, obstacles, storage)
+        self.floor = analysis.floor
+        self.dead_squares = analysis.dead_squares
+
+    def __call__(self, state):
+        parent = state.parent
+        if parent is None:
+            return self.is_deadlocked(state)
+        boxes = state.boxes
+        parent_boxes = parent.boxes
+        if boxes == parent_boxes:
+            # the robot moved without pushing
+            return False
+        for box in boxes:
+            if box not in parent_boxes:
+                pushed = box
+                break
+        if pushed in self.dead_squares:
+            return True
+        if self.frozen_off_storage(pushed, boxes):
+            return True
+        return self.corrals and self.corral_deadlock(state.robots, boxes)
+
+    def is_deadlocked(self, state):
+        '''Returns True if any box of state is on a dead square or in a
+           frozen group off storage, or (if corrals is true) state has a
+           corral that can never be entered holding a box off storage'''
+        boxes = state.boxes
+        for box in boxes:
+            if box in self.dead_squares:
+                return True
+        for box in boxes:
+            if box not in self.storage and self.frozen_off_storage(box, boxes):
+                return True
+        return self.corrals and self.corral_deadlock(state.robots, boxes)
+
+    def frozen_off_storage(self, box, boxes):
+        '''Returns True if the box on square box is frozen and it, or a box
+           frozen with it, is off storage'''
+        group = []
+        if not self._frozen(box, boxes, set(), group):
+            return False
+        for frozen_box in group:
+            if frozen_box not in self.storage:
+                return True
+        return False
+
+    def _frozen(self, box, boxes, walls, group):
+        '''Returns True if the box on square box can never be moved, with
+           the squares in walls counted as walls. The boxes found frozen
+           are added to group.'''
+        mark = len(group)
+        walls.add(box)
+        frozen = self._blocked(box, 1, 0, boxes, walls, group) and self._blocked(box, 0, 1, boxes, walls, group)
+        walls.remove(box)
+        if frozen:
+            group.append(box)
+        else:
+            # boxes found frozen while box counted as a wall need not be
+            del group[mark:]
+        return frozen
+
+    def _blocked(self, box, dx, dy, boxes, walls, group):
+        '''Returns True if the box on square box cannot be pushed along
+           the axis (dx, dy)'''
+        before = (box[0] - dx, box[1] - dy)
+        after = (box[0] + dx, box[1] + dy)
+        if before not in self.floor or after not in self.floor or before in walls or after in walls:
+            return True
+        if before in self.dead_squares and after in self.dead_squares:
+            return True
+        return ((before in boxes and self._frozen(before, boxes, walls, group)) or
+                (after in boxes and self._frozen(after, boxes, walls, group)))
+
+    def frozen(self, box, boxes):
+        '''Returns True if the box on square box can never be moved'''
+        return self._frozen(box, boxes, set(), [])
+
+    def corral_deadlock(self, robots, boxes):
+        '''Returns True if the robots, with the boxes on squares boxes,
+           are fenced off from a corral whose fence is all frozen boxes,
+           and the corral holds a box off storage or (with no spare storage
+           points) an empty storage point'''
+        floor = self.floor
+        reach = set(robots)
+        stack = list(robots)
+        while stack:
+            square = stack.pop()
+            for dx, dy in _DIRECTIONS:
+                n = (square[0] + dx, square[1] + dy)
+                if n in floor and n not in boxes and n not in reach:
+                    reach.add(n)
+                    stack.append(n)
+
+        seen = set(reach)
+        for start in floor:
+            if start in seen:
+                continue
+            corral = [start]
+            seen.add(start)
+            fence = []
+            i = 0
+            while i < len(corral):
+                square = corral[i]
+                i = i + 1
+                on_fence = False
+                for dx, dy in _DIRECTIONS:
+                    n = (square[0] + dx, square[1] + dy)
+                    if n in reach:
+                        on_fence = True
+                    elif n in floor and n not in seen:
+                        seen.add(n)
+                        corral.append(n)
+                if on_fence:
+                    fence.append(square)
+            if any(not self.frozen(box, boxes) for box in fence):
+                continue
+            for square in corral:
+                if square in boxes:
+                    if square not in self.storage:
+                        return True
+                elif square in self.storage and len(self.storage) == len(boxes):
+                    return True
+        return False
@@ -0,0 +1,264 @@
+'''Push level Sokoban routines.
+
+    A) Class PushSokobanState
+
+      A Sokoban state space whose actions are box pushes rather than
+      single robot moves. Each successor is one robot walking (by a
+      shortest path found with breadth first search, the other robots
+      staying where they are) to a square next to a box and pushing it
+      once. Its gval still counts every single move: the walk plus the
+      push. States where only the robots have moved are never generated,
+      so far fewer states are expanded and stored than with SokobanState.
+
+      A robot that is alone in its region of the room (the squares it
+      can reach without moving a box) can reach every square of the
+      region, so by default its position is normalised to the smallest
+      square of the region in hashable_state(): states that differ only
+      by where such a robot stands within its region are the same state.
+      Robots that share a region with another robot keep their exact
+      positions. They get no single steps as actions (with them the push
+      level space was larger than the move level one): every square of a
+      region can be reached by one of its robots without the others
+      moving, namely the last robot on a path to it, so pushes alone
+      cover the region. A robot standing where a box is pushed to steps
+      aside first, as part of the push.
+
+      gval is always the exact number of moves of the path found, but
+      with normalised positions a state may be kept with a robot position
+      that makes later walks longer, so solutions need not be move
+      optimal. With normalize=False and one robot, every state keeps the
+      exact robot position, and astar with an admissible heuristic finds
+      move optimal solutions, over a larger state space. With several
+      robots, a robot only moves right before it pushes (or to make room
+      for a push), so a solution needing a robot to walk through a gap
+      that another robot's push later closes can be missed.
+
+      robots, boxes, storage, obstacles, width and height are as in
+      SokobanState, so the Sokoban heuristics, goal function and deadlock
+      detector work unchanged. primitive_actions() returns the single
+      moves of the path to a state, with SokobanState's action names.
+'''
+
+from search import StateSpace
+from sokoban import SokobanState, UP, RIGHT, DOWN, LEFT
+from sokoban_analysis import level_analysis
+
+_DIRECTIONS = (UP, RIGHT, DOWN, LEFT)
+
+
+def _walk(start, goal, floor, blocked):
+    '''Returns the directions (indices into _DIRECTIONS) of a shortest
+       walk from start to goal over the squares of floor not in blocked,
+       or None if there is none'''
+    previous = {start: None}
+    frontier = [start]
+    for square in frontier:
+        if square == goal:
+            break
+        for d, direction in enumerate(_DIRECTIONS):
+            n = (square[0] + direction.delta[0], square[1] + direction.delta[1])
+            if n in floor and n not in blocked and n not in previous:
+                previous[n] = (square, d)
+                frontier.append(n)
+    if goal not in previous:
+        return None
+    path = []
+    square = goal
+    while previous[square] is not None:
+        square, d = previous[square]
+        path.append(d)
+    path.reverse()
+    return path
+
+
+class PushSokobanState(StateSpace):
+
+    def __init__(self, action, gval, parent, width, height, robots, boxes, storage, obstacles, normalize=True,
+                 move=None):
+        '''
+        Creates a new push level Sokoban state.
+        @param width: The room's X dimension (excluding walls).
+        @param height: The room's Y dimension (excluding walls).
+        @param robots: A tuple of all the robots' locations. Each robot is denoted by its index in the list.
+        @param boxes: A frozenset of all the boxes.
+        @param storage: A frozenset of all the storage points.
+        @param obstacles: A frozenset of all the impassable obstacles.
+        @param normalize: If true, a robot alone in its region is keyed by the region (see hashable_state).
+        @param move: (robot, square the robot pushed from, direction index) of the last push, followed by
+                     (robot, direction index) of the step aside made before it, if any.
+        '''
+        StateSpace.__init__(self, action, gval, parent)
+        self.width = width
+        self.height = height
+        self.robots = robots
+        self.boxes = boxes
+        self.storage = storage
+        self.obstacles = obstacles
+        self.normalize = normalize
+        self.move = move
+        self.floor = parent.floor if parent is not None else frozenset(
+            (x, y) for x in range(width) for y in range(height) if (x, y) not in obstacles)
+        self._regions()
+
+    @classmethod
+    def from_state(cls, state, normalize=True):
+        '''Returns the push level state for a SokobanState (without its parent)'''
+        return cls(state.action, state.gval, None, state.width, state.height, state.robots, state.boxes,
+                   state.storage, state.obstacles, normalize)
+
+    def to_state(self):
+        '''Returns the SokobanState for this state (without its parent)'''
+        return SokobanState(self.action, self.gval, None, self.width, self.height, self.robots, self.boxes,
+                            self.storage, self.obstacles)
+
+    def _regions(self):
+        '''Find the region of every robot and set self.shared (whether each
+           robot shares its region with another) and self.key'''
+        floor = self.floor
+        boxes = self.boxes
+        region_of = dict()
+        smallest = []
+        for robot in self.robots:
+            if robot in region_of:
+                continue
+            region = len(smallest)
+            region_of[robot] = region
+            least = robot
+            stack = [robot]
+            while stack:
+                square = stack.pop()
+                if square < least:
+                    least = square
+                for direction in _DIRECTIONS:
+                    n = (square[0] + direction.delta[0], square[1] + direction.delta[1])
+                    if n in floor and n not in boxes and n not in region_of:
+                        region_of[n] = region
+                        stack.append(n)
+            smallest.append(least)
+        regions = [region_of[robot] for robot in self.robots]
+        self.shared = tuple(regions.count(region) > 1 for region in regions)
+        if self.normalize:
+            robot_key = tuple(robot if shared else smallest[region]
+                              for robot, shared, region in zip(self.robots, self.shared, regions))
+        else:
+            robot_key = self.robots
+        self.key = (robot_key, boxes)
+
+    def successors(self):
+        '''
+        Generates every push (after a shortest walk) that can be performed from this state, and the states those
+        pushes will create. A push onto a square where another robot stands is preceded by that robot stepping
+        aside.
+        '''
+        successors = []
+        floor = self.floor
+        boxes = self.boxes
+
+        for robot in range(len(self.robots)):
+            start = self.robots[robot]
+            others = set(self.robots)
+            others.remove(start)
+
+            # breadth first search for the distance to every reachable square
+            dist = {start: 0}
+            frontier = [start]
+            for square in frontier:
+                for direction in _DIRECTIONS:
+                    n = (square[0] + direction.delta[0], square[1] + direction.delta[1])
+                    if n in floor and n not in boxes and n not in others and n not in dist:
+                        dist[n] = dist[square] + 1
+                        frontier.append(n)
+
+            for square in frontier:
+                for d, direction in enumerate(_DIRECTIONS):
+                    box = (square[0] + direction.delta[0], square[1] + direction.delta[1])
+                    if box not in boxes:
+                        continue
+                    target = (box[0] + direction.delta[0], box[1] + direction.delta[1])
+                    if target not in floor or target in boxes:
+                        continue
+                    new_boxes = boxes.difference((box,)).union((target,))
+                    action = "{} push {} from {}".format(robot, direction.name, square)
+                    if target not in others:
+                        new_robots = self.robots[:robot] + (box,) + self.robots[robot + 1:]
+                        successors.append(PushSokobanState(action, self.gval + dist[square] + 1, self, self.width,
+                                                           self.height, new_robots, new_boxes, self.storage,
+                                                           self.obstacles, self.normalize, (robot, square, d)))
+                    else:
+                        successors.extend(self._step_aside(robot, square, d, box, target, new_boxes, action))
+
+        return successors
+
+    def _step_aside(self, robot, square, d, box, target, new_boxes, action):
+        '''The states where the robot standing on target steps to a free neighbouring square, then robot walks to
+           square and pushes the box on box (in direction d) onto target'''
+        successors = []
+        other = self.robots.index(target)
+        for d_aside, direction in enumerate(_DIRECTIONS):
+            aside = (target[0] + direction.delta[0], target[1] + direction.delta[1])
+            if aside not in self.floor or aside in self.boxes or aside in self.robots:
+                continue
+            new_robots = list(self.robots)
+            new_robots[other] = aside
+            blocked = self.boxes.union(new_robots[:robot] + new_robots[robot + 1:])
+            walk = _walk(self.robots[robot], square, self.floor, blocked)
+            if walk is None:
+                continue
+            new_robots[robot] = box
+            successors.append(PushSokobanState("{} {}, {}".format(other, direction.name, action),
+                                               self.gval + 1 + len(walk) + 1, self, self.width, self.height,
+                                               tuple(new_robots), new_boxes, self.storage, self.obstacles,
+                                               self.normalize, (robot, square, d, (other, d_aside))))
+        return successors
+
+    def hashable_state(self):
+        '''Return a data item that can be used as a dictionary key to UNIQUELY represent a state: the boxes, and
+           for each robot its location, or if normalize is on and it is alone in its region, the region's
+           smallest square.'''
+        return self.key
+
+    def problem_key(self):
+        '''Returns the level: the room's size, obstacles and storage points, as SokobanState.problem_key'''
+        return (self.width, self.height, self.obstacles, self.storage)
+
+    def analysis(self):
+        '''Returns the LevelAnalysis of this state's level (see sokoban_analysis)'''
+        return level_analysis(self)
+
+    def primitive_actions(self):
+        '''Returns the SokobanState action names of the single moves leading from the initial state to this state'''
+        states = []
+        state = self
+        while state.parent is not None:
+            states.append(state)
+            state = state.parent
+        states.reverse()
+
+        actions = []
+        for state in states:
+            parent = state.parent
+            robot, square, d = state.move[:3]
+            robots = list(parent.robots)
+            if len(state.move) > 3:
+                other, d_aside = state.move[3]
+                actions.append(str(other) + " " + _DIRECTIONS[d_aside].name)
+                delta = _DIRECTIONS[d_aside].delta
+                robots[other] = (robots[other][0] + delta[0], robots[other][1] + delta[1])
+            start = robots[robot]
+            others = set(robots)
+            others.remove(start)
+            walk = _walk(start, square, parent.floor, parent.boxes.union(others))
+            for step in walk + [d]:
+                actions.append(str(robot) + " " + _DIRECTIONS[step].name)
+        return actions
+
+    def state_string(self):
+        '''Returns a string representation of a state that can be printed to stdout.'''
+        return self.to_state().state_string()
+
+    def print_state(self):
+        '''
+        Prints the string representation of the state.
+        '''
+        print("ACTION was " + self.action)
+        print(self.state_string())
@@ -0,0 +1,39 @@
+'''Offline viewer for search event logs.
+
+    SearchEngine.set_event_log records the trace of a search as one JSON
+    event per line. This module reads such a log back and prints the
+    TRACE text that trace_on would have printed during the search, at any
+    trace level up to the one the log was recorded at.
+
+    Usage: python trace_viewer.py LOGFILE [LEVEL]
+'''
+
+import json
+import sys
+
+from search import render_trace_event
+
+
+def read_events(path):
+    '''Yield the events of the event log at path'''
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def render_log(path, level=1, out=None):
+    '''Write the TRACE text of the event log at path, as printed at the
+       given trace level, to out (default: standard output)'''
+    if out is None:
+        out = sys.stdout
+    for event in read_events(path):
+        if event['level'] <= level:
+            out.write(render_trace_event(event))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python trace_viewer.py LOGFILE [LEVEL]")
+        sys.exit(1)
+    render_log(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1)